@@ -0,0 +1,75 @@
+import argparse
+import contextlib
+import io
+import itertools
+import time
+import src
+from src.config import AppConfig
+
+
+def run_baseline(bot, input_path: str, n: int) -> float:
+    """Throughput khi gọi `chat` lần lượt từng câu (để so với chế độ batch)."""
+    from src.batch import read_questions
+
+    questions = list(itertools.islice(read_questions(input_path), n))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for item in questions:
+            bot.chat(item["question"])
+    elapsed = time.perf_counter() - start
+    return len(questions) / elapsed if elapsed else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trả lời hàng loạt câu hỏi từ file JSONL")
+    parser.add_argument("input", help='JSONL, mỗi dòng {"id": ..., "question": ...}')
+    parser.add_argument("output", help="JSONL kết quả (chạy lại sẽ tiếp tục từ file này)")
+    parser.add_argument("--llm", choices=["stub", "gemini"], default="gemini")
+    parser.add_argument("--concurrency", type=int, default=AppConfig.BATCH_CONCURRENCY)
+    parser.add_argument(
+        "--rate-limit", type=float, default=AppConfig.BATCH_RATE_LIMIT, help="Lời gọi LLM/phút"
+    )
+    parser.add_argument("--batch-size", type=int, default=AppConfig.BATCH_SIZE)
+    parser.add_argument("--max-retries", type=int, default=AppConfig.BATCH_MAX_RETRIES)
+    parser.add_argument("--no-rewrite", action="store_true", help="Bỏ bước viết lại câu hỏi")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument(
+        "--baseline", type=int, default=0, metavar="N",
+        help="Đo thêm throughput của chat() tuần tự trên N câu đầu để so sánh",
+    )
+    args = parser.parse_args()
+
+    from src.batch import BatchQA
+    from src.rag_engine import TrafficLawRAG
+
+    llm = None
+    if args.llm == "stub":
+        from src.llm_stub import StubLLM
+
+        llm = StubLLM()
+    bot = TrafficLawRAG(llm=llm)
+
+    batch = BatchQA(
+        bot,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+        batch_size=args.batch_size,
+        max_retries=args.max_retries,
+        rewrite=not args.no_rewrite,
+    )
+    stats = batch.run(args.input, args.output, limit=args.limit)
+
+    print(
+        f"📊 {stats['answered']} answered, {stats['failed']} failed, "
+        f"{stats['skipped']} skipped (already in output)"
+    )
+    print(f"   cache hits: {stats['cached']} | direct citations: {stats['citation']}")
+    print(f"   throughput: {stats['throughput_qps']:.2f} q/s ({stats['elapsed_s']:.1f}s)")
+    if args.baseline:
+        baseline = run_baseline(bot, args.input, args.baseline)
+        print(f"   chat() loop: {baseline:.2f} q/s on {args.baseline} questions")
+    print(f"   -> 💾 Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
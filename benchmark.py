@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import numpy as np
+import src
+from src.config import AppConfig
+
+# Tên span của TrafficLawRAG (src/telemetry.py)
+STAGES = ["query_rewrite", "scope", "vector_search", "bm25", "fusion", "rerank"]
+
+
+def law_number(text: str) -> str:
+    """'Nghị định 168/2024/NĐ-CP' / '168_2024_ND-CP' -> '168'."""
+    match = re.search(r"\d+", text or "")
+    return match.group(0) if match else ""
+
+
+def first_hit_rank(docs, expected_law: str, expected_article: str):
+    expected_number = law_number(expected_law)
+    for rank, doc in enumerate(docs, start=1):
+        meta = doc.metadata
+        if (
+            law_number(meta.get("law_id", "")) == expected_number
+            and str(meta.get("article")) == str(expected_article)
+        ):
+            return rank
+    return None
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    arr = np.asarray(values) * 1000
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p90_ms": float(np.percentile(arr, 90)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+    }
+
+
+def summarize(rows, ks):
+    summary = {"n": len(rows)}
+    for k in ks:
+        summary[f"recall@{k}"] = float(
+            np.mean([r["rank"] is not None and r["rank"] <= k for r in rows])
+        )
+    summary["mrr"] = float(np.mean([1 / r["rank"] if r["rank"] else 0.0 for r in rows]))
+    summary["hit_rate"] = float(np.mean([r["rank"] is not None for r in rows]))
+    if all("candidates" in r for r in rows):
+        summary["rerank_candidates"] = float(np.mean([r["candidates"] for r in rows]))
+    return summary
+
+
+def run(args):
+    # Tắt cache để đo đúng chi phí từng bước (trừ khi --with-cache)
+    if args.vector_backend:
+        AppConfig.VECTOR_BACKEND = args.vector_backend
+    if args.faiss_index_type:
+        AppConfig.FAISS_INDEX_TYPE = args.faiss_index_type
+    if args.no_scope:
+        AppConfig.SCOPE_INFER = False
+    if args.cutoff_ratio is not None:
+        AppConfig.RERANK_CUTOFF_RATIO = args.cutoff_ratio
+    if args.scope_boost is not None:
+        AppConfig.SCOPE_BOOST = args.scope_boost
+    if not args.with_cache:
+        AppConfig.QUERY_CACHE_PATH = os.path.join(tempfile.mkdtemp(), "bench_cache.sqlite")
+        AppConfig.RERANKER_SCORE_CACHE_SIZE = 0
+        AppConfig.EMBEDDING_QUERY_CACHE_SIZE = 0  # LRU vector câu hỏi của CachedEmbeddings
+
+    from src.rag_engine import TrafficLawRAG
+    from src.telemetry import CollectingSink
+
+    llm = None
+    if args.llm == "stub":
+        from src.llm_stub import StubLLM
+
+        llm = StubLLM()
+    bot = TrafficLawRAG(llm=llm)
+    vector_db = bot.vector_db
+    if AppConfig.VECTOR_BACKEND == "faiss" and vector_db.built_index_type != AppConfig.FAISS_INDEX_TYPE:
+        # Dựng lại index FAISS theo loại cần đo từ vectors.npy (không embed lại)
+        print(f"   -> 🔁 Rebuilding FAISS index as {AppConfig.FAISS_INDEX_TYPE} (in memory)...")
+        vector_db.rebuild_index(AppConfig.FAISS_INDEX_TYPE)
+    spans = CollectingSink()
+    bot.tracer.add_sink(spans)
+
+    with open(args.ground_truth, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    rows = []
+    stage_times = defaultdict(list)
+    total_times = []
+    wall_start = time.perf_counter()
+    for _ in range(args.repeat):
+        for item in questions:
+            start = time.perf_counter()
+            # Ẩn log của pipeline để output benchmark dễ đọc
+            with contextlib.redirect_stdout(io.StringIO()):
+                docs = bot.retrieve_hybrid(item["question"])
+            total_times.append(time.perf_counter() - start)
+            candidates = 0
+            for span in spans.drain():
+                stage_times[span.name].append(span.duration)
+                if span.name == "rerank":
+                    candidates = span.attrs.get("candidates", 0)
+
+            rows.append(
+                {
+                    "id": item["id"],
+                    "type": item.get("type", "unknown"),
+                    "rank": first_hit_rank(docs, item["expected_law"], item["expected_article"]),
+                    "candidates": candidates,
+                    "retrieved": [d.metadata.get("citation") for d in docs],
+                }
+            )
+    wall_time = time.perf_counter() - wall_start
+
+    vector = run_vector_only(bot.vector_db, questions, args)
+
+    by_type = defaultdict(list)
+    for row in rows:
+        by_type[row["type"]].append(row)
+
+    return {
+        "config": {
+            "llm": args.llm,
+            "inference_backend": AppConfig.INFERENCE_BACKEND,
+            "vector_backend": AppConfig.VECTOR_BACKEND,
+            "faiss_index_type": AppConfig.FAISS_INDEX_TYPE,
+            "scope_infer": AppConfig.SCOPE_INFER,
+            "scope_boost": AppConfig.SCOPE_BOOST,
+            "embedding_model": AppConfig.EMBEDDING_MODEL,
+            "reranker_model": AppConfig.RERANKER_MODEL,
+            "retrieval_vector_k": AppConfig.RETRIEVAL_VECTOR_K,
+            "retrieval_bm25_k": AppConfig.RETRIEVAL_BM25_K,
+            "rerank_top_k": AppConfig.RERANK_TOP_K,
+            "rerank_cutoff_ratio": AppConfig.RERANK_CUTOFF_RATIO,
+            "repeat": args.repeat,
+        },
+        "quality": {
+            "overall": summarize(rows, args.k),
+            "by_type": {t: summarize(r, args.k) for t, r in sorted(by_type.items())},
+        },
+        "latency": {
+            "total": percentiles(total_times),
+            "stages": {s: percentiles(stage_times[s]) for s in STAGES if stage_times[s]},
+        },
+        "vector_only": vector,
+        "throughput_qps": len(rows) / wall_time if wall_time else 0.0,
+        # ru_maxrss: KB trên Linux, byte trên macOS
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / (1024 * 1024 if sys.platform == "darwin" else 1024),
+        "questions": rows,
+    }
+
+
+def run_vector_only(vector_db, questions, args):
+    """Recall và độ trễ của riêng vector store trên câu hỏi gốc (không rewrite).
+
+    Đo cả từng query một lần và batch nhiều query (`similarity_search_many`).
+    """
+    texts = [item["question"] for item in questions]
+    k = AppConfig.RETRIEVAL_VECTOR_K
+
+    single_times, rows = [], []
+    for item in questions:
+        start = time.perf_counter()
+        scored = vector_db.similarity_search_with_relevance_scores(item["question"], k=k)
+        single_times.append(time.perf_counter() - start)
+        docs = [doc for doc, _ in scored]
+        rows.append(
+            {"rank": first_hit_rank(docs, item["expected_law"], item["expected_article"])}
+        )
+
+    batch_times = []
+    for start_idx in range(0, len(texts), args.vector_batch):
+        batch = texts[start_idx : start_idx + args.vector_batch]
+        start = time.perf_counter()
+        vector_db.similarity_search_many(batch, k=k)
+        batch_times.append((time.perf_counter() - start) / len(batch))
+
+    return {
+        "quality": summarize(rows, args.k + [k]),
+        "single": percentiles(single_times),
+        "batched_per_query": percentiles(batch_times),
+        "batch_size": args.vector_batch,
+    }
+
+
+def diff(old_path: str, new_path: str):
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{'metric':<28}{'old':>12}{'new':>12}{'delta':>12}")
+    for name, value in new["quality"]["overall"].items():
+        old_value = old["quality"]["overall"].get(name, 0)
+        print(f"{name:<28}{old_value:>12.4f}{value:>12.4f}{value - old_value:>+12.4f}")
+    for stage, stats in [("total", new["latency"]["total"])] + list(
+        new["latency"]["stages"].items()
+    ):
+        old_stats = (
+            old["latency"]["total"]
+            if stage == "total"
+            else old["latency"]["stages"].get(stage, {})
+        )
+        value, old_value = stats.get("p50_ms", 0), old_stats.get("p50_ms", 0)
+        print(f"{stage + ' p50_ms':<28}{old_value:>12.2f}{value:>12.2f}{value - old_value:>+12.2f}")
+    if "vector_only" in old and "vector_only" in new:
+        for name, value in new["vector_only"]["quality"].items():
+            old_value = old["vector_only"]["quality"].get(name, 0)
+            label = f"vector {name}"
+            print(f"{label:<28}{old_value:>12.4f}{value:>12.4f}{value - old_value:>+12.4f}")
+        for mode in ["single", "batched_per_query"]:
+            value = new["vector_only"][mode].get("p50_ms", 0)
+            old_value = old["vector_only"][mode].get("p50_ms", 0)
+            label = f"vector {mode} p50_ms"
+            print(f"{label:<28}{old_value:>12.2f}{value:>12.2f}{value - old_value:>+12.2f}")
+    for name in ["throughput_qps", "peak_rss_mb"]:
+        print(f"{name:<28}{old[name]:>12.2f}{new[name]:>12.2f}{new[name] - old[name]:>+12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval trên ground truth")
+    parser.add_argument(
+        "--ground-truth", default=os.path.join(AppConfig.ROOT_DIR, "data", "ground_truth.json")
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--llm", choices=["stub", "gemini"], default="stub")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--with-cache", action="store_true")
+    # So sánh backend: chạy 2 lần (--vector-backend chroma / faiss) rồi --diff
+    parser.add_argument("--vector-backend", choices=["chroma", "faiss"])
+    # Dựng lại index FAISS (trong RAM) theo loại này nếu snapshot build loại khác
+    parser.add_argument("--faiss-index-type", choices=["flat", "ivf", "hnsw"])
+    parser.add_argument("--vector-batch", type=int, default=32)
+    # So sánh có/không ưu tiên phạm vi suy ra từ câu hỏi, và mức ưu tiên
+    parser.add_argument("--no-scope", action="store_true")
+    parser.add_argument("--scope-boost", type=float)
+    # Chỉnh ngưỡng cắt ứng viên trước rerank (so recall@k / rerank_candidates)
+    parser.add_argument("--cutoff-ratio", type=float)
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.diff:
+        diff(*args.diff)
+        return
+
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    overall = results["quality"]["overall"]
+    print(f"📊 {overall['n']} queries | MRR {overall['mrr']:.3f} | hit rate {overall['hit_rate']:.3f}")
+    for k in args.k:
+        print(f"   recall@{k}: {overall[f'recall@{k}']:.3f}")
+    print(f"   p50 total: {results['latency']['total']['p50_ms']:.1f} ms")
+    vector = results["vector_only"]
+    print(
+        f"   vector ({AppConfig.VECTOR_BACKEND}): recall@{AppConfig.RETRIEVAL_VECTOR_K} "
+        f"{vector['quality'][f'recall@{AppConfig.RETRIEVAL_VECTOR_K}']:.3f} | "
+        f"p50 {vector['single']['p50_ms']:.1f} ms, batched {vector['batched_per_query']['p50_ms']:.1f} ms/q"
+    )
+    print(f"   throughput: {results['throughput_qps']:.2f} q/s | peak RSS {results['peak_rss_mb']:.0f} MB")
+    print(f"   -> 💾 Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
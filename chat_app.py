@@ -14,12 +14,13 @@ def main():
     console.print("-" * 50)
 
     try:
-        bot = TrafficLawRAG()
+        # Load model/index nền trong lúc người dùng gõ câu hỏi đầu tiên
+        bot = TrafficLawRAG(lazy=True)
     except Exception as e:
         console.print(f"❌ [red]Init Error:[/red] {e}")
         return
 
-    console.print("\n✅ [bold blue]Ready! Type 'exit' to quit.[/bold blue]")
+    console.print("\n✅ [bold blue]Type your question ('exit' to quit).[/bold blue]")
 
     while True:
         query = console.input("\n👤 [bold yellow]Bạn:[/bold yellow] ").strip()
@@ -29,6 +30,9 @@ def main():
             continue
 
         try:
+            if not bot.ready.is_set():
+                with console.status("⏳ Đang tải mô hình và chỉ mục..."):
+                    bot.wait_until_ready()
             answer, sources = bot.chat(query)
 
             console.print(Panel(Markdown(answer), title="🤖 Bot", border_style="cyan"))
@@ -1,61 +1,104 @@
 import sys
 import json
 import csv
+import itertools
 import os
 import src
 from src.ingestion import VietnameseLawParser
 from src.indexing import Indexer
+from src.snapshots import building_snapshot
 from src.config import AppConfig
 
 
-def save_debug_data(documents):
-    json_path = os.path.join(AppConfig.DATA_PROCESSED_DIR, "processed_chunks.json")
+def stream_debug_data(documents, parquet: bool = False):
+    """Ghi chunk ra JSONL + CSV (hoặc Parquet) trong lúc chuyển tiếp cho bước index."""
+    jsonl_path = os.path.join(AppConfig.DATA_PROCESSED_DIR, "processed_chunks.jsonl")
     csv_path = os.path.join(AppConfig.DATA_PROCESSED_DIR, "processed_chunks.csv")
 
-    data_export = [
-        {"content": d.page_content, "metadata": d.metadata} for d in documents
-    ]
+    parquet_writer, rows = None, []
+    if parquet:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
 
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(data_export, f, ensure_ascii=False, indent=2)
+        schema = pa.schema([("content", pa.string()), ("metadata", pa.string())])
+        parquet_writer = pq.ParquetWriter(
+            os.path.join(AppConfig.DATA_PROCESSED_DIR, "processed_chunks.parquet"), schema
+        )
 
-    with open(csv_path, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.writer(f)
+    def flush_parquet():
+        if parquet_writer is not None and rows:
+            parquet_writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            rows.clear()
+
+    with open(jsonl_path, "w", encoding="utf-8") as jsonl_file, open(
+        csv_path, "w", newline="", encoding="utf-8-sig"
+    ) as csv_file:
+        writer = csv.writer(csv_file)
         writer.writerow(["Article ID", "Citation", "Content"])
-        for doc in documents:
-            writer.writerow(
-                [
-                    doc.metadata.get("article", ""),
-                    doc.metadata.get("citation", ""),
-                    doc.page_content,
-                ]
-            )
+        try:
+            for doc in documents:
+                jsonl_file.write(
+                    json.dumps(
+                        {"content": doc.page_content, "metadata": doc.metadata},
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                )
+                writer.writerow(
+                    [
+                        doc.metadata.get("article", ""),
+                        doc.metadata.get("citation", ""),
+                        doc.page_content,
+                    ]
+                )
+                if parquet_writer is not None:
+                    rows.append(
+                        {
+                            "content": doc.page_content,
+                            "metadata": json.dumps(doc.metadata, ensure_ascii=False),
+                        }
+                    )
+                    if len(rows) >= AppConfig.INDEXING_BATCH_SIZE:
+                        flush_parquet()
+                yield doc
+        finally:
+            flush_parquet()
+            if parquet_writer is not None:
+                parquet_writer.close()
 
     print(f"   -> 💾 Debug data saved to {AppConfig.DATA_PROCESSED_DIR}")
 
 
 def main():
+    # --full: xoá index cũ và embed lại toàn bộ thay vì cập nhật incremental
+    full_rebuild = "--full" in sys.argv[1:]
+    # --parquet: ghi thêm processed_chunks.parquet (cần pyarrow)
+    parquet = "--parquet" in sys.argv[1:]
+
     print("🚀 STARTING ETL PIPELINE")
     print("-" * 50)
 
-    # 1. Ingestion
+    # 1. Ingestion (generator: parse từng file khi bước index cần tới)
     parser = VietnameseLawParser()
-    docs = parser.load_and_parse()
+    docs = parser.iter_documents()
 
-    if not docs:
+    first = next(docs, None)
+    if first is None:
         print("❌ No documents found. Check 'data/raw' folder.")
         return
 
-    save_debug_data(docs)
+    docs = stream_debug_data(itertools.chain([first], docs), parquet=parquet)
 
-    # 2. Indexing
+    # 2. Indexing (embed + ghi index theo batch trong lúc đang parse)
     print("\n🏗️  STARTING INDEXING")
     indexer = Indexer()
     try:
-        indexer.build_indices(docs)
+        indexer.build_indices(docs, full_rebuild=full_rebuild)
         print("\n🎉 SETUP COMPLETE! Run 'python chat_app.py' to start.")
     except Exception as e:
         print(f"\n❌ Indexing Error: {e}")
+        if os.path.exists(building_snapshot().checkpoint_path):
+            print("   -> ⏯️  Chạy lại 'python main.py' để tiếp tục từ checkpoint.")
 
 
 if __name__ == "__main__":
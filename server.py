@@ -0,0 +1,78 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import httpx
+import src
+from src.config import AppConfig
+
+
+def start_model_server(host: str, port: int) -> subprocess.Popen:
+    """Chạy `python -m src.model_server` và chờ tới khi model load xong."""
+    print(f"🧠 Starting model server on {host}:{port}...")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.model_server", "--host", host, "--port", str(port)],
+        cwd=AppConfig.ROOT_DIR,
+    )
+    url = f"http://{host}:{port}"
+    deadline = time.monotonic() + AppConfig.MODEL_SERVER_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"❌ Model server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=2.0).status_code == 200:
+                print(f"   -> ✅ Model server ready: {url}")
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(1.0)
+    process.terminate()
+    raise TimeoutError("❌ Model server did not become ready in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API (SSE) cho chatbot luật giao thông")
+    parser.add_argument("--host", default=AppConfig.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=AppConfig.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=AppConfig.SERVER_WORKERS)
+    parser.add_argument("--llm", choices=["stub", "gemini"], default=AppConfig.SERVER_LLM)
+    parser.add_argument(
+        "--model-server", default=AppConfig.MODEL_SERVER_URL, metavar="URL",
+        help="Dùng model server có sẵn (mặc định: tự chạy khi --workers > 1)",
+    )
+    parser.add_argument(
+        "--no-model-server", action="store_true",
+        help="Mỗi worker tự load embedding + reranker",
+    )
+    args = parser.parse_args()
+
+    import uvicorn
+
+    model_server = None
+    url = None if args.no_model_server else args.model_server
+    if not url and not args.no_model_server and args.workers > 1:
+        model_server = start_model_server(AppConfig.MODEL_SERVER_HOST, AppConfig.MODEL_SERVER_PORT)
+        url = f"http://{AppConfig.MODEL_SERVER_HOST}:{AppConfig.MODEL_SERVER_PORT}"
+
+    # Worker là process mới, đọc cấu hình qua biến môi trường (AppConfig)
+    # ("" thay vì xoá biến để .env không đặt lại)
+    os.environ["SERVER_LLM"] = args.llm
+    os.environ["MODEL_SERVER_URL"] = url or ""
+
+    try:
+        uvicorn.run(
+            "src.api:create_app",
+            factory=True,
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+        )
+    finally:
+        if model_server is not None:
+            model_server.terminate()
+            model_server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from src.config import AppConfig
+from src.facets import normalize_filters
+from src.telemetry import PrometheusSink
+
+
+class Overloaded(Exception):
+    """Hàng đợi đầy hoặc chờ slot quá lâu -> 503."""
+
+
+class Admission:
+    """Giới hạn request xử lý đồng thời + hàng đợi có giới hạn (mỗi worker).
+
+    Tối đa `max_active` request chạy cùng lúc; tối đa `max_queue` request chờ
+    slot, mỗi request chờ không quá `queue_timeout` giây. Ngoài giới hạn thì
+    từ chối ngay thay vì để độ trễ của mọi request cùng tăng.
+    """
+
+    def __init__(
+        self,
+        max_active: int = AppConfig.SERVER_MAX_ACTIVE,
+        max_queue: int = AppConfig.SERVER_MAX_QUEUE,
+        queue_timeout: float = AppConfig.SERVER_QUEUE_TIMEOUT,
+    ):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_active)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        if not self._slots.locked():
+            await self._slots.acquire()  # Còn slot: lấy ngay, không nhường event loop
+        elif self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("queue full")
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded("queue timeout")
+            finally:
+                self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def render(self) -> str:
+        return (
+            "# TYPE rag_server_active_requests gauge\n"
+            f"rag_server_active_requests {self.active}\n"
+            "# TYPE rag_server_queued_requests gauge\n"
+            f"rag_server_queued_requests {self.waiting}\n"
+            "# TYPE rag_server_rejected_total counter\n"
+            f"rag_server_rejected_total {self.rejected}\n"
+        )
+
+
+class AdmittedStream(StreamingResponse):
+    """StreamingResponse giữ một slot của Admission, trả slot khi response kết
+    thúc theo bất kỳ cách nào.
+
+    Không trả trong `finally` của generator: client ngắt trước khi generator
+    chạy lần đầu thì `finally` không bao giờ được gọi (và Starlette bỏ qua
+    background task khi ClientDisconnect).
+    """
+
+    def __init__(self, content, admission: "Admission", **kwargs):
+        super().__init__(content, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.admission.release()
+
+
+class QuestionRequest(BaseModel):
+    question: str
+    # Như TrafficLawRAG.chat: None = suy ra từ câu hỏi, {} = toàn bộ corpus
+    filters: Optional[Dict] = None
+
+
+def source_dict(doc) -> Dict:
+    return {
+        "citation": doc.metadata.get("citation", "N/A"),
+        "chunk_id": doc.metadata.get("chunk_id"),
+        "score": doc.metadata.get("rerank_score"),
+        "content": doc.page_content,
+        "metadata": doc.metadata,
+    }
+
+
+def sse(event: str, data: Dict) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def _load_llm(name: str):
+    if name == "stub":
+        from src.llm_stub import StubLLM
+
+        return StubLLM()
+    return None  # Gemini (TrafficLawRAG tự load)
+
+
+def create_app(
+    engine=None, llm: str = AppConfig.SERVER_LLM, admission: Optional[Admission] = None
+) -> FastAPI:
+    """App HTTP quanh TrafficLawRAG.
+
+    - POST /chat: stream câu trả lời qua SSE (event token*, citations, done);
+      ?stream=false -> JSON một lần.
+    - POST /retrieve: chỉ retrieval + rerank, không sinh câu trả lời.
+    - GET /health (sống), /ready (model + index đã load), /metrics (Prometheus).
+    engine=None: tạo TrafficLawRAG lúc khởi động (load nền, /ready báo khi xong).
+    admission=None: giới hạn theo SERVER_MAX_ACTIVE / SERVER_MAX_QUEUE.
+    """
+    state = {"engine": engine}
+    admission = admission or Admission()
+
+    @asynccontextmanager
+    async def lifespan(app):
+        owns_engine = state["engine"] is None
+        if owns_engine:
+            from src.rag_engine import TrafficLawRAG
+
+            state["engine"] = TrafficLawRAG(llm=_load_llm(llm), lazy=True)
+        yield
+        if owns_engine:
+            state["engine"].close()
+
+    app = FastAPI(title="Traffic Law RAG", lifespan=lifespan)
+
+    def ready_engine():
+        bot = state["engine"]
+        if bot is None or not bot.ready.is_set():
+            raise HTTPException(status_code=503, detail="loading", headers={"Retry-After": "5"})
+        if bot.startup_error is not None:
+            raise HTTPException(status_code=503, detail=f"startup failed: {bot.startup_error}")
+        return bot
+
+    def check_filters(request: QuestionRequest):
+        # Báo lỗi bộ lọc trước khi nhận request (stream đã bắt đầu thì chỉ còn event lỗi)
+        try:
+            normalize_filters(request.filters or {})
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    def overloaded(e: Overloaded):
+        return HTTPException(status_code=503, detail=f"overloaded: {e}", headers={"Retry-After": "1"})
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/ready")
+    async def ready():
+        bot = ready_engine()
+        return {"status": "ready", "index_version": bot.index_version}
+
+    @app.get("/metrics")
+    async def metrics():
+        text = admission.render()
+        bot = state["engine"]
+        sink = bot.tracer.get_sink(PrometheusSink) if bot is not None else None
+        if sink is not None:
+            text = sink.render() + text
+        return PlainTextResponse(text)
+
+    @app.post("/retrieve")
+    async def retrieve(request: QuestionRequest):
+        bot = ready_engine()
+        check_filters(request)
+        try:
+            async with admission.slot():
+                docs = await asyncio.wait_for(
+                    bot.aretrieve_hybrid(request.question, request.filters),
+                    AppConfig.SERVER_REQUEST_TIMEOUT,
+                )
+        except Overloaded as e:
+            raise overloaded(e)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="timeout")
+        return {"documents": [source_dict(d) for d in docs], "index_version": bot.index_version}
+
+    @app.post("/chat")
+    async def chat(request: QuestionRequest, stream: bool = True):
+        bot = ready_engine()
+        check_filters(request)
+        if not stream:
+            try:
+                async with admission.slot():
+                    answer, docs = await asyncio.wait_for(
+                        bot.achat(request.question, request.filters),
+                        AppConfig.SERVER_REQUEST_TIMEOUT,
+                    )
+            except Overloaded as e:
+                raise overloaded(e)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail="timeout")
+            return {"answer": answer, "citations": [source_dict(d) for d in docs]}
+
+        # Lấy slot trước khi trả header để request bị từ chối nhận 503 thật
+        try:
+            await admission.acquire()
+        except Overloaded as e:
+            raise overloaded(e)
+        return AdmittedStream(
+            _stream_answer(bot, request),
+            admission,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    return app
+
+
+async def _stream_answer(bot, request: QuestionRequest):
+    """Sinh các event SSE (slot do AdmittedStream trả)."""
+    started = time.perf_counter()
+    try:
+        # asyncio.timeout (không tạo task mới) để contextvar của trace giữ nguyên
+        async with asyncio.timeout(AppConfig.SERVER_REQUEST_TIMEOUT):
+            async for kind, value in bot.astream_chat(request.question, request.filters):
+                if kind == "token":
+                    yield sse("token", {"text": value})
+                else:
+                    yield sse("citations", {"citations": [source_dict(d) for d in value]})
+        yield sse(
+            "done",
+            {
+                "index_version": bot.index_version,
+                "elapsed_s": round(time.perf_counter() - started, 3),
+            },
+        )
+    except TimeoutError:
+        yield sse("error", {"error": "timeout"})
+    except Exception as e:
+        yield sse("error", {"error": f"{type(e).__name__}: {e}"})
@@ -0,0 +1,294 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+from src.config import AppConfig
+from src.context import build_context
+
+NO_DOCS_ANSWER = "Xin lỗi, không tìm thấy tài liệu liên quan."
+
+
+def read_questions(path: str) -> Iterator[Dict]:
+    """Đọc câu hỏi từ JSONL: mỗi dòng {"id", "question"} (hoặc "query"/"body"),
+    tuỳ chọn "filters" như `TrafficLawRAG.retrieve_hybrid`.
+
+    Dòng không có id dùng số dòng làm id.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            question = row.get("question") or row.get("query") or row.get("body")
+            if not question:
+                print(f"   ⚠️ Line {line_no}: no question, skipped")
+                continue
+            yield {
+                "id": str(row.get("id") or row.get("request_id") or line_no),
+                "question": question,
+                "filters": row.get("filters"),
+            }
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Id đã có câu trả lời trong file output (checkpoint để chạy tiếp)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:  # Dòng ghi dở khi bị ngắt
+                continue
+            if row.get("error") is None:
+                done.add(str(row["id"]))
+    return done
+
+
+class RateLimiter:
+    """Giãn đều các lời gọi LLM để không vượt `per_minute` lời gọi mỗi phút."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class BatchQA:
+    """Trả lời hàng loạt câu hỏi offline trên một TrafficLawRAG.
+
+    - Retrieval theo lô BATCH_SIZE câu: embed mọi câu hỏi trong một lần gọi
+      (`similarity_search_many`), BM25 + fusion từng câu, rồi rerank mọi cặp
+      của cả lô trong một lần (`Reranker.rank_many`).
+    - Sinh câu trả lời đồng thời (tối đa `concurrency` lời gọi), giới hạn
+      `rate_limit` lời gọi/phút, thử lại với exponential backoff.
+    - Retrieval lô sau chạy song song với generation của lô trước.
+    - Mỗi câu trả lời được ghi ngay vào JSONL; chạy lại với cùng file output
+      sẽ bỏ qua các câu đã trả lời (câu lỗi được thử lại).
+    """
+
+    def __init__(
+        self,
+        engine,
+        concurrency: int = AppConfig.BATCH_CONCURRENCY,
+        rate_limit: float = AppConfig.BATCH_RATE_LIMIT,
+        batch_size: int = AppConfig.BATCH_SIZE,
+        max_retries: int = AppConfig.BATCH_MAX_RETRIES,
+        rewrite: bool = True,
+    ):
+        self.engine = engine
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.rewrite = rewrite
+
+    def run(self, input_path: str, output_path: str, limit: Optional[int] = None) -> Dict:
+        return asyncio.run(self.arun(input_path, output_path, limit))
+
+    async def arun(self, input_path: str, output_path: str, limit: Optional[int] = None) -> Dict:
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = RateLimiter(self.rate_limit)
+        stats = {"answered": 0, "failed": 0, "skipped": 0, "cached": 0, "citation": 0}
+
+        started = time.perf_counter()
+        # Cả lượt chạy dùng một snapshot index (đổi snapshot giữa chừng không ảnh hưởng)
+        with self.engine.pin_index():
+            done = completed_ids(output_path)
+            questions: Iterable[Dict] = read_questions(input_path)
+            if limit is not None:
+                questions = itertools.islice(questions, limit)
+
+            pending: Set[asyncio.Task] = set()
+            with open(output_path, "a", encoding="utf-8") as out:
+                for batch in self._batches(questions, done, stats):
+                    items = await self._retrieve(batch, stats)
+                    for item in items:
+                        pending.add(asyncio.create_task(self._answer(item, out, stats)))
+                    # Back-pressure: không retrieve quá xa so với generation
+                    while len(pending) >= self.batch_size:
+                        _, pending = await asyncio.wait(
+                            pending, return_when=asyncio.FIRST_COMPLETED
+                        )
+                    print(
+                        f"   -> 📦 {stats['answered'] + stats['failed']} answered, "
+                        f"{len(pending)} generating ({time.perf_counter() - started:.1f}s)"
+                    )
+                if pending:
+                    await asyncio.wait(pending)
+
+        stats["elapsed_s"] = time.perf_counter() - started
+        processed = stats["answered"] + stats["failed"]
+        stats["throughput_qps"] = processed / stats["elapsed_s"] if stats["elapsed_s"] else 0.0
+        return stats
+
+    def _batches(self, questions: Iterable[Dict], done: Set[str], stats: Dict) -> Iterator[List[Dict]]:
+        batch = []
+        for item in questions:
+            if item["id"] in done:
+                stats["skipped"] += 1
+                continue
+            done.add(item["id"])  # id trùng trong input chỉ trả lời một lần
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # --- Retrieval theo lô ---
+    async def _retrieve(self, batch: List[Dict], stats: Dict) -> List[Dict]:
+        engine = self.engine
+        for item in batch:
+            item["search_query"] = item["question"]
+            item["cached"] = None
+            if item["filters"] is None:
+                item["cached"] = await engine._run_blocking(
+                    engine.answer_cache.get, item["question"]
+                )
+        todo = [item for item in batch if item["cached"] is None]
+
+        if self.rewrite:
+            queries = await asyncio.gather(*(self._rewrite(item["question"]) for item in todo))
+            for item, query in zip(todo, queries):
+                item["search_query"] = query
+
+        with engine.tracer.span("batch_retrieval", questions=len(todo)):
+            await engine._run_blocking(self._retrieve_docs, todo, stats)
+        return batch
+
+    def _retrieve_docs(self, items: List[Dict], stats: Dict):
+        engine = self.engine
+        searched, cited = [], []
+        for item in items:
+            item["docs"], needs_rerank = [], False
+            if engine.citation_index is not None:
+                item["docs"], needs_rerank = engine.citation_index.lookup(
+                    item["question"], engine.chunk_store
+                )
+            if item["docs"]:
+                stats["citation"] += 1
+                if needs_rerank:  # Cả Điều + câu hỏi nội dung: rerank chung lô
+                    cited.append(item)
+            else:
+                searched.append(item)
+        if not searched and not cited:
+            return
+
+        # (bộ lọc cứng, phạm vi ưu tiên) của từng câu hỏi
+        scopes = [engine._scope(item["question"], item["filters"]) for item in searched]
+        vector_results = engine.vector_db.similarity_search_many(
+            [item["search_query"] for item in searched],
+            k=AppConfig.RETRIEVAL_VECTOR_K,
+            filters=[scope for scope, _ in scopes],
+        )
+        candidates = []
+        for item, (scope, boost), docs_vector in zip(searched, scopes, vector_results):
+            docs_bm25 = engine.lexical_index.search(item["search_query"], filters=scope)
+            merged_docs, cutoff = engine._fuse_candidates(docs_vector, docs_bm25, boost)
+            candidates.append(merged_docs[:cutoff])
+
+        candidates += [item["docs"] for item in cited]
+        reranked = searched + cited
+        ranked = engine.reranker.rank_many([item["question"] for item in reranked], candidates)
+        for item, docs in zip(reranked, ranked):
+            item["docs"] = docs
+
+    async def _rewrite(self, question: str) -> str:
+        engine = self.engine
+        cached = await engine._run_blocking(engine.rewrite_cache.get, question)
+        if cached is not None:
+            return cached
+        try:
+            async with self._semaphore:
+                response, _ = await self._invoke(
+                    engine.query_transform_prompt | engine.llm, {"question": question}
+                )
+        except Exception as e:
+            print(f"   ⚠️ Error expanding query: {e}. Using original.")
+            return question
+        legal_query = response.content.strip()
+        await engine._run_blocking(engine.rewrite_cache.set, question, legal_query)
+        return legal_query
+
+    # --- Generation ---
+    async def _answer(self, item: Dict, out, stats: Dict):
+        engine = self.engine
+        record = {"id": item["id"], "question": item["question"], "error": None}
+        if item["cached"] is not None:
+            stats["cached"] += 1
+            record.update(
+                answer=item["cached"]["answer"],
+                citations=[d["metadata"].get("citation") for d in item["cached"]["sources"]],
+                chunk_ids=[d["metadata"].get("chunk_id") for d in item["cached"]["sources"]],
+                cached=True,
+            )
+            return self._write(out, record, stats)
+
+        # Chỉ document nằm trong context mới là nguồn của câu trả lời
+        context_text, context_stats, docs = build_context(item["docs"], engine.chunk_store)
+        record.update(
+            search_query=item["search_query"],
+            citations=[d.metadata.get("citation") for d in docs],
+            chunk_ids=[d.metadata.get("chunk_id") for d in docs],
+            cached=False,
+        )
+        if not docs:
+            record["answer"] = NO_DOCS_ANSWER
+            return self._write(out, record, stats)
+
+        record["context_tokens"] = context_stats["tokens"]
+        try:
+            async with self._semaphore:
+                response, attempts = await self._invoke(
+                    engine.answer_prompt | engine.llm,
+                    {"context": context_text, "question": item["question"]},
+                )
+        except Exception as e:
+            record.update(answer=None, error=str(e))
+            return self._write(out, record, stats)
+
+        record.update(answer=response.content, attempts=attempts)
+        if item["filters"] is None:
+            await engine._run_blocking(
+                engine._store_answer, item["question"], response.content, docs
+            )
+        self._write(out, record, stats)
+
+    async def _invoke(self, chain, inputs: Dict):
+        """Gọi LLM (đã qua rate limit), thử lại tối đa `max_retries` lần."""
+        for attempt in range(self.max_retries + 1):
+            await self._limiter.acquire()
+            try:
+                return await chain.ainvoke(inputs), attempt + 1
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                # Exponential backoff + jitter để các lời gọi lỗi không dội lại cùng lúc
+                delay = min(
+                    AppConfig.BATCH_BACKOFF_BASE * 2**attempt * (1 + random.random()),
+                    AppConfig.BATCH_BACKOFF_MAX,
+                )
+                print(f"   ⚠️ LLM error ({e}), retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _write(out, record: Dict, stats: Dict):
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        stats["failed" if record["error"] else "answered"] += 1
@@ -0,0 +1,230 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+import numpy as np
+from src.config import AppConfig
+from src.snapshots import current_version
+
+
+def normalize_query(query: str) -> str:
+    """'  Vượt đèn đỏ phạt bao nhiêu?? ' -> 'vượt đèn đỏ phạt bao nhiêu'."""
+    query = unicodedata.normalize("NFC", query).lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" ?.!,;:")
+
+
+def read_index_version(manifest_path: Optional[str] = None) -> str:
+    """Version của index (mặc định: snapshot CURRENT; đổi mỗi khi build có thay đổi)."""
+    if manifest_path is None:
+        return current_version()
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("version", "")
+    except (OSError, ValueError):
+        return ""
+
+
+class QueryCache:
+    """Cache 2 tầng cho kết quả theo câu hỏi (query rewrite, câu trả lời).
+
+    - Tầng 1: khớp chính xác trên câu hỏi đã chuẩn hoá. LRU trong RAM, ghi
+      xuống SQLite để giữ qua các lần restart; có TTL và giới hạn số entry.
+    - Tầng 2 (tuỳ chọn): nếu có `embedding_model` và `semantic_threshold`,
+      dùng lại entry có embedding câu hỏi gần nhất với cosine >= ngưỡng.
+
+    Mọi entry gắn với `index_version` (nằm trong khoá chính): chỉ đọc entry
+    cùng version. Entry của version khác được giữ lại (engine tạo cache mới
+    khi đổi snapshot, rollback về snapshot cũ dùng lại được) và chỉ bị dọn
+    theo TTL hoặc LRU: `max_size` giới hạn số dòng của namespace trên mọi
+    version, dòng truy cập lâu nhất bị xoá trước. SQLite chạy ở chế độ WAL
+    để nhiều worker process đọc/ghi cùng file.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        db_path: Optional[str] = None,
+        index_version: str = "",
+        max_size: int = AppConfig.QUERY_CACHE_MAX_SIZE,
+        ttl: float = AppConfig.QUERY_CACHE_TTL,
+        embedding_model=None,
+        semantic_threshold: Optional[float] = AppConfig.SEMANTIC_CACHE_THRESHOLD,
+    ):
+        db_path = db_path or AppConfig.QUERY_CACHE_PATH  # Đọc lúc tạo (test/benchmark đổi được)
+        self.namespace = namespace
+        self.index_version = index_version
+        self.max_size = max_size
+        self.ttl = ttl
+        self.embedding_model = embedding_model if semantic_threshold else None
+        self.semantic_threshold = semantic_threshold
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._sem_keys = []
+        self._sem_vectors = []
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(
+            db_path, timeout=AppConfig.QUERY_CACHE_BUSY_TIMEOUT, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_table()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM query_cache WHERE namespace = ? AND created_at < ?",
+                (namespace, time.time() - ttl),
+            )
+            self._evict()
+            self._conn.commit()
+
+        if self.embedding_model is not None:
+            rows = self._conn.execute(
+                "SELECT key, embedding FROM query_cache"
+                " WHERE namespace = ? AND index_version = ? AND embedding IS NOT NULL",
+                (namespace, index_version),
+            ).fetchall()
+            for key, blob in rows:
+                self._sem_keys.append(key)
+                self._sem_vectors.append(np.frombuffer(blob, dtype=np.float32))
+
+    def _create_table(self):
+        # Khoá ghi trước khi kiểm tra schema: nhiều cache (thread/process) có
+        # thể mở cùng file một lúc
+        self._conn.execute("BEGIN IMMEDIATE")
+        # Bảng cũ có khoá chính (namespace, key): chỉ là cache nên tạo lại
+        pk = [
+            row[1]
+            for row in sorted(self._conn.execute("PRAGMA table_info(query_cache)"), key=lambda r: r[5])
+            if row[5]
+        ]
+        if pk and pk != ["namespace", "index_version", "key"]:
+            self._conn.execute("DROP TABLE query_cache")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache ("
+            " namespace TEXT, index_version TEXT, key TEXT, value TEXT,"
+            " embedding BLOB, created_at REAL, last_access REAL,"
+            " PRIMARY KEY (namespace, index_version, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS query_cache_lru ON query_cache (namespace, last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, query: str) -> Optional[Any]:
+        key = normalize_query(query)
+        with self._lock:
+            value = self._get_exact(key)
+        if value is not None or self.embedding_model is None:
+            return value
+
+        # Tầng 2: semantic
+        match_key = self._nearest(query)
+        if match_key is None:
+            return None
+        with self._lock:
+            return self._get_exact(match_key)
+
+    def set(self, query: str, value: Any):
+        key = normalize_query(query)
+        now = time.time()
+        embedding = None
+        if self.embedding_model is not None:
+            embedding = np.asarray(self.embedding_model.embed_query(key), dtype=np.float32)
+
+        with self._lock:
+            self._memory[key] = (value, now)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.namespace,
+                    self.index_version,
+                    key,
+                    json.dumps(value, ensure_ascii=False),
+                    embedding.tobytes() if embedding is not None else None,
+                    now,
+                    now,
+                ),
+            )
+            if embedding is not None and key not in self._sem_keys:
+                self._sem_keys.append(key)
+                self._sem_vectors.append(embedding)
+            self._evict()
+            self._conn.commit()
+
+    def _get_exact(self, key: str) -> Optional[Any]:
+        now = time.time()
+        if key in self._memory:
+            value, created_at = self._memory[key]
+            if now - created_at <= self.ttl:
+                self._memory.move_to_end(key)
+                return value
+            del self._memory[key]
+
+        row = self._conn.execute(
+            "SELECT value, created_at FROM query_cache"
+            " WHERE namespace = ? AND key = ? AND index_version = ?",
+            (self.namespace, key, self.index_version),
+        ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+
+        self._conn.execute(
+            "UPDATE query_cache SET last_access = ?"
+            " WHERE namespace = ? AND index_version = ? AND key = ?",
+            (now, self.namespace, self.index_version, key),
+        )
+        self._conn.commit()
+        value = json.loads(row[0])
+        self._memory[key] = (value, row[1])
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+        return value
+
+    def _nearest(self, query: str) -> Optional[str]:
+        with self._lock:
+            if not self._sem_vectors:
+                return None
+            keys = list(self._sem_keys)
+            matrix = np.vstack(self._sem_vectors)
+        vec = np.asarray(
+            self.embedding_model.embed_query(normalize_query(query)), dtype=np.float32
+        )
+        sims = matrix @ vec / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(vec) + 1e-9)
+        best = int(np.argmax(sims))
+        return keys[best] if sims[best] >= self.semantic_threshold else None
+
+    def _evict(self):
+        """Giữ tối đa max_size dòng của namespace (mọi version), xoá theo LRU."""
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM query_cache WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        if count <= self.max_size:
+            return
+        evicted = self._conn.execute(
+            "SELECT index_version, key FROM query_cache WHERE namespace = ?"
+            " ORDER BY last_access LIMIT ?",
+            (self.namespace, count - self.max_size),
+        ).fetchall()
+        self._conn.executemany(
+            "DELETE FROM query_cache WHERE namespace = ? AND index_version = ? AND key = ?",
+            [(self.namespace, version, k) for version, k in evicted],
+        )
+        evicted = {k for version, k in evicted if version == self.index_version}
+        keep = [i for i, k in enumerate(self._sem_keys) if k not in evicted]
+        self._sem_keys = [self._sem_keys[i] for i in keep]
+        self._sem_vectors = [self._sem_vectors[i] for i in keep]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
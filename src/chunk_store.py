@@ -0,0 +1,218 @@
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+from langchain_core.documents import Document
+from src.config import AppConfig
+
+
+class ChunkStore:
+    """Lưu cây Điều > Khoản > Điểm, mỗi đoạn text chỉ lưu một lần.
+
+    Parser emit chunk Khoản (parent, chứa mọi Điểm) và chunk Điểm (child,
+    lặp lại header + phần mở đầu của Khoản). Store tách chúng thành:
+      - article: header "Tên luật > Điều x. Tiêu đề"
+      - clause:  "Khoản x: ..." + con trỏ tới article và danh sách Điểm
+      - point:   "Điểm a) ..." + con trỏ tới clause
+    và dựng lại đúng page_content gốc khi cần (render).
+    """
+
+    def __init__(self, nodes: Optional[Dict[str, Dict]] = None):
+        self.nodes: Dict[str, Dict] = nodes or {}
+        self._article_ids: Dict[tuple, str] = {}
+
+    # --- Build ---
+    @classmethod
+    def from_documents(cls, documents: List[Document]) -> "ChunkStore":
+        store = cls()
+        store.add_documents(documents)
+        return store
+
+    def add_documents(self, documents: List[Document]) -> List[str]:
+        """Thêm các chunk của một hay nhiều Khoản trọn vẹn (Khoản + mọi Điểm).
+
+        Trả về node_id của các Khoản/Điểm vừa thêm, để build có thể stream
+        từng nhóm nhỏ thay vì giữ toàn bộ corpus.
+        """
+        added: List[str] = []
+        children: Dict[str, List[Document]] = {}
+        for doc in documents:
+            if not doc.metadata["is_parent"]:
+                children.setdefault(doc.metadata["parent_id"], []).append(doc)
+
+        for doc in documents:
+            meta = doc.metadata
+            if not meta["is_parent"]:
+                continue
+
+            header, body = doc.page_content.split("\n", 1)
+            article_key = (meta["law_id"], meta["article"], header)
+            if article_key not in self._article_ids:
+                base_id = f"{meta['law_id']}|{meta['article']}"
+                article_id, n = base_id, 1
+                while article_id in self.nodes:
+                    n += 1
+                    article_id = f"{base_id}#{n}"
+                self._article_ids[article_key] = article_id
+                self.nodes[article_id] = {
+                    "level": "article",
+                    "parent": None,
+                    "text": header,
+                    "children": [],
+                    "metadata": {
+                        k: meta[k] for k in ("doc_type", "law_name", "law_id", "article")
+                    },
+                }
+            article_id = self._article_ids[article_key]
+            self.nodes[article_id]["children"].append(meta["chunk_id"])
+
+            points = children.get(meta["chunk_id"], [])
+            prefix_len = self._clause_prefix_len(doc, points)
+            self.nodes[meta["chunk_id"]] = {
+                "level": "clause",
+                "parent": article_id,
+                "text": doc.page_content[len(header) + 1 : prefix_len],
+                "children": [p.metadata["chunk_id"] for p in points],
+                "metadata": dict(meta),
+            }
+            added.append(meta["chunk_id"])
+            for point in points:
+                self.nodes[point.metadata["chunk_id"]] = {
+                    "level": "point",
+                    "parent": meta["chunk_id"],
+                    "text": point.page_content[prefix_len + 1 :],
+                    "children": [],
+                    "metadata": dict(point.metadata),
+                }
+                added.append(point.metadata["chunk_id"])
+        return added
+
+    @staticmethod
+    def iter_groups(documents: Iterable[Document]) -> Iterator[List[Document]]:
+        """Cắt stream chunk của parser thành từng nhóm [Khoản, Điểm...]."""
+        group: List[Document] = []
+        for doc in documents:
+            if doc.metadata["is_parent"] and group:
+                yield group
+                group = []
+            group.append(doc)
+        if group:
+            yield group
+
+    @staticmethod
+    def _clause_prefix_len(parent: Document, points: List[Document]) -> int:
+        """Độ dài phần chung "header\nKhoản x: ..." của Khoản và các Điểm.
+
+        parent = prefix + Σ("\n" + điểm_i), child_i = prefix + "\n" + điểm_i
+        => len(prefix) = (Σ len(child_i) - len(parent)) / (n - 1). Nội dung
+        Điểm có thể chứa xuống dòng (w:br) nên không tách theo dòng được.
+        """
+        text = parent.page_content
+        if not points:
+            return len(text)
+        if len(points) == 1:
+            # parent == child: tách tại dấu "Điểm x)" của chính nó
+            marker = f"\nĐiểm {points[0].metadata['point']}) "
+            pos = text.find(marker)
+            return pos if pos >= 0 else len(text)
+        return (sum(len(p.page_content) for p in points) - len(text)) // (len(points) - 1)
+
+    # --- Persistence ---
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.nodes, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ChunkStore":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    # --- Access ---
+    def render(self, node_id: str) -> str:
+        """Dựng lại page_content như parser gốc (header > Khoản > Điểm)."""
+        node = self.nodes[node_id]
+        if node["level"] == "article":
+            return node["text"]
+        if node["level"] == "clause":
+            header = self.nodes[node["parent"]]["text"]
+            text = f"{header}\n{node['text']}"
+            for child_id in node["children"]:
+                text += f"\n{self.nodes[child_id]['text']}"
+            return text
+        clause = self.nodes[node["parent"]]
+        header = self.nodes[clause["parent"]]["text"]
+        return f"{header}\n{clause['text']}\n{node['text']}"
+
+    def get_document(self, node_id: str) -> Document:
+        return Document(
+            page_content=self.render(node_id),
+            metadata=dict(self.nodes[node_id]["metadata"]),
+        )
+
+    def searchable_documents(
+        self, units: str = AppConfig.INDEX_UNITS, node_ids: Optional[Iterable[str]] = None
+    ) -> List[Document]:
+        """Các đơn vị cần đưa vào vector/BM25 index.
+
+        units = "all": mọi Khoản và Điểm (như trước đây).
+        units = "leaf": chỉ Điểm, và Khoản không có Điểm. Khoản có Điểm không
+        được index riêng vì nội dung của nó đã nằm trong các Điểm; khi cần sẽ
+        được dựng lại qua `collapse`. `node_ids`: chỉ xét các node này.
+        """
+        if node_ids is None:
+            node_ids = self.nodes.keys()
+        return [
+            self.get_document(node_id)
+            for node_id in node_ids
+            if self._is_searchable(self.nodes[node_id], units)
+        ]
+
+    @staticmethod
+    def _is_searchable(node: Dict, units: str) -> bool:
+        return node["level"] == "point" or (
+            node["level"] == "clause" and (units == "all" or not node["children"])
+        )
+
+    def collapse(self, documents: List[Document]) -> List[Document]:
+        """Gộp ứng viên về tổ tiên/con cháu tốt nhất trước khi rerank.
+
+        Nếu Khoản đã có mặt hoặc >= COLLAPSE_MIN_SIBLINGS Điểm của nó cùng
+        được tìm thấy, thay cả nhóm bằng một chunk Khoản duy nhất; nếu chỉ một
+        Điểm được tìm thấy thì giữ Điểm đó (ngắn và sát câu hỏi hơn).
+        """
+        groups: Dict[str, List[Document]] = {}
+        order: List[str] = []
+        passthrough: Dict[str, Document] = {}
+        for doc in documents:
+            node_id = doc.metadata.get("chunk_id")
+            node = self.nodes.get(node_id)
+            if node is None or node["level"] == "article":
+                key = node_id or doc.page_content[:50]
+                if key not in passthrough:
+                    order.append(key)
+                passthrough[key] = doc
+                continue
+            clause_id = node_id if node["level"] == "clause" else node["parent"]
+            if clause_id not in groups:
+                groups[clause_id] = []
+                order.append(clause_id)
+            groups[clause_id].append(doc)
+
+        collapsed = []
+        for key in order:
+            if key in passthrough:
+                collapsed.append(passthrough[key])
+                continue
+            group = groups[key]
+            has_clause = any(d.metadata.get("chunk_id") == key for d in group)
+            if has_clause or len(group) >= AppConfig.COLLAPSE_MIN_SIBLINGS:
+                clause_doc = self.get_document(key)
+                # Giữ điểm retrieval tốt nhất của nhóm (group[0] xếp hạng cao nhất)
+                for meta_key, value in group[0].metadata.items():
+                    if meta_key.endswith(("_score", "_rank")):
+                        clause_doc.metadata[meta_key] = value
+                collapsed.append(clause_doc)
+            else:
+                collapsed.append(group[0])
+        return collapsed
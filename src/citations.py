@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from src.chunk_store import ChunkStore
+from src.lexical import fold_diacritics
+
+# Khớp trên text đã bỏ dấu (trừ Điểm: cần phân biệt "d" và "đ")
+_LAW_RE = re.compile(
+    r"\b(nghi dinh|nd|luat|thong tu|tt)[\s\-]*(?:so\s*)?(\d+)(?:\s*/\s*(\d{4}))?"
+)
+_LAW_CODE_RE = re.compile(r"\b(\d+)\s*[/_]\s*(\d{4})\s*[/_]\s*(nd-cp|qh\d+|tt-[\w]+)")
+_ARTICLE_RE = re.compile(r"\bdieu\s+(\d+)\b")
+_CLAUSE_RE = re.compile(r"\bkhoan\s+(\d+)\b")
+_POINT_RE = re.compile(r"\b(?:điểm|diem)\s+([a-zđ])(?:\)|\b)")
+# Phần còn lại của câu hỏi sau khi bỏ trích dẫn: các từ này không phải nội dung hỏi
+_FILLER_RE = re.compile(
+    r"\b(?:diem\s+[a-z]|nghi dinh|luat|thong tu|nd|cp|qh\d*|so|nam|noi dung|quy dinh|"
+    r"cua|theo|tai|ve|la|gi|the nao|ra sao|cho biet|xem|tra cuu|toan van|nguyen van|\d+)\b"
+)
+
+_KIND_TO_DOC_TYPE = {
+    "nghi dinh": "nghi_dinh",
+    "nd": "nghi_dinh",
+    "nd-cp": "nghi_dinh",
+    "luat": "luat",
+    "thong tu": "thong_tu",
+    "tt": "thong_tu",
+}
+
+
+class Reference(NamedTuple):
+    law_number: str
+    doc_type: Optional[str]
+    article: str
+    clause: Optional[str]
+    point: Optional[str]
+
+
+def parse_reference(query: str) -> Optional[Reference]:
+    """'Điều 6 khoản 9 Nghị định 168' -> Reference('168', 'nghi_dinh', '6', '9', None).
+
+    Chỉ trả về khi câu hỏi nêu đúng một văn bản và một Điều; các trường hợp
+    khác (không nêu Điều, nêu nhiều Điều...) coi là mơ hồ -> None.
+    """
+    lowered = unicodedata.normalize("NFC", query.lower())
+    folded = fold_diacritics(query)
+
+    code_matches = list(_LAW_CODE_RE.finditer(folded))
+    law_matches = list(_LAW_RE.finditer(folded))
+    # "Nghị định 168/2024/NĐ-CP" khớp cả hai regex -> gom theo số hiệu
+    numbers = {m.group(1) for m in code_matches} | {m.group(2) for m in law_matches}
+    articles = set(_ARTICLE_RE.findall(folded))
+    if len(numbers) != 1 or len(articles) != 1:
+        return None
+
+    clauses = set(_CLAUSE_RE.findall(folded))
+    points = set(_POINT_RE.findall(lowered))
+    if len(clauses) > 1 or len(points) > 1 or (points and not clauses):
+        return None
+
+    doc_type = None
+    if code_matches:
+        suffix = code_matches[0].group(3)
+        doc_type = "luat" if suffix.startswith("qh") else _KIND_TO_DOC_TYPE.get(suffix, "thong_tu")
+    elif law_matches:
+        doc_type = _KIND_TO_DOC_TYPE[law_matches[0].group(1)]
+
+    return Reference(
+        law_number=numbers.pop(),
+        doc_type=doc_type,
+        article=articles.pop(),
+        clause=clauses.pop() if clauses else None,
+        point=points.pop() if points else None,
+    )
+
+
+def is_reference_only(query: str) -> bool:
+    """Câu hỏi chỉ gồm trích dẫn ("Điều 2 Luật 36/2024 quy định gì?"), không kèm
+    nội dung cần tìm ("... vượt đèn đỏ phạt bao nhiêu")."""
+    rest = fold_diacritics(query)
+    for pattern in (_LAW_CODE_RE, _LAW_RE, _ARTICLE_RE, _CLAUSE_RE, _FILLER_RE):
+        rest = pattern.sub(" ", rest)
+    return not re.search(r"\w", rest)
+
+
+def law_mentions(query: str) -> Dict[str, Optional[str]]:
+    """Các văn bản được nhắc tới: số hiệu -> doc_type (None nếu không nêu loại)."""
+    folded = fold_diacritics(query)
+    mentions: Dict[str, Optional[str]] = {}
+    for m in _LAW_CODE_RE.finditer(folded):
+        suffix = m.group(3)
+        mentions[m.group(1)] = "luat" if suffix.startswith("qh") else _KIND_TO_DOC_TYPE.get(suffix, "thong_tu")
+    for m in _LAW_RE.finditer(folded):
+        if mentions.get(m.group(2)) is None:
+            mentions[m.group(2)] = _KIND_TO_DOC_TYPE[m.group(1)]
+    return mentions
+
+
+def article_mentions(query: str) -> List[str]:
+    return sorted(set(_ARTICLE_RE.findall(fold_diacritics(query))))
+
+
+class CitationIndex:
+    """Tra cứu O(1) (law_id, Điều, Khoản, Điểm) -> node trong ChunkStore."""
+
+    def __init__(self, entries: Dict[str, str], laws: Dict[str, List[Dict]]):
+        self.entries = entries  # "law_id|điều|khoản|điểm" -> node_id
+        self.laws = laws  # số hiệu -> [{"law_id", "doc_type"}]
+
+    @staticmethod
+    def _key(law_id: str, article: str, clause: Optional[str], point: Optional[str]) -> str:
+        return f"{law_id}|{article}|{clause or ''}|{point or ''}"
+
+    @classmethod
+    def from_chunk_store(cls, store: ChunkStore) -> "CitationIndex":
+        entries: Dict[str, str] = {}
+        laws: Dict[str, List[Dict]] = {}
+        for node_id, node in store.nodes.items():
+            meta = node["metadata"]
+            number = re.search(r"\d+", meta["law_id"])
+            if number and not any(l["law_id"] == meta["law_id"] for l in laws.get(number.group(0), [])):
+                laws.setdefault(number.group(0), []).append(
+                    {"law_id": meta["law_id"], "doc_type": meta["doc_type"]}
+                )
+
+            if node["level"] == "article":
+                key = cls._key(meta["law_id"], meta["article"], None, None)
+            elif node["level"] == "clause":
+                key = cls._key(meta["law_id"], meta["article"], meta["clause"], None)
+            else:
+                key = cls._key(meta["law_id"], meta["article"], meta["clause"], meta["point"])
+            # Bản gốc xuất hiện trước, các lần trích dẫn lại (#2, #3...) bị bỏ qua
+            entries.setdefault(key, node_id)
+        return cls(entries, laws)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries, "laws": self.laws}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CitationIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["entries"], data["laws"])
+
+    def resolve(self, query: str) -> Optional[str]:
+        """node_id được trích dẫn rõ ràng trong câu hỏi, hoặc None nếu mơ hồ."""
+        ref = parse_reference(query)
+        if ref is None:
+            return None
+        candidates = self.laws.get(ref.law_number, [])
+        if ref.doc_type:
+            candidates = [c for c in candidates if c["doc_type"] == ref.doc_type]
+        if len(candidates) != 1:
+            return None
+        return self.entries.get(
+            self._key(candidates[0]["law_id"], ref.article, ref.clause, ref.point)
+        )
+
+    def lookup(self, query: str, store: ChunkStore) -> Tuple[List, bool]:
+        """(documents, cần rerank) cho trích dẫn trong câu hỏi; documents rỗng
+        nếu phải đi pipeline đầy đủ.
+
+        - Trích dẫn Khoản/Điểm -> đúng chunk đó.
+        - Trích dẫn cả Điều -> mọi Khoản của Điều (theo thứ tự văn bản; phần
+          vượt budget context do build_context cắt). Nếu câu hỏi còn hỏi nội
+          dung khác ngoài trích dẫn thì cần rerank các Khoản này theo câu hỏi.
+        """
+        node_id = self.resolve(query)
+        if node_id is None:
+            return [], False
+        node = store.nodes[node_id]
+        if node["level"] != "article" or not node["children"]:
+            return [store.get_document(node_id)], False
+        docs = [store.get_document(child_id) for child_id in node["children"]]
+        return docs, not is_reference_only(query)
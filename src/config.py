@@ -12,29 +12,138 @@ class AppConfig:
 
     DATA_RAW_DIR = os.path.join(ROOT_DIR, "data", "raw")
     DATA_PROCESSED_DIR = os.path.join(ROOT_DIR, "data", "processed")
+    PARSE_CACHE_DIR = os.path.join(DATA_PROCESSED_DIR, "parse_cache")
 
-    VECTOR_DB_DIR = os.path.join(ROOT_DIR, "data", "indexes", "chroma_db")
-    BM25_PATH = os.path.join(ROOT_DIR, "data", "indexes", "bm25_retriever.pkl")
+    # Index được build thành snapshot: data/indexes/snapshots/<version>/,
+    # CURRENT chứa version đang phục vụ (xem src/snapshots.py)
+    INDEX_DIR = os.path.join(ROOT_DIR, "data", "indexes")
+    SNAPSHOTS_DIR = os.path.join(INDEX_DIR, "snapshots")
+    CURRENT_SNAPSHOT_PATH = os.path.join(INDEX_DIR, "CURRENT")
+    SNAPSHOT_KEEP = 3  # Số snapshot giữ lại (kể cả CURRENT)
+    SNAPSHOT_POLL_INTERVAL = 10.0  # Giây; engine tự nạp snapshot mới (0 = tắt)
 
     # --- MODELS (Cấu hình Model) ---
     EMBEDDING_MODEL = "bkai-foundation-models/vietnamese-bi-encoder"
-    EMBEDDING_DEVICE = "cuda"
+    EMBEDDING_DEVICE = "auto"  # "auto" = cuda nếu có GPU, ngược lại cpu
+    # Cache vector theo nội dung (None = tắt)
+    EMBEDDING_CACHE_DIR = os.path.join(ROOT_DIR, "data", "cache", "embeddings")
+    EMBEDDING_QUERY_CACHE_SIZE = 10000  # Vector câu hỏi: chỉ LRU trong bộ nhớ
 
     RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
-    RERANKER_DEVICE = "cuda"
+    RERANKER_DEVICE = "auto"
+
+    # --- INFERENCE BACKEND ---
+    INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")  # "torch" | "onnx"
+    ONNX_QUANTIZE = True  # Dynamic int8 cho backend onnx
+    ONNX_MODEL_DIR = os.path.join(ROOT_DIR, "data", "models", "onnx")
+    INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or None
 
     LLM_MODEL_NAME = "gemini-2.5-flash"
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+    # --- VECTOR STORE ---
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" | "faiss"
+    FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")  # "flat" | "ivf" | "hnsw"
+    FAISS_IVF_NLIST = 64
+    FAISS_IVF_NPROBE = 16
+    FAISS_HNSW_M = 32
+    FAISS_HNSW_EF_CONSTRUCTION = 80
+    FAISS_HNSW_EF_SEARCH = 64
+    FAISS_EXACT_FILTER_MAX = 4096  # Bộ lọc còn <= N dòng -> tính chính xác thay vì duyệt index
+
     # --- PARAMETERS (Tham số thuật toán) ---
     RETRIEVAL_BM25_K = 15  # Số lượng docs lấy từ BM25
     RETRIEVAL_VECTOR_K = 40  # Số lượng docs lấy từ Vector Search
     RERANK_TOP_K = 5  # Số lượng docs cuối cùng sau khi chấm điểm lại
 
-    RERANKER_BATCH_SIZE = 8
+    # --- FUSION --- ("rrf" | "score")
+    FUSION_METHOD = "rrf"
+    RRF_K = 60
+    FUSION_WEIGHTS = {"vector": 1.0, "bm25": 1.0}
+    RERANK_MIN_CANDIDATES = 8  # Cắt ứng viên thích ứng trước khi rerank
+    RERANK_MAX_CANDIDATES = 30
+    RERANK_CUTOFF_RATIO = 0.3  # Giữ doc có norm_score >= ratio * điểm cao nhất
+    FUSION_AGREEMENT_DEPTH = 10
+    FUSION_AGREEMENT_THRESHOLD = 0.6  # Top-10 hai retriever trùng >= 60% -> chỉ rerank top-10
+
+    # Phạm vi (doc_type/law_id/article/vehicle) suy ra từ câu hỏi: chỉ ưu tiên
+    # doc khớp lúc fusion, không lọc cứng (bộ lọc do caller truyền mới lọc cứng)
+    SCOPE_INFER = True
+    SCOPE_BOOST = 0.2  # fusion_score, norm_score của doc khớp phạm vi x (1 + boost)
+
+    # "leaf": chỉ index Điểm + Khoản không có Điểm; "all": index cả Khoản cha
+    INDEX_UNITS = "leaf"
+    COLLAPSE_MIN_SIBLINGS = 2  # Số Điểm cùng Khoản được tìm thấy để gộp về Khoản
+
+    BM25_K1 = 1.5
+    BM25_B = 0.75
+    LEXICAL_NGRAM = 2  # Unigram + bigram âm tiết
+    LEXICAL_SPILL_POSTINGS = 2_000_000  # Cặp (doc_id, tf) giữ trong RAM trước khi ghi run ra đĩa
+
+    RERANKER_MAX_BATCH_TOKENS = 8192  # Tổng token (kể cả padding) mỗi forward pass
+    RERANKER_COALESCE_MS = 5  # Cửa sổ gom request đồng thời (0 = tắt)
+    RERANKER_MAX_COALESCED_PAIRS = 256
+    RERANKER_SCORE_CACHE_SIZE = 50000
+    INDEXING_BATCH_SIZE = 512  # Số chunk mỗi lần embed + upsert vào ChromaDB
+    INDEXING_QUEUE_SIZE = 2  # Số batch chờ embed tối đa (back-pressure cho parser)
+
+    # --- CONTEXT (prompt sinh câu trả lời) ---
+    # Token được đếm bằng tokenizer của OpenAI (tiktoken), không phải của Gemini:
+    # budget và số token tiết kiệm chỉ là xấp xỉ số token Gemini thực tính
+    CONTEXT_TOKEN_BUDGET = 2000  # Token tối đa cho phần CONTEXT (theo CONTEXT_TOKENIZER)
+    CONTEXT_TOKENIZER = "o200k_base"  # tiktoken encoding dùng để ước lượng token
+
+    # --- STARTUP ---
+    STARTUP_WORKERS = 4  # Thread load model/index song song
+    STARTUP_WARMUP = True  # Chạy thử 1 query (không gọi LLM) trước khi báo ready
+    WARMUP_QUERY = "Xe ô tô vượt đèn đỏ bị phạt bao nhiêu tiền?"
+
+    ASYNC_WORKERS = 8  # Thread pool cho retrieval/rerank trong achat
+
+    # --- BATCH QA (batch_qa.py) ---
+    BATCH_SIZE = 64  # Số câu hỏi mỗi lượt retrieval (embed + rerank chung)
+    BATCH_CONCURRENCY = 8  # Số lời gọi LLM đồng thời
+    BATCH_RATE_LIMIT = 60  # Lời gọi LLM tối đa mỗi phút (0 = không giới hạn)
+    BATCH_MAX_RETRIES = 5
+    BATCH_BACKOFF_BASE = 1.0  # giây, nhân đôi sau mỗi lần thử lại
+    BATCH_BACKOFF_MAX = 60.0
+
+    # --- SERVER (server.py) ---
+    SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+    SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+    SERVER_WORKERS = 2
+    SERVER_LLM = os.getenv("SERVER_LLM", "gemini")  # "gemini" | "stub"
+    SERVER_MAX_ACTIVE = 16  # Request xử lý đồng thời mỗi worker
+    SERVER_MAX_QUEUE = 64  # Request chờ tối đa mỗi worker; đầy -> 503
+    SERVER_QUEUE_TIMEOUT = 10.0  # giây chờ slot trước khi trả 503
+    SERVER_REQUEST_TIMEOUT = 60.0  # giây cho cả request (kể cả stream) -> 504
+
+    # Process giữ embedding + reranker dùng chung cho các worker
+    # (None = mỗi process tự load model)
+    MODEL_SERVER_URL = os.getenv("MODEL_SERVER_URL")
+    MODEL_SERVER_HOST = "127.0.0.1"
+    MODEL_SERVER_PORT = int(os.getenv("MODEL_SERVER_PORT", "8001"))
+    MODEL_SERVER_TIMEOUT = 30.0  # giây mỗi lời gọi embed/score
+    MODEL_SERVER_STARTUP_TIMEOUT = 600.0  # giây chờ load model lúc khởi động
+
+    # --- TELEMETRY --- ("prometheus", "json", "otel"; phân tách bằng dấu phẩy)
+    TELEMETRY_SINKS = [
+        s.strip() for s in os.getenv("TELEMETRY_SINKS", "prometheus").split(",") if s.strip()
+    ]
+
+    # --- QUERY / ANSWER CACHE ---
+    QUERY_CACHE_PATH = os.path.join(ROOT_DIR, "data", "cache", "query_cache.sqlite")
+    QUERY_CACHE_MAX_SIZE = 5000
+    QUERY_CACHE_TTL = 7 * 24 * 3600  # giây
+    QUERY_CACHE_BUSY_TIMEOUT = 5.0  # giây chờ khoá SQLite khi process khác đang ghi
+    SEMANTIC_CACHE_THRESHOLD = None  # VD: 0.95 để bật semantic cache
+
+    # --- INGESTION ---
+    INGESTION_WORKERS = min(8, os.cpu_count() or 1)  # <= 1: parse tuần tự
 
 
 # Tự động tạo các thư mục cần thiết
 os.makedirs(AppConfig.DATA_RAW_DIR, exist_ok=True)
 os.makedirs(AppConfig.DATA_PROCESSED_DIR, exist_ok=True)
-os.makedirs(os.path.dirname(AppConfig.VECTOR_DB_DIR), exist_ok=True)
+os.makedirs(AppConfig.PARSE_CACHE_DIR, exist_ok=True)
+os.makedirs(AppConfig.SNAPSHOTS_DIR, exist_ok=True)
@@ -0,0 +1,170 @@
+import functools
+import re
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from src.chunk_store import ChunkStore
+from src.config import AppConfig
+
+_CLAUSE_PREFIX_RE = re.compile(r"^Khoản \S+: ")
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoder():
+    # Lần đầu tiktoken tải file BPE: máy offline / bị chặn mạng cũng rơi về
+    # ước lượng (lru_cache giữ kết quả None nên không thử tải lại mỗi request)
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(AppConfig.CONTEXT_TOKENIZER)
+    except Exception as e:
+        print(f"   ⚠️ tiktoken unavailable ({type(e).__name__}: {e}), estimating tokens from length")
+        return None
+
+
+def tokenizer_name() -> str:
+    """Cách đếm token đang dùng. Không phải tokenizer của Gemini: mọi số token
+    (budget, tokens_saved) chỉ là xấp xỉ."""
+    return AppConfig.CONTEXT_TOKENIZER if _get_encoder() is not None else "chars/3"
+
+
+def count_tokens(text: str) -> int:
+    encoder = _get_encoder()
+    if encoder is None:
+        # Ước lượng thô: tiếng Việt có dấu ~3 ký tự / token
+        return (len(text) + 2) // 3
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def format_verbatim(docs: List[Document]) -> str:
+    """Cách ghép context cũ: mỗi document nguyên văn (dùng để đo token tiết kiệm)."""
+    context_text = ""
+    for i, doc in enumerate(docs):
+        source = doc.metadata.get("citation", "N/A")
+        content = doc.page_content.replace("\n", " ")
+        context_text += f"[{i+1}] {source}: {content}\n\n"
+    return context_text
+
+
+def build_context(
+    docs: List[Document],
+    store: Optional[ChunkStore],
+    budget: int = AppConfig.CONTEXT_TOKEN_BUDGET,
+) -> Tuple[str, Dict, List[Document]]:
+    """Ghép context cho LLM trong giới hạn `budget` token.
+
+    - Chunk cùng Khoản (Khoản + các Điểm của nó) được gộp thành một mục,
+      các Điểm xếp theo thứ tự trong văn bản.
+    - Header "Tên luật > Điều x" chỉ in một lần cho mỗi Điều (các Khoản sau
+      của cùng Điều vẫn có trích dẫn "Điều x Khoản y" riêng).
+    - Mục (kể cả chunk không có trong ChunkStore) được thêm theo thứ tự rerank
+      của chunk đầu tiên thuộc mục tới khi hết budget; Khoản quá dài thì giữ
+      phần mở đầu, ưu tiên các Điểm được retrieve rồi mới tới các Điểm khác.
+    Trả về (context, thống kê token, các document thực sự nằm trong context
+    theo thứ tự rerank).
+    """
+    # Mục theo thứ tự rerank: clause_id -> {"whole", "points", "docs"} hoặc
+    # ("loose", nội dung) -> chunk không có trong ChunkStore, giữ nguyên văn
+    entries: Dict = {}
+    for doc in docs:
+        node_id = doc.metadata.get("chunk_id")
+        node = store.nodes.get(node_id) if store is not None and node_id else None
+        if node is None or node["level"] == "article":
+            entries.setdefault(("loose", doc.page_content), {"docs": [doc]})
+            continue
+        clause_id = node_id if node["level"] == "clause" else node["parent"]
+        entry = entries.setdefault(clause_id, {"whole": False, "points": [], "docs": []})
+        entry["docs"].append(doc)
+        if node["level"] == "clause":
+            entry["whole"] = True
+        elif node_id not in entry["points"]:
+            entry["points"].append(node_id)
+
+    lines: List[str] = []
+    packed: set = set()
+    used, truncated, dropped = 0, 0, 0
+    printed_headers = set()
+    for key, entry in entries.items():
+        n = len(lines) + 1
+        if isinstance(key, tuple):
+            doc = entry["docs"][0]
+            block = f"[{n}] {doc.metadata.get('citation', 'N/A')}: {_flat(key[1])}"
+            block_tokens = count_tokens(block + "\n\n")
+            if used + block_tokens > budget and lines:
+                dropped += 1
+                continue
+            lines.append(block)
+            used += block_tokens
+            packed.add(id(doc))
+            continue
+
+        clause = store.nodes[key]
+        article_id = clause["parent"]
+        header = ""
+        if article_id not in printed_headers:
+            header = _flat(store.nodes[article_id]["text"]) + "\n"
+        # "Khoản x: ..." -> bỏ "Khoản x: " vì trích dẫn đã nêu Khoản
+        intro = _CLAUSE_PREFIX_RE.sub("", _flat(clause["text"]), count=1)
+        # Citation theo các Điểm được retrieve (chỉ ngắn đi khi bị cắt bớt Điểm)
+        if entry["whole"]:
+            citation = clause["metadata"].get("citation", "N/A")
+        else:
+            citation = _points_citation(store, clause, entry["points"])
+        block_tokens = count_tokens(f"{header}[{n}] {citation}: {intro}\n\n")
+        if used + block_tokens > budget and lines:
+            dropped += 1
+            continue
+
+        # Điểm được retrieve trước (thứ tự rerank), rồi các Điểm còn lại của
+        # Khoản (khi retrieve cả Khoản) theo thứ tự văn bản
+        candidates = list(entry["points"])
+        if entry["whole"]:
+            candidates += [p for p in clause["children"] if p not in candidates]
+        selected = set()
+        for point_id in candidates:
+            part_tokens = count_tokens(" " + _flat(store.nodes[point_id]["text"]))
+            # Mục đầu tiên luôn giữ ít nhất một Điểm được retrieve
+            if used + block_tokens + part_tokens > budget and (lines or selected or entry["whole"]):
+                truncated += 1
+                break
+            selected.add(point_id)
+            block_tokens += part_tokens
+        if not entry["whole"] and not selected:
+            dropped += 1  # Không Điểm nào được retrieve vừa budget
+            continue
+        point_ids = [p for p in clause["children"] if p in selected]
+        if not entry["whole"] and len(point_ids) < len(entry["points"]):
+            citation = _points_citation(store, clause, point_ids)
+
+        parts = [intro] + [_flat(store.nodes[p]["text"]) for p in point_ids]
+        block = f"{header}[{n}] {citation}: " + " ".join(parts)
+        lines.append(block)
+        used += block_tokens
+        printed_headers.add(article_id)
+        for doc in entry["docs"]:
+            if doc.metadata.get("chunk_id") in selected or doc.metadata.get("chunk_id") == key:
+                packed.add(id(doc))
+
+    context_text = "\n\n".join(lines) + "\n\n" if lines else ""
+    verbatim_tokens = count_tokens(format_verbatim(docs))
+    context_tokens = count_tokens(context_text)
+    stats = {
+        "tokens": context_tokens,
+        "tokens_verbatim": verbatim_tokens,
+        "tokens_saved": verbatim_tokens - context_tokens,
+        "entries": len(lines),
+        "entries_dropped": dropped,
+        "entries_truncated": truncated,
+        "tokenizer": tokenizer_name(),
+    }
+    return context_text, stats, [d for d in docs if id(d) in packed]
+
+
+def _flat(text: str) -> str:
+    return text.replace("\n", " ")
+
+
+def _points_citation(store: ChunkStore, clause: Dict, point_ids: List[str]) -> str:
+    if len(point_ids) == 1:
+        return store.nodes[point_ids[0]]["metadata"].get("citation", "N/A")
+    points = ", ".join(store.nodes[p]["metadata"]["point"] for p in point_ids)
+    return f"{clause['metadata'].get('citation', 'N/A')} Điểm {points}"
@@ -0,0 +1,165 @@
+import argparse
+import os
+import time
+import zipfile
+from typing import Iterator, List
+from lxml import etree
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_OFFICE_DOCUMENT = "/officeDocument"
+
+W_BODY = f"{_W}body"
+W_P = f"{_W}p"
+W_R = f"{_W}r"
+W_HYPERLINK = f"{_W}hyperlink"
+W_T = f"{_W}t"
+W_TAB = f"{_W}tab"
+W_PTAB = f"{_W}ptab"
+W_BR = f"{_W}br"
+W_CR = f"{_W}cr"
+W_NO_BREAK_HYPHEN = f"{_W}noBreakHyphen"
+W_TYPE = f"{_W}type"
+
+PRUNE_EVERY = 256  # Số đoạn giữa hai lần xoá phần tử đã đọc khỏi cây
+
+
+def _document_part(archive: zipfile.ZipFile) -> str:
+    """Tên part chính (thường là word/document.xml), theo _rels/.rels."""
+    try:
+        rels = etree.fromstring(archive.read("_rels/.rels"))
+    except KeyError:
+        return "word/document.xml"
+    for rel in rels.iter(f"{_REL_NS}Relationship"):
+        if rel.get("Type", "").endswith(_OFFICE_DOCUMENT):
+            return rel.get("Target").lstrip("/")
+    return "word/document.xml"
+
+
+_RUN_CONTENT = (W_T, W_TAB, W_PTAB, W_BR, W_CR, W_NO_BREAK_HYPHEN)
+
+
+def _run_text(run) -> str:
+    # Giống python-docx CT_R.text (lọc tag trong C bằng iterchildren)
+    parts = []
+    for child in run.iterchildren(*_RUN_CONTENT):
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or "")
+        elif tag == W_BR:
+            # Ngắt trang / cột -> "" ; ngắt dòng (mặc định) -> "\n"
+            if child.get(W_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif tag == W_CR:
+            parts.append("\n")
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append("-")
+        else:  # w:tab, w:ptab
+            parts.append("\t")
+    return "".join(parts)
+
+
+def paragraph_text(p) -> str:
+    """Text của một w:p, giống `docx.text.paragraph.Paragraph.text`."""
+    parts = []
+    for child in p.iterchildren(W_R, W_HYPERLINK):
+        if child.tag == W_R:
+            parts.append(_run_text(child))
+        else:
+            parts.extend(_run_text(r) for r in child.iterchildren(W_R))
+    return "".join(parts)
+
+
+def iter_paragraphs(path: str) -> Iterator[str]:
+    """Stream text các đoạn cấp body của file .docx (như `Document(path).paragraphs`).
+
+    Đọc document.xml bằng iterparse: đoạn đã đọc được clear ngay, và cứ
+    PRUNE_EVERY đoạn thì xoá khỏi cây mọi phần tử body đứng trước (kể cả bảng),
+    nên bộ nhớ không tăng theo độ dài văn bản. Xoá theo lô vì xoá từng phần
+    tử trong lxml tốn hơn cả việc parse. Đoạn nằm trong bảng bị bỏ qua như
+    python-docx.
+    """
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(_document_part(archive)) as xml:
+            n = 0
+            for _, p in etree.iterparse(xml, events=("end",), tag=W_P, huge_tree=True):
+                body = p.getparent()
+                if body is None or body.tag != W_BODY:
+                    continue
+                yield paragraph_text(p)
+                p.clear(keep_tail=True)
+                n += 1
+                if n % PRUNE_EVERY == 0:
+                    del body[: body.index(p)]
+
+
+# --- Parity + throughput so với python-docx ---
+def _python_docx_paragraphs(path: str) -> List[str]:
+    from docx import Document
+
+    return [p.text for p in Document(path).paragraphs]
+
+
+def check_parity(data_path: str, repeat: int = 3) -> dict:
+    """So text từng đoạn và chunk đầu ra với python-docx trên mọi file .docx."""
+    from src.ingestion import VietnameseLawParser
+
+    parser = VietnameseLawParser(data_path, cache_dir=None)
+    files = sorted(f for f in os.listdir(data_path) if f.endswith(".docx"))
+    report = {"files": len(files), "mismatched_files": [], "paragraphs": 0, "chunks": 0}
+    timings = {"python_docx": 0.0, "lxml": 0.0}
+    total_bytes = 0
+
+    for file_name in files:
+        path = os.path.join(data_path, file_name)
+        total_bytes += os.path.getsize(path)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            expected = _python_docx_paragraphs(path)
+        timings["python_docx"] += (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for _ in range(repeat):
+            actual = list(iter_paragraphs(path))
+        timings["lxml"] += (time.perf_counter() - start) / repeat
+
+        expected_docs = parser._chunk_lines(expected, file_name)
+        actual_docs = parser._process_single_file(path, file_name)
+        same_docs = [(d.page_content, d.metadata) for d in expected_docs] == [
+            (d.page_content, d.metadata) for d in actual_docs
+        ]
+        if actual != expected or not same_docs:
+            report["mismatched_files"].append(file_name)
+        report["paragraphs"] += len(expected)
+        report["chunks"] += len(expected_docs)
+
+    mb = total_bytes / (1024 * 1024)
+    report["parity"] = not report["mismatched_files"]
+    report["throughput_mb_s"] = {
+        name: mb / seconds if seconds else 0.0 for name, seconds in timings.items()
+    }
+    report["speedup"] = timings["python_docx"] / timings["lxml"] if timings["lxml"] else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra parity + tốc độ đọc .docx (lxml vs python-docx)")
+    parser.add_argument("--data", default="data/raw")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    report = check_parity(args.data, args.repeat)
+    status = "✅" if report["parity"] else "❌"
+    print(
+        f"{status} Parity: {report['files'] - len(report['mismatched_files'])}/{report['files']} files "
+        f"({report['paragraphs']} paragraphs, {report['chunks']} chunks)"
+    )
+    for file_name in report["mismatched_files"]:
+        print(f"   -> ❌ {file_name}")
+    for name, value in report["throughput_mb_s"].items():
+        print(f"   {name}: {value:.1f} MB/s")
+    print(f"   speedup: {report['speedup']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.config import AppConfig
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá trong cùng process
+    fcntl = None
+
+
+class CachedEmbeddings(Embeddings):
+    """Cache embedding theo nội dung, đặt quanh một model embedding bất kỳ.
+
+    Key = sha1(tên model@backend + loại (doc/query) + text). Vector được append vào một
+    ma trận float32 trên đĩa (`vectors.f32`, đọc qua memmap) và vị trí dòng được
+    ghi vào `index.tsv`. Cả hai file chỉ append nên nhiều process (Indexer,
+    TrafficLawRAG) dùng chung được; phần ghi dở khi crash sẽ bị bỏ qua lúc load.
+
+    Chỉ vector document được ghi xuống đĩa (tập chunk có giới hạn). Vector câu
+    hỏi chỉ giữ trong LRU bộ nhớ (EMBEDDING_QUERY_CACHE_SIZE): không fsync trên
+    đường xử lý request và file không phình theo số câu hỏi.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, cache_dir: str):
+        self.base = base
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "_", model_name))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.index_path = os.path.join(self.cache_dir, "index.tsv")
+        self.meta_path = os.path.join(self.cache_dir, "meta.json")
+
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._index_pos = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.dim: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        self._refresh()
+
+    def _key(self, text: str, kind: str) -> str:
+        raw = f"{self.model_name}\0{kind}\0{text}".encode("utf-8")
+        return hashlib.sha1(raw).hexdigest()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.cache_dir, ".lock"), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Đọc phần index mới (có thể do process khác ghi) và map lại ma trận."""
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return
+        n_rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        if n_rows:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim)
+            )
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_pos)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Dòng ghi dở
+                    key, row = line.decode("utf-8").split("\t")
+                    if int(row) < n_rows:
+                        self._index[key] = int(row)
+                    self._index_pos += len(line)
+
+    def _append(self, keys: List[str], vectors: np.ndarray):
+        with self._file_lock():
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            start_row = 0
+            if os.path.exists(self.vectors_path):
+                start_row = os.path.getsize(self.vectors_path) // (4 * self.dim)
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(start_row * 4 * self.dim)  # Bỏ phần ghi dở (nếu có)
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.writelines(f"{k}\t{start_row + i}\n" for i, k in enumerate(keys))
+            self._refresh()
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t, "doc") for t in texts]
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._index and key not in missing:
+                    missing[key] = text
+            if missing:
+                self._refresh()
+                missing = {k: t for k, t in missing.items() if k not in self._index}
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+
+        # Encode ngoài lock để các query đồng thời không phải xếp hàng
+        if missing:
+            vectors = self.base.embed_documents(list(missing.values()))
+            with self._lock:
+                self._append(list(missing), np.asarray(vectors, dtype=np.float32))
+
+        with self._lock:
+            return [self._matrix[self._index[k]].tolist() for k in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text, "query")
+        with self._lock:
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                self.hits += 1
+                return self._query_cache[key]
+        vector = self.base.embed_query(text)
+        with self._lock:
+            self.misses += 1
+            self._query_cache[key] = vector
+            while len(self._query_cache) > AppConfig.EMBEDDING_QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vector
+
+
+def get_embedding_model(local: bool = False) -> Embeddings:
+    """Model embedding dùng chung cho Indexer và TrafficLawRAG (có cache nếu bật).
+
+    Có AppConfig.MODEL_SERVER_URL -> gọi model server thay vì load model
+    (local=True: luôn load tại chỗ, dùng trong chính model server).
+    """
+    if AppConfig.MODEL_SERVER_URL and not local:
+        from src.model_server import RemoteEmbeddings
+
+        return RemoteEmbeddings(AppConfig.MODEL_SERVER_URL)
+
+    from src.inference import backend_tag, load_embedding_backend
+
+    base = load_embedding_backend()
+    if not AppConfig.EMBEDDING_CACHE_DIR:
+        return base
+    # Mỗi backend (torch / onnx-int8...) một cache riêng: vector không trộn lẫn
+    return CachedEmbeddings(
+        base, f"{AppConfig.EMBEDDING_MODEL}@{backend_tag()}", AppConfig.EMBEDDING_CACHE_DIR
+    )
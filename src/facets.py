@@ -0,0 +1,105 @@
+import json
+import os
+from array import array
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Trường metadata dùng để lọc (thứ tự = thứ tự cột trong facet_codes.npy)
+FILTER_FIELDS = ("doc_type", "law_id", "article", "vehicle")
+
+
+def normalize_filters(filters: Optional[Dict]) -> Dict[str, Tuple[str, ...]]:
+    """{"law_id": "x", "article": ["6", "7"]} -> {"law_id": ("x",), "article": ("6", "7")}.
+
+    Lọc theo `vehicle` luôn giữ cả các Điều chung (vehicle = "").
+    """
+    normalized = {}
+    for field, value in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field: {field} (expected one of {FILTER_FIELDS})")
+        if value is None:
+            continue
+        values = {str(v) for v in ([value] if isinstance(value, (str, int)) else value)}
+        if field == "vehicle":
+            values.add("")
+        normalized[field] = tuple(sorted(values))
+    return normalized
+
+
+def matches_filters(metadata: Dict, filters: Dict[str, Tuple[str, ...]]) -> bool:
+    """Metadata của một doc có thoả bộ lọc đã normalize_filters không."""
+    return all(str(metadata.get(field, "")) in values for field, values in filters.items())
+
+
+def chroma_where(filters: Dict[str, Tuple[str, ...]]) -> Optional[Dict]:
+    clauses = [{field: {"$in": list(values)}} for field, values in filters.items()]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class FacetIndex:
+    """Các trường FILTER_FIELDS của từng doc, mã hoá thành mảng int32.
+
+    Lọc = so sánh mảng mã (mask bool theo doc), không phải đọc metadata từng
+    doc; mask được tính một lần cho mỗi bộ lọc rồi cache.
+    """
+
+    MASK_CACHE_SIZE = 256
+
+    def __init__(self, values: Optional[Dict[str, List[str]]] = None, codes=None):
+        self.values = values or {field: [] for field in FILTER_FIELDS}
+        self._lookup = {
+            field: {v: i for i, v in enumerate(vals)} for field, vals in self.values.items()
+        }
+        self._rows = array("i")  # Khi build: các dòng mã nối liền
+        self._codes = codes
+        self._masks: Dict[Tuple, np.ndarray] = {}
+
+    def add(self, metadata: Dict):
+        for field in FILTER_FIELDS:
+            value = str(metadata.get(field, ""))
+            code = self._lookup[field].get(value)
+            if code is None:
+                code = self._lookup[field][value] = len(self.values[field])
+                self.values[field].append(value)
+            self._rows.append(code)
+
+    @property
+    def codes(self) -> np.ndarray:
+        if self._codes is None:
+            self._codes = np.frombuffer(self._rows, dtype=np.int32).reshape(-1, len(FILTER_FIELDS))
+        return self._codes
+
+    def save(self, index_dir: str):
+        np.save(os.path.join(index_dir, "facet_codes.npy"), self.codes)
+        with open(os.path.join(index_dir, "facets.json"), "w", encoding="utf-8") as f:
+            json.dump(self.values, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["FacetIndex"]:
+        """None nếu index được build trước khi có facet."""
+        path = os.path.join(index_dir, "facets.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            values = json.load(f)
+        codes = np.load(os.path.join(index_dir, "facet_codes.npy"), mmap_mode="r")
+        return cls(values, codes)
+
+    def mask(self, filters: Dict[str, Tuple[str, ...]]) -> np.ndarray:
+        key = tuple(sorted(filters.items()))
+        mask = self._masks.get(key)
+        if mask is not None:
+            return mask
+        mask = np.ones(len(self.codes), dtype=bool)
+        for col, field in enumerate(FILTER_FIELDS):
+            if field in filters:
+                allowed = [
+                    self._lookup[field][v] for v in filters[field] if v in self._lookup[field]
+                ]
+                mask &= np.isin(self.codes[:, col], allowed)
+        if len(self._masks) >= self.MASK_CACHE_SIZE:
+            self._masks.pop(next(iter(self._masks)))
+        self._masks[key] = mask
+        return mask
@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from src.config import AppConfig
+from src.facets import matches_filters
+
+ScoredDocs = List[Tuple[Document, float]]
+
+
+def _doc_key(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or doc.metadata.get("citation", doc.page_content[:50])
+
+
+def fuse(results: Dict[str, ScoredDocs], method: str = AppConfig.FUSION_METHOD) -> List[Document]:
+    """Hợp nhất kết quả của nhiều retriever, giữ điểm gốc của từng retriever.
+
+    results: {"vector": [(doc, score), ...], "bm25": [...]}, mỗi list đã sắp
+    giảm dần. Trả về danh sách doc duy nhất, sắp theo `fusion_score`; điểm và
+    thứ hạng gốc nằm trong metadata (`vector_score`, `bm25_rank`...).
+
+    - "rrf": Reciprocal Rank Fusion, score = Σ w / (RRF_K + rank).
+    - "score": min-max chuẩn hoá điểm từng retriever rồi cộng có trọng số.
+    Tổng điểm chuẩn hoá luôn được ghi vào `norm_score` (dùng cho adaptive_cutoff).
+    """
+    fused: Dict[str, Document] = {}
+    totals: Dict[str, float] = {}
+    norms: Dict[str, float] = {}
+    for name, scored_docs in results.items():
+        weight = AppConfig.FUSION_WEIGHTS.get(name, 1.0)
+        scores = [s for _, s in scored_docs]
+        low, high = (min(scores), max(scores)) if scores else (0.0, 0.0)
+
+        for rank, (doc, score) in enumerate(scored_docs, start=1):
+            key = _doc_key(doc)
+            if key not in fused:
+                fused[key] = doc
+                totals[key] = 0.0
+                norms[key] = 0.0
+            meta = fused[key].metadata
+            meta[f"{name}_score"] = float(score)
+            meta[f"{name}_rank"] = rank
+
+            norm = (score - low) / (high - low) if high > low else 1.0
+            norms[key] += weight * norm
+            if method == "rrf":
+                totals[key] += weight / (AppConfig.RRF_K + rank)
+            else:
+                totals[key] += weight * norm
+
+    for key, doc in fused.items():
+        doc.metadata["fusion_score"] = totals[key]
+        doc.metadata["norm_score"] = norms[key]
+    return sorted(fused.values(), key=lambda d: d.metadata["fusion_score"], reverse=True)
+
+
+def boost_scope(docs: List[Document], scope: Optional[Dict]) -> List[Document]:
+    """Ưu tiên (không lọc) các doc khớp phạm vi suy ra từ câu hỏi.
+
+    fusion_score và norm_score của doc khớp nhân (1 + SCOPE_BOOST), rồi sắp
+    lại. Doc ngoài phạm vi vẫn còn nên phạm vi suy sai chỉ làm lệch thứ hạng.
+    """
+    if not scope or not AppConfig.SCOPE_BOOST:
+        return docs
+    for doc in docs:
+        if matches_filters(doc.metadata, scope):
+            doc.metadata["fusion_score"] *= 1 + AppConfig.SCOPE_BOOST
+            doc.metadata["norm_score"] *= 1 + AppConfig.SCOPE_BOOST
+    return sorted(docs, key=lambda d: d.metadata["fusion_score"], reverse=True)
+
+
+def agreement(results: Dict[str, ScoredDocs], depth: int = AppConfig.FUSION_AGREEMENT_DEPTH) -> float:
+    """Tỉ lệ trùng nhau giữa top-`depth` của các retriever (0..1)."""
+    tops = [{_doc_key(d) for d, _ in scored[:depth]} for scored in results.values() if scored]
+    if len(tops) < 2:
+        return 0.0
+    common = set.intersection(*tops)
+    return len(common) / min(len(t) for t in tops)
+
+
+def adaptive_cutoff(docs: List[Document], results: Dict[str, ScoredDocs]) -> int:
+    """Số ứng viên nên gửi sang reranker, trong [RERANK_MIN, RERANK_MAX]_CANDIDATES.
+
+    Giữ các doc có norm_score >= RERANK_CUTOFF_RATIO * điểm cao nhất. Dùng
+    điểm min-max từng retriever chứ không dùng fusion_score: điểm RRF nằm
+    trong dải rất hẹp (top ~1/61..2/61, hạng 40 ~1/100) nên ngưỡng theo tỉ lệ
+    giữ gần như mọi ứng viên. Nếu các retriever đã đồng thuận ở top
+    (agreement cao) thì chỉ giữ tới FUSION_AGREEMENT_DEPTH ứng viên.
+    """
+    min_n, max_n = AppConfig.RERANK_MIN_CANDIDATES, AppConfig.RERANK_MAX_CANDIDATES
+    if not docs:
+        return 0
+
+    top_score = max(d.metadata.get("norm_score", 0.0) for d in docs)
+    n = sum(
+        1
+        for d in docs
+        if d.metadata.get("norm_score", 0.0) >= AppConfig.RERANK_CUTOFF_RATIO * top_score
+    )
+    if agreement(results) >= AppConfig.FUSION_AGREEMENT_THRESHOLD:
+        n = min(n, AppConfig.FUSION_AGREEMENT_DEPTH)
+    return min(len(docs), max(min_n, min(n, max_n)))
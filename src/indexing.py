@@ -1,49 +1,274 @@
+import hashlib
+import json
 import os
-import pickle
+import queue
 import shutil
-from typing import List
+import threading
+from typing import Dict, Iterable, List, Optional
 from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.retrievers import BM25Retriever
+from src.chunk_store import ChunkStore
+from src.citations import CitationIndex
 from src.config import AppConfig
+from src.embeddings import get_embedding_model
+from src.inference import backend_tag, resolve_device
+from src.lexical import LexicalIndexBuilder
+from src.snapshots import building_snapshot, current_snapshot, publish_snapshot
+from src.vector_store import faiss_build_params, open_vector_store
 
 
 class Indexer:
     def __init__(self):
-        self.db_path = AppConfig.VECTOR_DB_DIR
-        self.bm25_path = AppConfig.BM25_PATH
-
         print(
-            f"⚙️  [Indexer] Init Embedding Model: {AppConfig.EMBEDDING_MODEL} ({AppConfig.EMBEDDING_DEVICE})"
+            f"⚙️  [Indexer] Init Embedding Model: {AppConfig.EMBEDDING_MODEL} "
+            f"({resolve_device(AppConfig.EMBEDDING_DEVICE)}, {AppConfig.INFERENCE_BACKEND})"
         )
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=AppConfig.EMBEDDING_MODEL,
-            model_kwargs={"device": AppConfig.EMBEDDING_DEVICE},
-            encode_kwargs={"normalize_embeddings": True},
+        self.embeddings = get_embedding_model()
+
+    def build_indices(self, documents: Iterable[Document], full_rebuild: bool = False):
+        """Build index từ stream chunk của parser (list hoặc generator).
+
+        Chunk được xử lý theo từng nhóm Khoản: thêm vào ChunkStore, BM25
+        builder, và các chunk cần embed được gom thành batch
+        INDEXING_BATCH_SIZE, đẩy qua hàng đợi giới hạn sang thread embed + ghi
+        vector store (parser chờ khi embed chậm hơn). Mỗi batch ghi xong được lưu
+        vào checkpoint nên lần chạy sau tiếp tục từ chỗ bị ngắt.
+
+        Mọi thứ được ghi vào `snapshots/.building` (incremental: bắt đầu từ bản
+        sao vector store của snapshot CURRENT, chỉ sao chép khi có batch cần
+        ghi hoặc chunk cần xoá); xong mới publish thành `snapshots/<version>`
+        và đổi con trỏ CURRENT, nên engine đang chạy không bao giờ thấy index
+        ghi dở. Không chunk nào thay đổi và cùng tham số build (_index_params)
+        -> giữ nguyên CURRENT.
+
+        Giới hạn bộ nhớ: postings BM25 được ghi ra đĩa theo từng run (xem
+        LexicalIndexBuilder), nhưng ChunkStore (toàn bộ cây Điều/Khoản/Điểm)
+        và bảng chunk_id -> content_hash vẫn nằm trong RAM tới khi lưu, nên
+        bộ nhớ đỉnh vẫn tăng tuyến tính theo kích thước corpus.
+        """
+        base = current_snapshot()
+        previous = self._load_manifest(base.manifest_path) if base else None
+        if previous is None or not os.path.exists(base.vector_path()):
+            full_rebuild = True
+        old_chunks = {} if full_rebuild else previous["chunks"]
+        base_version = "" if full_rebuild else previous["version"]
+
+        self.snapshot = building = building_snapshot()
+        done = self._load_checkpoint(full_rebuild, base_version)
+        if done:
+            print(f"   -> ⏯️  Resume: {len(done)} chunks đã embed ở lần chạy trước")
+        else:
+            if os.path.exists(building.root):
+                shutil.rmtree(building.root)
+            os.makedirs(building.root)
+            self._start_checkpoint(full_rebuild, base_version)
+
+        def open_vectors():
+            # Incremental: chỉ sao chép vector store của CURRENT khi thật sự cần ghi
+            if not full_rebuild and not os.path.exists(building.vector_path()):
+                shutil.copytree(base.vector_path(), building.vector_path())
+            return open_vector_store(self.embeddings, building.vector_path())
+
+        writer = _VectorWriter(open_vectors, self._append_checkpoint)
+        chunk_store = ChunkStore()
+        lexical = LexicalIndexBuilder()
+        current: Dict[str, str] = {}
+        batch: List[Document] = []
+
+        print(
+            f"   -> 🧠 Embedding & {AppConfig.VECTOR_BACKEND} ({'full rebuild' if full_rebuild else 'incremental'}, "
+            f"batch {AppConfig.INDEXING_BATCH_SIZE})..."
         )
+        try:
+            for group in ChunkStore.iter_groups(documents):
+                # Lưu cây Điều/Khoản/Điểm một lần, chỉ index các đơn vị cần tìm kiếm
+                node_ids = chunk_store.add_documents(group)
+                searchable = chunk_store.searchable_documents(node_ids=node_ids)
+                lexical.add(searchable)
+                for doc in searchable:
+                    cid, content_hash = doc.metadata["chunk_id"], doc.metadata["content_hash"]
+                    current[cid] = content_hash
+                    if old_chunks.get(cid) != content_hash and done.get(cid) != content_hash:
+                        batch.append(doc)
+                if len(batch) >= AppConfig.INDEXING_BATCH_SIZE:
+                    writer.put(batch)
+                    batch = []
+            if batch:
+                writer.put(batch)
+        finally:
+            writer.close()
 
-    def build_indices(self, documents: List[Document]):
-        print(f"📊 Đang tạo Index cho {len(documents)} documents...")
+        if not current:
+            raise ValueError("No documents to index")
 
-        # 1. Vector Store
-        if os.path.exists(self.db_path):
-            shutil.rmtree(self.db_path)
+        params = self._index_params()
+        if not full_rebuild and current == old_chunks and previous.get("index_params") == params:
+            shutil.rmtree(building.root)
+            print("   -> ✅ Index đã cập nhật, không có thay đổi.")
+            return base_version
 
-        print("   -> 🧠 Embedding & ChromaDB...")
-        Chroma.from_documents(
-            documents=documents,
-            embedding=self.embeddings,
-            persist_directory=self.db_path,
-            collection_metadata={"hnsw:space": "cosine"},
+        removed_ids = [cid for cid in old_chunks if cid not in current]
+        vector_db = writer.vector_db or open_vectors()
+        for start in range(0, len(removed_ids), AppConfig.INDEXING_BATCH_SIZE):
+            vector_db.delete(ids=removed_ids[start : start + AppConfig.INDEXING_BATCH_SIZE])
+        vector_db.save()
+        print(
+            f"   -> ✅ Vector Index: {len(current)} chunks, {writer.written} embedded, "
+            f"{len(removed_ids)} xoá"
         )
-        print("   -> ✅ Vector Index Saved.")
 
-        # 2. BM25
-        print("   -> 🔍 Creating BM25 Index...")
-        bm25_retriever = BM25Retriever.from_documents(documents)
-        bm25_retriever.k = AppConfig.RETRIEVAL_BM25_K
+        chunk_store.save(building.chunk_store_path)
+        # Index trích dẫn (Luật/Điều/Khoản/Điểm -> node) cho fast path
+        CitationIndex.from_chunk_store(chunk_store).save(building.citation_index_path)
 
-        with open(self.bm25_path, "wb") as f:
-            pickle.dump(bm25_retriever, f)
+        # 2. BM25 (IDF phụ thuộc toàn bộ corpus -> ghi lại, không cần embed nên rẻ)
+        print("   -> 🔍 Saving BM25 Index...")
+        lexical.save(building.lexical_path)
         print("   -> ✅ BM25 Index Saved.")
+
+        version = self._save_manifest(current, params)
+        os.remove(building.checkpoint_path)
+        publish_snapshot(building, version)
+        print(f"   -> 📦 Snapshot {version} published (CURRENT)")
+        return version
+
+    # --- Checkpoint: các batch đã embed + ghi vào vector store của lần build dở ---
+    def _load_checkpoint(self, full_rebuild: bool, base_version: str) -> Dict[str, str]:
+        if not os.path.exists(self.snapshot.checkpoint_path):
+            return {}
+        done: Dict[str, str] = {}
+        with open(self.snapshot.checkpoint_path, "r", encoding="utf-8") as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                return {}
+            if (
+                header.get("embedding_model") != AppConfig.EMBEDDING_MODEL
+                or header.get("inference_backend") != backend_tag()
+                or header.get("vector_backend") != AppConfig.VECTOR_BACKEND
+                or header.get("full_rebuild") != full_rebuild
+                or header.get("base_version") != base_version
+            ):
+                return {}
+            for line in f:
+                try:
+                    done.update(json.loads(line))
+                except ValueError:
+                    break  # Dòng cuối ghi dở khi bị ngắt
+        return done
+
+    def _start_checkpoint(self, full_rebuild: bool, base_version: str):
+        with open(self.snapshot.checkpoint_path, "w", encoding="utf-8") as f:
+            header = {
+                "base_version": base_version,
+                "embedding_model": AppConfig.EMBEDDING_MODEL,
+                "inference_backend": backend_tag(),
+                "vector_backend": AppConfig.VECTOR_BACKEND,
+                "full_rebuild": full_rebuild,
+            }
+            f.write(json.dumps(header) + "\n")
+
+    def _append_checkpoint(self, batch: List[Document]):
+        entry = {d.metadata["chunk_id"]: d.metadata["content_hash"] for d in batch}
+        with open(self.snapshot.checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    # --- Manifest: chunk_id -> content_hash của lần index gần nhất ---
+    def _load_manifest(self, manifest_path: str) -> Optional[Dict]:
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Đổi model embedding / backend suy luận / vector backend -> vector cũ
+        # không dùng lại được (manifest cũ không ghi backend: mặc định torch)
+        if manifest.get("embedding_model") != AppConfig.EMBEDDING_MODEL:
+            return None
+        if manifest.get("inference_backend", "torch") != backend_tag():
+            return None
+        if manifest.get("vector_backend", "chroma") != AppConfig.VECTOR_BACKEND:
+            return None
+        return manifest
+
+    @staticmethod
+    def _index_params() -> Dict:
+        """Tham số build ngoài nội dung chunk: đổi -> vẫn lưu + publish snapshot
+        mới (dùng lại vector đã embed), dù không chunk nào thay đổi."""
+        params = {
+            "index_units": AppConfig.INDEX_UNITS,
+            "lexical_ngram": AppConfig.LEXICAL_NGRAM,
+            "bm25_k1": AppConfig.BM25_K1,
+            "bm25_b": AppConfig.BM25_B,
+        }
+        if AppConfig.VECTOR_BACKEND == "faiss":
+            params["faiss"] = faiss_build_params()
+        return params
+
+    def _save_manifest(self, chunks: Dict[str, str], params: Dict) -> str:
+        digest = hashlib.sha256()
+        digest.update(
+            f"{AppConfig.EMBEDDING_MODEL}|{backend_tag()}|{AppConfig.VECTOR_BACKEND}\n".encode("utf-8")
+        )
+        digest.update((json.dumps(params, sort_keys=True) + "\n").encode("utf-8"))
+        for cid in sorted(chunks):
+            digest.update(f"{cid}:{chunks[cid]}\n".encode("utf-8"))
+
+        manifest = {
+            "version": digest.hexdigest()[:16],
+            "embedding_model": AppConfig.EMBEDDING_MODEL,
+            "inference_backend": backend_tag(),
+            "vector_backend": AppConfig.VECTOR_BACKEND,
+            "index_params": params,
+            "chunks": chunks,
+        }
+        tmp_path = f"{self.snapshot.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot.manifest_path)
+        return manifest["version"]
+
+
+class _VectorWriter:
+    """Thread embed + upsert vector store, nhận batch qua hàng đợi có giới hạn.
+
+    Vector store được mở (`open_db`) ở batch đầu tiên.
+    """
+
+    def __init__(self, open_db, on_written):
+        self.open_db = open_db
+        self.vector_db = None
+        self.on_written = on_written
+        self.written = 0
+        self.error: Optional[BaseException] = None
+        self._queue: queue.Queue = queue.Queue(maxsize=AppConfig.INDEXING_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="indexer-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, batch: List[Document]):
+        if self.error is not None:
+            raise self.error
+        # Block khi hàng đợi đầy -> parser không chạy quá xa phần embed
+        self._queue.put(batch)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            if self.error is not None:
+                continue  # Đã lỗi: chỉ xả hàng đợi cho tới khi close()
+            try:
+                if self.vector_db is None:
+                    self.vector_db = self.open_db()
+                self.vector_db.add_documents(batch, ids=[d.metadata["chunk_id"] for d in batch])
+                self.on_written(batch)
+                self.written += len(batch)
+            except BaseException as e:
+                self.error = e
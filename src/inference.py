@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import re
+import sys
+from typing import List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.config import AppConfig
+
+
+def resolve_device(device: str) -> str:
+    """'auto' -> 'cuda' nếu có GPU, ngược lại 'cpu'."""
+    if device != "auto":
+        return device
+    try:
+        import torch
+
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    except ImportError:
+        return "cpu"
+
+
+def configure_threads():
+    """Giới hạn số thread intra-op của PyTorch (ONNX đặt trong SessionOptions)."""
+    if not AppConfig.INFERENCE_THREADS:
+        return
+    import torch
+
+    torch.set_num_threads(AppConfig.INFERENCE_THREADS)
+
+
+def _export_dir(model_name: str) -> str:
+    return os.path.join(AppConfig.ONNX_MODEL_DIR, re.sub(r"[^\w.-]+", "_", model_name))
+
+
+def _onnx_path(export_dir: str, quantize: bool) -> str:
+    return os.path.join(export_dir, "model.int8.onnx" if quantize else "model.onnx")
+
+
+def export_onnx(model_name: str, kind: str, quantize: bool) -> str:
+    """Export model HF sang ONNX (một lần, lưu trong ONNX_MODEL_DIR).
+
+    kind = "embedding" (SentenceTransformer, xuất last_hidden_state + cấu hình
+    pooling) hoặc "reranker" (CrossEncoder, xuất logits). Nếu `quantize`, tạo
+    thêm bản int8 bằng dynamic quantization của onnxruntime.
+    """
+    export_dir = _export_dir(model_name)
+    fp32_path = _onnx_path(export_dir, quantize=False)
+    target_path = _onnx_path(export_dir, quantize)
+    if os.path.exists(target_path):
+        return target_path
+
+    import torch
+
+    os.makedirs(export_dir, exist_ok=True)
+    if not os.path.exists(fp32_path):
+        print(f"   -> 📦 Exporting {model_name} to ONNX...")
+        if kind == "embedding":
+            from sentence_transformers import SentenceTransformer
+
+            st_model = SentenceTransformer(model_name, device="cpu")
+            hf_model = st_model[0].auto_model
+            tokenizer = st_model.tokenizer
+            info = {
+                "kind": kind,
+                "max_length": st_model.max_seq_length,
+                "pooling": st_model[1].get_pooling_mode_str(),
+            }
+            sample = tokenizer(["xin chào"], return_tensors="pt")
+        else:
+            from sentence_transformers import CrossEncoder
+
+            ce_model = CrossEncoder(model_name, device="cpu")
+            hf_model = ce_model.model
+            tokenizer = ce_model.tokenizer
+            info = {
+                "kind": kind,
+                "max_length": ce_model.max_length
+                or min(tokenizer.model_max_length, 8192),
+                "sigmoid": ce_model.config.num_labels == 1,
+            }
+            sample = tokenizer(["xin chào"], ["luật"], return_tensors="pt")
+
+        class _Wrapper(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask):
+                return self.model(
+                    input_ids=input_ids, attention_mask=attention_mask, return_dict=False
+                )[0]
+
+        hf_model.eval()
+        with torch.no_grad():
+            torch.onnx.export(
+                _Wrapper(hf_model),
+                (sample["input_ids"], sample["attention_mask"]),
+                fp32_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["output"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "seq"},
+                    "attention_mask": {0: "batch", 1: "seq"},
+                    "output": {0: "batch"},
+                },
+                opset_version=17,
+            )
+        tokenizer.save_pretrained(export_dir)
+        with open(os.path.join(export_dir, "inference.json"), "w", encoding="utf-8") as f:
+            json.dump(info, f)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print(f"   -> 🗜️  Quantizing {model_name} (int8)...")
+        quantize_dynamic(
+            fp32_path,
+            target_path,
+            weight_type=QuantType.QInt8,
+            use_external_data_format=os.path.getsize(fp32_path) > (1 << 30),
+        )
+    return target_path
+
+
+class _OnnxModel:
+    def __init__(self, model_name: str, kind: str, device: str, quantize: bool):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(model_name, kind, quantize)
+        export_dir = os.path.dirname(path)
+        with open(os.path.join(export_dir, "inference.json"), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if AppConfig.INFERENCE_THREADS:
+            options.intra_op_num_threads = AppConfig.INFERENCE_THREADS
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_length = self.info["max_length"]
+
+    def run(self, *texts) -> tuple:
+        encoded = self.tokenizer(
+            *texts,
+            padding=True,
+            truncation="longest_first",
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        output = self.session.run(
+            None,
+            {
+                "input_ids": encoded["input_ids"].astype(np.int64),
+                "attention_mask": encoded["attention_mask"].astype(np.int64),
+            },
+        )[0]
+        return output, encoded["attention_mask"]
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embedding bằng ONNX Runtime, cùng pooling + normalize như SentenceTransformer."""
+
+    def __init__(self, model_name: str, device: str, quantize: bool, batch_size: int = 32):
+        self.model = _OnnxModel(model_name, "embedding", device, quantize)
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            hidden, mask = self.model.run(texts[start : start + self.batch_size])
+            if self.model.info["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = mask[..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class OnnxCrossEncoder:
+    """Thay thế CrossEncoder cho Reranker: cùng `tokenizer`, `max_length`, `predict`."""
+
+    def __init__(self, model_name: str, device: str, quantize: bool):
+        self._model = _OnnxModel(model_name, "reranker", device, quantize)
+        self.tokenizer = self._model.tokenizer
+        self.max_length = self._model.max_length
+
+    def predict(self, pairs, batch_size: int = 32, show_progress_bar: bool = False):
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start : start + batch_size]
+            logits, _ = self._model.run([p[0] for p in batch], [p[1] for p in batch])
+            scores.append(logits[:, 0])
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+        if self._model.info["sigmoid"]:
+            scores = 1 / (1 + np.exp(-scores))
+        return scores
+
+
+def backend_tag(backend: Optional[str] = None) -> str:
+    """Tên backend kèm độ chính xác ("torch", "onnx-int8", "onnx-fp32").
+
+    Vector của các backend khác nhau không dùng lẫn được: tag này nằm trong key
+    cache embedding và manifest index.
+    """
+    backend = backend or AppConfig.INFERENCE_BACKEND
+    if backend == "onnx":
+        return "onnx-int8" if AppConfig.ONNX_QUANTIZE else "onnx-fp32"
+    return backend
+
+
+def load_embedding_backend(backend: Optional[str] = None) -> Embeddings:
+    backend = backend or AppConfig.INFERENCE_BACKEND
+    device = resolve_device(AppConfig.EMBEDDING_DEVICE)
+    if backend == "onnx":
+        return OnnxEmbeddings(AppConfig.EMBEDDING_MODEL, device, AppConfig.ONNX_QUANTIZE)
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    configure_threads()
+    return HuggingFaceEmbeddings(
+        model_name=AppConfig.EMBEDDING_MODEL,
+        model_kwargs={"device": device},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+
+
+def load_cross_encoder(backend: Optional[str] = None):
+    backend = backend or AppConfig.INFERENCE_BACKEND
+    device = resolve_device(AppConfig.RERANKER_DEVICE)
+    if backend == "onnx":
+        return OnnxCrossEncoder(AppConfig.RERANKER_MODEL, device, AppConfig.ONNX_QUANTIZE)
+
+    from sentence_transformers import CrossEncoder
+
+    configure_threads()
+    return CrossEncoder(AppConfig.RERANKER_MODEL, device=device)
+
+
+def _rank_corr(a: np.ndarray, b: np.ndarray) -> float:
+    if len(a) < 2:
+        return 1.0
+    ra = np.argsort(np.argsort(a)).astype(np.float64)
+    rb = np.argsort(np.argsort(b)).astype(np.float64)
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def check_parity(ground_truth_path: str, n_candidates: int = 40, top_k: int = 5) -> dict:
+    """So sánh backend torch (fp32) và ONNX hiện tại trên data/ground_truth.json.
+
+    Ứng viên của mỗi câu hỏi lấy từ BM25 (không cần LLM/vector DB) rồi được
+    chấm bởi cả hai reranker; embedding được so bằng cosine trên cùng tập text.
+    """
+    from src.lexical import LexicalIndex
+    from src.snapshots import current_snapshot
+
+    with open(ground_truth_path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    snapshot = current_snapshot()
+    if snapshot is None:
+        raise FileNotFoundError("❌ No index snapshot found. Run 'python main.py' first.")
+    lexical_index = LexicalIndex(snapshot.lexical_path)
+
+    ref_reranker, onnx_reranker = load_cross_encoder("torch"), load_cross_encoder("onnx")
+    ref_embedder, onnx_embedder = load_embedding_backend("torch"), load_embedding_backend("onnx")
+
+    overlaps, top1, corrs, cosines = [], [], [], []
+    for item in questions:
+        docs = [d for d, _ in lexical_index.search(item["question"], n_candidates)]
+        if not docs:
+            continue
+        pairs = [[item["question"], d.page_content] for d in docs]
+        ref = np.asarray(ref_reranker.predict(pairs, batch_size=16, show_progress_bar=False))
+        new = np.asarray(onnx_reranker.predict(pairs, batch_size=16))
+        ref_top, new_top = np.argsort(-ref)[:top_k], np.argsort(-new)[:top_k]
+        overlaps.append(len(set(ref_top) & set(new_top)) / len(ref_top))
+        top1.append(float(ref_top[0] == new_top[0]))
+        corrs.append(_rank_corr(ref, new))
+
+        texts = [item["question"]] + [d.page_content for d in docs[:top_k]]
+        ref_vec = np.asarray(ref_embedder.embed_documents(texts))
+        new_vec = np.asarray(onnx_embedder.embed_documents(texts))
+        cosines.extend((ref_vec * new_vec).sum(axis=1).tolist())
+
+    return {
+        "questions": len(overlaps),
+        f"rerank_top{top_k}_overlap": float(np.mean(overlaps)),
+        "rerank_top1_agreement": float(np.mean(top1)),
+        "rerank_spearman": float(np.mean(corrs)),
+        "embedding_min_cosine": float(np.min(cosines)),
+        "embedding_mean_cosine": float(np.mean(cosines)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export ONNX / kiểm tra parity backend")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument(
+        "--ground-truth", default=os.path.join(AppConfig.ROOT_DIR, "data", "ground_truth.json")
+    )
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for name, kind in [
+            (AppConfig.EMBEDDING_MODEL, "embedding"),
+            (AppConfig.RERANKER_MODEL, "reranker"),
+        ]:
+            print(f"✅ {export_onnx(name, kind, AppConfig.ONNX_QUANTIZE)}")
+        return
+
+    try:
+        report = check_parity(args.ground_truth)
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit(2)
+    print(json.dumps(report, indent=2))
+    ok = report["rerank_top5_overlap"] >= 0.8 and report["embedding_min_cosine"] >= 0.95
+    print("✅ Parity OK" if ok else "❌ Parity FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,156 @@
+import hashlib
+import itertools
+import json
 import os
 import re
-from docx import Document
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from langchain_core.documents import Document as LangchainDocument
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from src.config import AppConfig
+from src.docx_reader import iter_paragraphs
+from src.facets import FILTER_FIELDS
+from src.scoping import vehicle_tag
+
+# Tăng version khi đổi logic parse để vô hiệu hoá cache cũ
+PARSER_VERSION = "v5"
 
 
 class VietnameseLawParser:
-    def __init__(self, data_path: str = "data/raw"):
+    def __init__(
+        self,
+        data_path: str = "data/raw",
+        cache_dir: Optional[str] = AppConfig.PARSE_CACHE_DIR,
+    ):
         self.data_path = data_path
+        self.cache_dir = cache_dir
+
+    def load_and_parse(self, workers: Optional[int] = None) -> List[LangchainDocument]:
+        return list(self.iter_documents(workers))
+
+    def iter_documents(self, workers: Optional[int] = None) -> Iterator[LangchainDocument]:
+        """Stream chunk theo thứ tự file, đã gán chunk_id (xem `iter_chunk_ids`)."""
+        chunks = (doc for _, docs in self.iter_files(workers) for doc in docs)
+        return iter_chunk_ids(chunks)
+
+    def iter_files(
+        self, workers: Optional[int] = None
+    ) -> Iterator[Tuple[str, List[LangchainDocument]]]:
+        """Yield (file_name, chunks) theo thứ tự file.
 
-    def load_and_parse(self) -> List[LangchainDocument]:
-        all_documents = []
+        File có trong parse cache được trả về ngay; file mới / đã sửa được parse
+        song song nhưng chỉ giữ tối đa 2 * workers file đang xử lý, nên bộ nhớ
+        không tăng theo số file.
+        """
         if not os.path.exists(self.data_path):
-            return []
+            return
+
+        if workers is None:
+            workers = AppConfig.INGESTION_WORKERS
 
         files = [f for f in os.listdir(self.data_path) if f.endswith(".docx")]
         print(
             f"🔄 [V4-Ultimate] Đang xử lý {len(files)} file (Fix lỗi Title & Context)..."
         )
 
-        for file_name in files:
-            file_path = os.path.join(self.data_path, file_name)
-            try:
-                docs = self._process_single_file(file_path, file_name)
-                all_documents.extend(docs)
-                print(f"   -> ✅ {file_name}: {len(docs)} chunks")
-            except Exception as e:
-                print(f"   -> ❌ Lỗi {file_name}: {e}")
-
-        return all_documents
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(files) > 1 else None
+        # (file_name, cache_key, cached docs | Future | None)
+        in_flight = deque()
+        try:
+            for file_name in files:
+                file_path = os.path.join(self.data_path, file_name)
+                cache_key = self._cache_key(file_path, file_name)
+                cached = self._load_cache(cache_key)
+                if cached is not None or pool is None:
+                    job = cached
+                else:
+                    job = pool.submit(self._process_single_file, file_path, file_name)
+                in_flight.append((file_name, file_path, cache_key, job))
+
+                # Trả kết quả theo đúng thứ tự file ngay khi file đầu hàng xong
+                while in_flight and (
+                    len(in_flight) > 2 * workers
+                    or not isinstance(in_flight[0][3], Future)
+                    or in_flight[0][3].done()
+                ):
+                    result = self._finish(*in_flight.popleft())
+                    if result is not None:
+                        yield result
+            while in_flight:
+                result = self._finish(*in_flight.popleft())
+                if result is not None:
+                    yield result
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def _finish(self, file_name: str, file_path: str, cache_key: str, job):
+        if isinstance(job, list):
+            print(f"   -> ♻️  {file_name}: {len(job)} chunks (cache)")
+            return file_name, job
+
+        if job is None:
+            docs, error = self._collect_call(file_path, file_name)
+        else:
+            docs, error = self._collect(job)
+        if error is not None:
+            print(f"   -> ❌ Lỗi {file_name}: {error}")
+            return None
+        self._save_cache(cache_key, docs)
+        print(f"   -> ✅ {file_name}: {len(docs)} chunks")
+        return file_name, docs
+
+    @staticmethod
+    def _collect(future):
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
+
+    def _collect_call(self, file_path: str, file_name: str):
+        try:
+            return self._process_single_file(file_path, file_name), None
+        except Exception as e:
+            return None, e
+
+    # --- Parse cache (key = hash nội dung file + tên file + version parser) ---
+    def _cache_key(self, file_path: str, file_name: str) -> str:
+        h = hashlib.sha256()
+        h.update(f"{PARSER_VERSION}|{file_name}|".encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _load_cache(self, cache_key: str) -> Optional[List[LangchainDocument]]:
+        if not self.cache_dir:
+            return None
+        path = os.path.join(self.cache_dir, f"{cache_key}.json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return [
+            LangchainDocument(page_content=d["content"], metadata=d["metadata"])
+            for d in data
+        ]
+
+    def _save_cache(self, cache_key: str, docs: List[LangchainDocument]):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, f"{cache_key}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                [{"content": d.page_content, "metadata": d.metadata} for d in docs],
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, path)
 
     def _get_doc_type_and_name(self, file_name: str, doc_content: List[str]) -> Dict:
         name_lower = file_name.lower()
@@ -61,143 +183,185 @@ class VietnameseLawParser:
     def _process_single_file(
         self, file_path: str, file_name: str
     ) -> List[LangchainDocument]:
-        doc = Document(file_path)
-        # Bỏ dòng trống ngay từ đầu
-        full_lines = [p.text.strip() for p in doc.paragraphs if p.text.strip()]
-        doc_info = self._get_doc_type_and_name(file_name, full_lines)
+        return self._chunk_lines(iter_paragraphs(file_path), file_name)
 
-        documents = []
+    def _chunk_lines(self, paragraphs: Iterable[str], file_name: str) -> List[LangchainDocument]:
+        return list(self._iter_chunks(paragraphs, file_name))
 
-        current_article = None
-        current_clause = None
-
-        article_re = re.compile(r"^Điều\s+(\d+)[\.:]?\s*(.*)$", re.IGNORECASE)
-        clause_re = re.compile(r"^(\d+)\.\s+(.*)$")
-        point_re = re.compile(r"^([a-zđ])\)\s+(.*)$", re.IGNORECASE)
+    def _iter_chunks(
+        self, paragraphs: Iterable[str], file_name: str
+    ) -> Iterator[LangchainDocument]:
+        """Stream chunk của một văn bản: mỗi Khoản được emit ngay khi đóng."""
+        # Bỏ dòng trống ngay từ đầu
+        lines = (text.strip() for text in paragraphs if text.strip())
+        # Số hiệu văn bản nằm trong 30 dòng đầu
+        head = list(itertools.islice(lines, 30))
+        chunker = _LawChunker(self._get_doc_type_and_name(file_name, head))
+        for line in itertools.chain(head, lines):
+            yield from chunker.feed(line)
+        yield from chunker.close()
+
+
+# Điều / Khoản / Điểm
+ARTICLE_RE = re.compile(r"^Điều\s+(\d+)[\.:]?\s*(.*)$", re.IGNORECASE)
+CLAUSE_RE = re.compile(r"^(\d+)\.\s+(.*)$")
+POINT_RE = re.compile(r"^([a-zđ])\)\s+(.*)$", re.IGNORECASE)
+
+
+class _LawChunker:
+    """State machine Điều > Khoản > Điểm, nhận từng dòng (đã strip, khác rỗng).
+
+    `feed` trả về các chunk của Khoản vừa đóng (Khoản cha + các Điểm).
+    """
+
+    def __init__(self, doc_info: Dict):
+        self.doc_info = doc_info
+        self.article = None
+        self.clause = None
+        # Dòng ngay sau "Điều x" có thể là phần tiếp của tiêu đề
+        self.title_open = False
+
+    def feed(self, line: str) -> List[LangchainDocument]:
+        if self.title_open:
+            self.title_open = False
+            # Heuristic: dòng sau không phải Khoản (1.), Điểm (a)) hay Điều mới
+            # -> là phần tiếp theo của tiêu đề
+            if not CLAUSE_RE.match(line) and not ARTICLE_RE.match(line) and not POINT_RE.match(line):
+                self.article["full_title"] += " " + line
+                return []
+
+        # 1. Phát hiện ĐIỀU
+        art_match = ARTICLE_RE.match(line)
+        if art_match:
+            chunks = self._commit_clause()
+            art_id = art_match.group(1)
+            title_part = art_match.group(2).strip()
+            self.article = {"id": art_id, "full_title": f"Điều {art_id}. {title_part}"}
+            self.clause = {"id": "intro", "content_lines": [], "points": []}
+            self.title_open = True
+            return chunks
+
+        if not self.article:
+            return []
 
-        def commit_clause():
-            if not current_clause or not current_article:
-                return
+        # 2. Phát hiện KHOẢN
+        clause_match = CLAUSE_RE.match(line)
+        if clause_match:
+            chunks = self._commit_clause()
+            self.clause = {
+                "id": clause_match.group(1),
+                "content_lines": [clause_match.group(2).strip()],
+                "points": [],
+            }
+            return chunks
+
+        # 3. Phát hiện ĐIỂM
+        point_match = POINT_RE.match(line)
+        if point_match and self.clause:
+            self.clause["points"].append(
+                {"id": point_match.group(1).lower(), "content": point_match.group(2).strip()}
+            )
+            return []
 
-            clause_intro = "\n".join(current_clause["content_lines"])
+        # 4. Nội dung nối tiếp
+        if self.clause:
+            if self.clause["points"]:
+                self.clause["points"][-1]["content"] += " " + line
+            else:
+                self.clause["content_lines"].append(line)
+        return []
 
-            # Thêm Tên Luật vào đầu mỗi chunk
-            context_header = f"{doc_info['law_name']} > {current_article['full_title']}"
+    def close(self) -> List[LangchainDocument]:
+        return self._commit_clause()
 
-            # 1. Parent Chunk
-            full_text = (
-                f"{context_header}\nKhoản {current_clause['id']}: {clause_intro}"
+    def _commit_clause(self) -> List[LangchainDocument]:
+        article, clause, doc_info = self.article, self.clause, self.doc_info
+        if not clause or not article:
+            return []
+        if "vehicle" not in article:
+            # Loại phương tiện theo tiêu đề Điều ("" = Điều chung)
+            article["vehicle"] = vehicle_tag(article["full_title"])
+
+        clause_intro = "\n".join(clause["content_lines"])
+
+        # Thêm Tên Luật vào đầu mỗi chunk
+        context_header = f"{doc_info['law_name']} > {article['full_title']}"
+
+        # 1. Parent Chunk
+        full_text = f"{context_header}\nKhoản {clause['id']}: {clause_intro}"
+        for p in clause["points"]:
+            full_text += f"\nĐiểm {p['id']}) {p['content']}"
+
+        documents = [
+            LangchainDocument(
+                page_content=full_text,
+                metadata={
+                    **doc_info,
+                    "article": article["id"],
+                    "clause": clause["id"],
+                    "point": "all",
+                    "vehicle": article["vehicle"],
+                    "citation": f"{doc_info['law_name']} - Điều {article['id']} Khoản {clause['id']}",
+                    "is_parent": True,
+                },
+            )
+        ]
+
+        # 2. Child Chunks
+        for p in clause["points"]:
+            # Inject full context: Luật > Điều > Khoản > Điểm
+            enriched_content = (
+                f"{context_header}\n"
+                f"Khoản {clause['id']}: {clause_intro}\n"
+                f"Điểm {p['id']}) {p['content']}"
             )
-            for p in current_clause["points"]:
-                full_text += f"\nĐiểm {p['id']}) {p['content']}"
-
             documents.append(
                 LangchainDocument(
-                    page_content=full_text,
+                    page_content=enriched_content,
                     metadata={
                         **doc_info,
-                        "article": current_article["id"],
-                        "clause": current_clause["id"],
-                        "point": "all",
-                        "citation": f"{doc_info['law_name']} - Điều {current_article['id']} Khoản {current_clause['id']}",
-                        "is_parent": True,
+                        "article": article["id"],
+                        "clause": clause["id"],
+                        "point": p["id"],
+                        "vehicle": article["vehicle"],
+                        "citation": f"{doc_info['law_name']} - Điều {article['id']} Khoản {clause['id']} Điểm {p['id']}",
+                        "is_parent": False,
                     },
                 )
             )
+        return documents
 
-            # 2. Child Chunks
-            for p in current_clause["points"]:
-                # Inject full context: Luật > Điều > Khoản > Điểm
-                enriched_content = (
-                    f"{context_header}\n"
-                    f"Khoản {current_clause['id']}: {clause_intro}\n"
-                    f"Điểm {p['id']}) {p['content']}"
-                )
 
-                documents.append(
-                    LangchainDocument(
-                        page_content=enriched_content,
-                        metadata={
-                            **doc_info,
-                            "article": current_article["id"],
-                            "clause": current_clause["id"],
-                            "point": p["id"],
-                            "citation": f"{doc_info['law_name']} - Điều {current_article['id']} Khoản {current_clause['id']} Điểm {p['id']}",
-                            "is_parent": False,
-                        },
-                    )
-                )
+def assign_chunk_ids(documents: List[LangchainDocument]) -> List[LangchainDocument]:
+    return list(iter_chunk_ids(documents))
 
-        i = 0
-        while i < len(full_lines):
-            line = full_lines[i]
-
-            # 1. Phát hiện ĐIỀU
-            art_match = article_re.match(line)
-            if art_match:
-                commit_clause()
-                current_clause = None
-
-                art_id = art_match.group(1)
-                title_part = art_match.group(2).strip()
-
-                # Nếu tiêu đề ngắn (rỗng hoặc chỉ có dấu chấm), hoặc dòng tiếp theo viết hoa toàn bộ -> Nối dòng tiếp theo vào
-                full_title = f"Điều {art_id}. {title_part}"
-
-                # Kiểm tra dòng tiếp theo (Lookahead)
-                if i + 1 < len(full_lines):
-                    next_line = full_lines[i + 1]
-                    # Logic heuristic: Nếu dòng sau không phải Khoản (1.), không phải Điểm (a)), và không phải Điều mới
-                    # Thường tiêu đề Điều viết hoa hoặc đậm, nhưng ở đây ta check đơn giản:
-                    if (
-                        not clause_re.match(next_line)
-                        and not article_re.match(next_line)
-                        and not point_re.match(next_line)
-                    ):
-                        # Giả định đó là phần tiếp theo của tiêu đề
-                        full_title += " " + next_line
-                        i += 1  # Bỏ qua dòng tiếp theo vì đã gộp rồi
-
-                current_article = {"id": art_id, "full_title": full_title}
-                current_clause = {"id": "intro", "content_lines": [], "points": []}
-                i += 1
-                continue
-
-            if not current_article:
-                i += 1
-                continue
-
-            # 2. Phát hiện KHOẢN
-            clause_match = clause_re.match(line)
-            if clause_match:
-                commit_clause()
-                current_clause = {
-                    "id": clause_match.group(1),
-                    "content_lines": [clause_match.group(2).strip()],
-                    "points": [],
-                }
-                i += 1
-                continue
-
-            # 3. Phát hiện ĐIỂM
-            point_match = point_re.match(line)
-            if point_match and current_clause:
-                current_clause["points"].append(
-                    {
-                        "id": point_match.group(1).lower(),
-                        "content": point_match.group(2).strip(),
-                    }
-                )
-                i += 1
-                continue
 
-            # 4. Nội dung nối tiếp
-            if current_clause:
-                if current_clause["points"]:
-                    current_clause["points"][-1]["content"] += " " + line
-                else:
-                    current_clause["content_lines"].append(line)
-            i += 1
+def iter_chunk_ids(documents: Iterable[LangchainDocument]) -> Iterator[LangchainDocument]:
+    """Gán ID ổn định (law_id|điều|khoản|điểm), parent_id và hash nội dung cho từng chunk.
 
-        commit_clause()
-        return documents
+    ID chỉ phụ thuộc vị trí trong văn bản nên không đổi khi nội dung được sửa;
+    `content_hash` (nội dung + các trường dùng để lọc) cho biết chunk nào cần
+    ghi lại vào index. Văn bản lặp lại cùng một Điều/Khoản (VD: Nghị định
+    sửa đổi) được đánh số thứ tự `#2`, `#3`...
+    """
+    seen: Dict[str, int] = {}
+    parent_id = None
+    for doc in documents:
+        meta = doc.metadata
+        base_id = (
+            f"{meta['law_id']}|{meta['article']}|{meta['clause']}|{meta['point']}"
+        )
+        seen[base_id] = seen.get(base_id, 0) + 1
+        chunk_id = base_id if seen[base_id] == 1 else f"{base_id}#{seen[base_id]}"
+
+        meta["chunk_id"] = chunk_id
+        # Parser luôn emit chunk Khoản (parent) ngay trước các Điểm (child) của nó
+        if meta["is_parent"]:
+            parent_id = chunk_id
+        else:
+            meta["parent_id"] = parent_id
+        facets = "|".join(str(meta.get(field, "")) for field in FILTER_FIELDS)
+        meta["content_hash"] = hashlib.sha1(
+            f"{doc.page_content}\n{facets}".encode("utf-8")
+        ).hexdigest()
+        yield doc
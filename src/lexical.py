@@ -0,0 +1,299 @@
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from src.config import AppConfig
+from src.facets import FacetIndex
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TOKEN_BYTES = 48  # Token dài hơn (URL, chuỗi số dài...) bị bỏ qua
+
+
+def fold_diacritics(text: str) -> str:
+    """'Vượt đèn đỏ' -> 'vuot den do' (chữ thường, bỏ dấu, đ -> d)."""
+    text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    return "".join(c for c in text if unicodedata.category(c) != "Mn")
+
+
+def tokenize(text: str, ngram: int = 2) -> List[str]:
+    """Tách âm tiết đã bỏ dấu + n-gram âm tiết (VD: 'den_do').
+
+    Tiếng Việt viết tách âm tiết nên n-gram giúp khớp từ ghép ("đèn đỏ"),
+    còn bỏ dấu giúp khớp câu hỏi gõ không dấu.
+    """
+    syllables = _WORD_RE.findall(fold_diacritics(text))
+    tokens = list(syllables)
+    for n in range(2, ngram + 1):
+        tokens += ["_".join(syllables[i : i + n]) for i in range(len(syllables) - n + 1)]
+    return [t for t in tokens if len(t.encode("utf-8")) <= MAX_TOKEN_BYTES]
+
+
+class LexicalIndexBuilder:
+    """Gom postings theo từng document rồi ghi ra các mảng NumPy dạng CSR.
+
+    `add` có thể gọi nhiều lần với từng batch: nội dung document được ghi
+    thẳng ra file tạm; postings gom trong RAM tới LEXICAL_SPILL_POSTINGS cặp
+    (doc_id, tf) thì được ghi ra đĩa thành một run CSR đã sắp theo term.
+    `save` trộn các run theo term và ghi doc_ids/tfs qua memmap, nên bộ nhớ
+    đỉnh chỉ còn tăng theo vocab và 12 byte/doc (độ dài doc, offset record).
+    """
+
+    def __init__(self, ngram: int = AppConfig.LEXICAL_NGRAM):
+        self.ngram = ngram
+        self.postings: Dict[str, array] = {}
+        self.doc_lens = array("i")
+        self.record_lens = array("q")
+        self.facets = FacetIndex()
+        self._records = tempfile.TemporaryFile()
+        self._n_postings = 0
+        self._runs_dir = tempfile.TemporaryDirectory(prefix="bm25-runs-")
+        self._runs: List[Dict[str, np.ndarray]] = []
+
+    def add(self, documents: Iterable[Document]):
+        for doc in documents:
+            doc_id = len(self.doc_lens)
+            tokens = tokenize(doc.page_content, self.ngram)
+            counts = Counter(tokens)
+            for term, tf in counts.items():
+                plist = self.postings.get(term)
+                if plist is None:
+                    plist = self.postings[term] = array("i")
+                plist.extend((doc_id, tf))
+            self._n_postings += len(counts)
+            self.doc_lens.append(len(tokens))
+            self.facets.add(doc.metadata)
+            record = {"content": doc.page_content, "metadata": doc.metadata}
+            data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            self._records.write(data)
+            self.record_lens.append(len(data))
+            if self._n_postings >= AppConfig.LEXICAL_SPILL_POSTINGS:
+                self._spill()
+
+    def _spill(self):
+        """Ghi postings đang giữ trong RAM ra một run (vocab, indptr, doc_ids, tfs)."""
+        if not self.postings:
+            return
+        terms = sorted(t.encode("utf-8") for t in self.postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            indptr[i + 1] = indptr[i] + len(self.postings[term.decode("utf-8")]) // 2
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            plist = np.frombuffer(self.postings.pop(term.decode("utf-8")), dtype=np.int32)
+            doc_ids[indptr[i] : indptr[i + 1]] = plist[0::2]
+            tfs[indptr[i] : indptr[i + 1]] = plist[1::2]
+
+        run_dir = os.path.join(self._runs_dir.name, f"run{len(self._runs):05d}")
+        os.makedirs(run_dir)
+        arrays = {
+            "vocab": np.asarray(terms, dtype=f"S{MAX_TOKEN_BYTES}"),
+            "indptr": indptr,
+            "doc_ids": doc_ids,
+            "tfs": tfs,
+        }
+        run = {}
+        for name, values in arrays.items():
+            path = os.path.join(run_dir, f"{name}.npy")
+            np.save(path, values)
+            run[name] = np.load(path, mmap_mode="r")
+        self._runs.append(run)
+        self.postings = {}
+        self._n_postings = 0
+
+    def _merge_runs(self, out_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Trộn các run thành CSR cuối (doc_ids/tfs ghi thẳng ra out_dir).
+
+        Run sau chứa doc_id lớn hơn run trước nên posting list của một term là
+        các đoạn của từng run nối theo thứ tự run. Trả về (vocab, indptr).
+        """
+        self._spill()
+        vocab = np.unique(
+            np.concatenate([run["vocab"] for run in self._runs])
+            if self._runs
+            else np.zeros(0, dtype=f"S{MAX_TOKEN_BYTES}")
+        ).astype(f"S{MAX_TOKEN_BYTES}")
+        positions = [np.searchsorted(vocab, run["vocab"]) for run in self._runs]
+
+        df = np.zeros(len(vocab), dtype=np.int64)
+        for run, pos in zip(self._runs, positions):
+            df[pos] += np.diff(run["indptr"])
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        nnz = int(indptr[-1])
+        doc_ids_path = os.path.join(out_dir, "doc_ids.npy")
+        tfs_path = os.path.join(out_dir, "tfs.npy")
+        if nnz == 0:  # memmap không mở được mảng rỗng
+            np.save(doc_ids_path, np.zeros(0, dtype=np.int32))
+            np.save(tfs_path, np.zeros(0, dtype=np.float32))
+            return vocab, indptr
+        doc_ids = np.lib.format.open_memmap(doc_ids_path, mode="w+", dtype=np.int32, shape=(nnz,))
+        tfs = np.lib.format.open_memmap(tfs_path, mode="w+", dtype=np.float32, shape=(nnz,))
+        fill = indptr[:-1].copy()  # Vị trí ghi tiếp theo của từng term
+        for run, pos in zip(self._runs, positions):
+            lengths = np.diff(run["indptr"])
+            # Đích của posting thứ i trong run = fill[term] + (i - đầu đoạn của term)
+            dest = np.repeat(fill[pos] - run["indptr"][:-1], lengths) + np.arange(
+                len(run["doc_ids"]), dtype=np.int64
+            )
+            doc_ids[dest] = run["doc_ids"]
+            tfs[dest] = run["tfs"]
+            fill[pos] += lengths
+        doc_ids.flush()
+        tfs.flush()
+        del doc_ids, tfs
+        return vocab, indptr
+
+    def save(self, index_dir: str):
+        k1, b = AppConfig.BM25_K1, AppConfig.BM25_B
+        n_docs = len(self.doc_lens)
+
+        # Ghi vào thư mục tạm rồi rename để reader không thấy index ghi dở
+        tmp_dir = f"{index_dir}.tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        terms, indptr = self._merge_runs(tmp_dir)
+        self._runs = []
+        self._runs_dir.cleanup()
+
+        # Okapi BM25: idf luôn dương, phần chuẩn hoá độ dài tính sẵn cho từng doc
+        df = np.diff(indptr).astype(np.float64)
+        idf = np.log((n_docs - df + 0.5) / (df + 0.5) + 1.0).astype(np.float32)
+        doc_len = np.asarray(self.doc_lens, dtype=np.float32)
+        avgdl = float(doc_len.mean()) if n_docs else 1.0
+        doc_norm = (k1 * (1 - b + b * doc_len / max(avgdl, 1e-9))).astype(np.float32)
+
+        offsets = np.zeros(n_docs + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.frombuffer(self.record_lens, dtype=np.int64))
+
+        np.save(os.path.join(tmp_dir, "vocab.npy"), terms)
+        np.save(os.path.join(tmp_dir, "indptr.npy"), indptr)
+        np.save(os.path.join(tmp_dir, "idf.npy"), idf)
+        np.save(os.path.join(tmp_dir, "doc_norm.npy"), doc_norm)
+        np.save(os.path.join(tmp_dir, "doc_offsets.npy"), offsets)
+        self.facets.save(tmp_dir)
+        self._records.seek(0)
+        with open(os.path.join(tmp_dir, "docs.jsonl"), "wb") as f:
+            shutil.copyfileobj(self._records, f)
+        self._records.close()
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_docs": n_docs, "k1": k1, "b": b, "ngram": self.ngram}, f)
+
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir)
+        os.replace(tmp_dir, index_dir)
+
+
+class LexicalIndex:
+    """BM25 trên postings CSR memory-mapped.
+
+    Các mảng được mở bằng `mmap_mode="r"` nên load gần như tức thì và nhiều
+    worker process dùng chung page cache của OS thay vì mỗi process một bản.
+    """
+
+    def __init__(self, index_dir: str, k: int = AppConfig.RETRIEVAL_BM25_K):
+        self.index_dir = index_dir
+        self.k = k
+
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n_docs = meta["n_docs"]
+        self.k1 = meta["k1"]
+        self.ngram = meta["ngram"]
+
+        def load(name):
+            return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.vocab = load("vocab")
+        self.indptr = load("indptr")
+        self.doc_ids = load("doc_ids")
+        self.tfs = load("tfs")
+        self.idf = load("idf")
+        self.doc_norm = load("doc_norm")
+        self.doc_offsets = load("doc_offsets")
+
+        self._docs_file = open(os.path.join(index_dir, "docs.jsonl"), "rb")
+        self._docs = (
+            mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.n_docs
+            else b""
+        )
+        self._facets = FacetIndex.load(index_dir)
+
+    @property
+    def facets(self) -> FacetIndex:
+        if self._facets is None:
+            # Index build trước khi có facet: dựng từ metadata của docs.jsonl
+            facets = FacetIndex()
+            for doc_id in range(self.n_docs):
+                facets.add(self.get_document(doc_id).metadata)
+            self._facets = facets
+        return self._facets
+
+    @classmethod
+    def build(cls, documents: Iterable[Document], index_dir: str) -> "LexicalIndex":
+        builder = LexicalIndexBuilder()
+        builder.add(documents)
+        builder.save(index_dir)
+        return cls(index_dir)
+
+    def _term_ids(self, query: str) -> Dict[int, int]:
+        term_ids = {}
+        if not len(self.vocab):
+            return term_ids
+        for term, qtf in Counter(tokenize(query, self.ngram)).items():
+            key = term.encode("utf-8")
+            pos = int(np.searchsorted(self.vocab, key))
+            if pos < len(self.vocab) and self.vocab[pos] == key:
+                term_ids[pos] = qtf
+        return term_ids
+
+    def score(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for tid, qtf in self._term_ids(query).items():
+            start, end = self.indptr[tid], self.indptr[tid + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            # doc_ids trong một posting list là duy nhất -> cộng trực tiếp được
+            scores[docs] += qtf * self.idf[tid] * tf * (self.k1 + 1) / (tf + self.doc_norm[docs])
+        return scores
+
+    def get_document(self, doc_id: int) -> Document:
+        start, end = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+        record = json.loads(self._docs[start:end])
+        return Document(page_content=record["content"], metadata=record["metadata"])
+
+    def search(
+        self, query: str, k: Optional[int] = None, filters: Optional[Dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """Top-k BM25; `filters` (đã normalize_filters) giới hạn trong các doc khớp."""
+        k = min(k or self.k, self.n_docs)
+        if k <= 0:
+            return []
+        scores = self.score(query)
+        if filters:
+            scores[~self.facets.mask(filters)] = 0
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.get_document(int(i)), float(scores[i])) for i in top if scores[i] > 0]
+
+    def invoke(self, query: str) -> List[Document]:
+        return [doc for doc, _ in self.search(query)]
+
+    def close(self):
+        self.indptr = self.doc_ids = self.tfs = self.doc_norm = self.doc_offsets = None
+        if self._docs_file is not None:
+            if self.n_docs:
+                self._docs.close()
+            self._docs_file.close()
+            self._docs_file = None
@@ -0,0 +1,51 @@
+import re
+from typing import Any, Iterator, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from src.prompts import QUERY_TRANSFORM_SYSTEM
+
+
+class StubLLM(BaseChatModel):
+    """LLM giả lập, chạy offline và cho kết quả xác định (benchmark, batch, test).
+
+    - Prompt viết lại câu hỏi: trả về nguyên câu hỏi của người dùng.
+    - Prompt trả lời: liệt kê các nguồn có trong CONTEXT.
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        system = messages[0].content if messages else ""
+        question = messages[-1].content if messages else ""
+        if system.startswith(QUERY_TRANSFORM_SYSTEM):
+            return re.sub(r"^Câu hỏi:\s*", "", question).strip()
+
+        sources = re.findall(r"^\[(\d+)\] ([^:\n]+):", system, re.MULTILINE)
+        if not sources:
+            return "Không có thông tin trong tài liệu được cung cấp."
+        lines = [f"Câu hỏi: {question}", "Căn cứ:"]
+        lines += [f"- [{i}] {citation}" for i, citation in sources]
+        return "\n".join(lines)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = AIMessage(content=self._respond(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        for token in re.findall(r"\S+\s*", self._respond(messages)):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
@@ -0,0 +1,136 @@
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import httpx
+from langchain_core.embeddings import Embeddings
+from src.config import AppConfig
+from src.reranker import Reranker
+
+
+# --- Client (chạy trong các API worker) ---
+class _ModelClient:
+    def __init__(self, url: str, timeout: float = AppConfig.MODEL_SERVER_TIMEOUT):
+        self.url = url.rstrip("/")
+        # httpx.Client dùng chung giữa các thread (connection pool có khoá)
+        self._http = httpx.Client(base_url=self.url, timeout=timeout)
+
+    def post(self, path: str, payload: dict) -> dict:
+        response = self._http.post(path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embedding qua model server: worker không load model embedding."""
+
+    def __init__(self, url: str):
+        self.client = _ModelClient(url)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.client.post("/embed", {"texts": texts, "kind": "doc"})["vectors"]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.post("/embed", {"texts": [text], "kind": "query"})["vectors"][0]
+
+
+class RemoteReranker(Reranker):
+    """Reranker chấm điểm qua model server.
+
+    Cache điểm, sắp xếp top-k và `rank_many` giữ nguyên như Reranker (chạy
+    trong worker); chỉ phần forward pass được gửi đi. Request từ mọi worker
+    được server gom chung batch (RERANKER_COALESCE_MS).
+    """
+
+    def __init__(self, url: str):
+        print(f"⚖️  [Reranker] Using model server: {url}")
+        self.client = _ModelClient(url)
+        self._score_cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _schedule(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return self._remote_scores(pairs, coalesce=True)
+
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return self._remote_scores(pairs, coalesce=False)
+
+    def _remote_scores(self, pairs, coalesce: bool) -> List[float]:
+        payload = {"pairs": [list(p) for p in pairs], "coalesce": coalesce}
+        return self.client.post("/score", payload)["scores"]
+
+
+# --- Server (một process giữ model cho mọi worker) ---
+def create_app():
+    """App FastAPI phục vụ /embed và /score; model load song song lúc khởi động."""
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI, HTTPException
+    from pydantic import BaseModel
+    from src.embeddings import get_embedding_model
+
+    models = {}
+
+    @asynccontextmanager
+    async def lifespan(app):
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-init") as pool:
+            embedding = pool.submit(get_embedding_model, True)
+            reranker = pool.submit(Reranker)
+            models["embedding"] = embedding.result()
+            models["reranker"] = reranker.result()
+        print(f"   -> ✅ Model server ready ({AppConfig.EMBEDDING_MODEL}, {AppConfig.RERANKER_MODEL})")
+        yield
+
+    app = FastAPI(title="Traffic Law RAG - model server", lifespan=lifespan)
+
+    class EmbedRequest(BaseModel):
+        texts: List[str]
+        kind: str = "doc"
+
+    class ScoreRequest(BaseModel):
+        pairs: List[Tuple[str, str]]
+        coalesce: bool = True
+
+    @app.get("/health")
+    def health():
+        return {
+            "status": "ok",
+            "embedding_model": AppConfig.EMBEDDING_MODEL,
+            "reranker_model": AppConfig.RERANKER_MODEL,
+        }
+
+    # Handler sync -> FastAPI chạy trên threadpool, các request song song
+    # gặp nhau ở scheduler của Reranker
+    @app.post("/embed")
+    def embed(request: EmbedRequest):
+        model = models["embedding"]
+        if request.kind == "query":
+            return {"vectors": [model.embed_query(t) for t in request.texts]}
+        if request.kind != "doc":
+            raise HTTPException(status_code=422, detail=f"Unknown kind: {request.kind}")
+        return {"vectors": model.embed_documents(request.texts)}
+
+    @app.post("/score")
+    def score(request: ScoreRequest):
+        reranker = models["reranker"]
+        if request.coalesce:
+            return {"scores": reranker._schedule(request.pairs)}
+        return {"scores": reranker._score_pairs(request.pairs)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model server: embedding + reranker dùng chung")
+    parser.add_argument("--host", default=AppConfig.MODEL_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=AppConfig.MODEL_SERVER_PORT)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
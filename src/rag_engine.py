@@ -1,105 +1,698 @@
-import pickle
+import asyncio
+import contextvars
+import functools
 import os
-from langchain_chroma import Chroma
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+from langchain_core.documents import Document
+from src.cache import QueryCache
+from src.chunk_store import ChunkStore
+from src.citations import CitationIndex
 from src.config import AppConfig
-from src.prompts import get_answer_prompt, get_query_transform_prompt
+from src.context import build_context
+from src.embeddings import get_embedding_model
+from src.facets import normalize_filters
+from src.fusion import adaptive_cutoff, boost_scope, fuse
+from src.lexical import LexicalIndex
 from src.reranker import Reranker
+from src.scoping import infer_filters
+from src.snapshots import IndexSnapshot, current_snapshot, current_version
+from src.telemetry import annotate, get_tracer
+from src.vector_store import open_vector_store
+
+
+_pinned_index: contextvars.ContextVar = contextvars.ContextVar("rag_index", default=None)
+
+
+class _Component:
+    """Thuộc tính được load nền: đọc sẽ chờ tới khi component sẵn sàng."""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance._components[self.name].result()
+
+    def __set__(self, instance, value):
+        future = Future()
+        future.set_result(value)
+        instance._components[self.name] = future
+
+
+class _IndexComponent(_Component):
+    """Component thuộc snapshot index: lấy từ snapshot mà request đang ghim."""
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance._active_index(), self.name)
+
+    def __set__(self, instance, value):
+        setattr(instance._index, self.name, value)
+
+
+def _pinned(method):
+    """Ghim snapshot index trong suốt request: đổi snapshot giữa chừng không
+    ảnh hưởng query đang chạy (kể cả phần chạy trên executor)."""
+    if asyncio.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            with self.pin_index():
+                return await method(self, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.pin_index():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _close_component(future: Future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), "close", None)
+    if close is not None:
+        close()
+
+
+class LoadedIndex:
+    """Các component đọc từ một snapshot (vector store, BM25, ChunkStore,
+    citation index, cache). Model (embedding, reranker, LLM) thuộc engine và
+    được dùng lại khi đổi snapshot."""
+
+    vector_db = _Component()
+    lexical_index = _Component()
+    chunk_store = _Component()
+    citation_index = _Component()
+    rewrite_cache = _Component()
+    answer_cache = _Component()
+
+    def __init__(self, engine: "TrafficLawRAG", snapshot: Optional[IndexSnapshot], pool):
+        self.engine = engine
+        self.snapshot = snapshot
+        self.version = snapshot.version if snapshot else ""
+        self._components = {}
+        # Số request đang ghim bản này; bản đã bị thay (retired) được đóng khi về 0
+        self._pins = 0
+        self._retired = False
+        self._pin_lock = threading.Lock()
+        # citation_index chờ chunk_store (submit trước) -> FIFO không deadlock
+        loaders = {
+            "vector_db": self._load_vector_db,
+            "lexical_index": self._load_lexical_index,
+            "chunk_store": self._load_chunk_store,
+            "citation_index": self._load_citation_index,
+            "rewrite_cache": functools.partial(self._load_cache, "rewrite"),
+            "answer_cache": functools.partial(self._load_cache, "answer"),
+        }
+        for name, loader in loaders.items():
+            self._components[name] = pool.submit(loader)
+
+    def wait(self):
+        for future in list(self._components.values()):
+            future.result()
+
+    def acquire(self):
+        with self._pin_lock:
+            self._pins += 1
+
+    def release(self):
+        with self._pin_lock:
+            self._pins -= 1
+            close = self._retired and self._pins == 0
+        if close:
+            self.close()
+
+    def retire(self):
+        """Bản này đã bị thay: đóng ngay nếu không còn request nào ghim."""
+        with self._pin_lock:
+            self._retired = True
+            close = self._pins == 0
+        if close:
+            self.close()
+
+    def close(self):
+        """Đóng handle (SQLite của cache, mmap của BM25/FAISS), kể cả component đang load."""
+        for future in list(self._components.values()):
+            future.add_done_callback(_close_component)
+
+    def _require_snapshot(self) -> IndexSnapshot:
+        if self.snapshot is None:
+            raise FileNotFoundError("❌ No index snapshot found. Run 'python main.py' first.")
+        return self.snapshot
+
+    def _load_vector_db(self):
+        # 2. Vector DB (Chroma hoặc FAISS, theo AppConfig.VECTOR_BACKEND)
+        return open_vector_store(
+            self.engine.embedding_model, self._require_snapshot().vector_path()
+        )
+
+    def _load_lexical_index(self):
+        # 3. BM25 (memory-mapped)
+        return LexicalIndex(self._require_snapshot().lexical_path, k=AppConfig.RETRIEVAL_BM25_K)
+
+    def _load_chunk_store(self):
+        # 3b. Cây Điều/Khoản/Điểm để gộp ứng viên trước khi rerank
+        path = self._require_snapshot().chunk_store_path
+        if not os.path.exists(path):
+            return None
+        return ChunkStore.load(path)
+
+    def _load_citation_index(self):
+        # 3c. Index trích dẫn: "Điều 6 khoản 9 Nghị định 168" -> tra thẳng
+        path = self._require_snapshot().citation_index_path
+        if not os.path.exists(path) or self.chunk_store is None:
+            return None
+        return CitationIndex.load(path)
+
+    def _load_cache(self, namespace: str):
+        # 7. Cache query rewrite & câu trả lời (gắn với version của snapshot)
+        embedding_model = (
+            self.engine.embedding_model if AppConfig.SEMANTIC_CACHE_THRESHOLD else None
+        )
+        return QueryCache(namespace, index_version=self.version, embedding_model=embedding_model)
 
 
 class TrafficLawRAG:
-    def __init__(self):
-        print(f"🚀 [RAG Engine] Starting... (LLM: {AppConfig.LLM_MODEL_NAME})")
-
-        # 1. Embeddings
-        self.embedding_model = HuggingFaceEmbeddings(
-            model_name=AppConfig.EMBEDDING_MODEL,
-            model_kwargs={"device": AppConfig.EMBEDDING_DEVICE},
-            encode_kwargs={"normalize_embeddings": True},
+    embedding_model = _Component()
+    reranker = _Component()
+    llm = _Component()
+    answer_prompt = _Component()
+    query_transform_prompt = _Component()
+    vector_db = _IndexComponent()
+    lexical_index = _IndexComponent()
+    chunk_store = _IndexComponent()
+    citation_index = _IndexComponent()
+    rewrite_cache = _IndexComponent()
+    answer_cache = _IndexComponent()
+
+    def __init__(self, llm=None, lazy: bool = False, warmup: bool = AppConfig.STARTUP_WARMUP):
+        """Khởi tạo engine, load các component song song trên thread nền.
+
+        lazy=False: chờ load xong như trước. lazy=True: trả về ngay; component
+        nào chưa sẵn sàng sẽ được chờ khi dùng tới lần đầu, còn `ready` /
+        `wait_until_ready()` cho biết khi nào replica phục vụ được đầy đủ.
+        """
+        print(
+            f"🚀 [RAG Engine] Starting... (LLM: {AppConfig.LLM_MODEL_NAME if llm is None else type(llm).__name__})"
         )
+        self._started_at = time.perf_counter()
+        self._components = {}
+        self.ready = threading.Event()
+        self.startup_error = None
+
+        # 8. Tracing từng bước (sink cấu hình qua AppConfig.TELEMETRY_SINKS)
+        self.tracer = get_tracer()
 
-        # 2. Vector DB
-        self.vector_db = Chroma(
-            persist_directory=AppConfig.VECTOR_DB_DIR,
-            embedding_function=self.embedding_model,
+        # 9. Thread pool cho các bước CPU-bound/blocking của API async
+        self._executor = ThreadPoolExecutor(
+            max_workers=AppConfig.ASYNC_WORKERS, thread_name_prefix="rag"
         )
 
-        # 3. BM25
-        with open(AppConfig.BM25_PATH, "rb") as f:
-            self.bm25_retriever = pickle.load(f)
-        self.bm25_retriever.k = AppConfig.RETRIEVAL_BM25_K
+        # Model nặng (embedding, reranker) và index load song song
+        self._init_pool = ThreadPoolExecutor(
+            max_workers=AppConfig.STARTUP_WORKERS, thread_name_prefix="rag-init"
+        )
+        # Thứ tự submit = thứ tự phụ thuộc (index chờ embedding_model) ->
+        # hàng đợi FIFO không bị deadlock
+        self._components["embedding_model"] = self._init_pool.submit(self._load_embedding_model)
+        self._index = LoadedIndex(self, current_snapshot(), self._init_pool)
+        self._reload_lock = threading.Lock()
+        self._swap_lock = threading.Lock()  # Ghim và đổi self._index không xen nhau
+        self._closed = threading.Event()
+        loaders = {
+            "reranker": self._load_reranker,
+            "llm": (lambda: llm) if llm is not None else self._load_llm,
+            "answer_prompt": self._load_answer_prompt,
+            "query_transform_prompt": self._load_query_transform_prompt,
+        }
+        for name, loader in loaders.items():
+            self._components[name] = self._init_pool.submit(loader)
+
+        threading.Thread(
+            target=self._finish_startup, args=(warmup,), name="rag-ready", daemon=True
+        ).start()
+        if not lazy:
+            self.wait_until_ready()
+
+    # --- Startup ---
+    def wait_until_ready(self, timeout=None) -> bool:
+        """Chờ mọi component (và warm-up) xong; raise nếu khởi tạo lỗi."""
+        finished = self.ready.wait(timeout)
+        if self.startup_error is not None:
+            raise self.startup_error
+        return finished
+
+    def _finish_startup(self, warmup: bool):
+        try:
+            for future in list(self._components.values()):
+                future.result()
+            self._index.wait()
+            if warmup:
+                self._warmup(self._index)
+            print(f"   -> ✅ RAG Engine ready in {time.perf_counter() - self._started_at:.1f}s")
+        except Exception as e:
+            self.startup_error = e
+        finally:
+            self._init_pool.shutdown(wait=False)
+            self.ready.set()
+        if self.startup_error is None and AppConfig.SNAPSHOT_POLL_INTERVAL > 0:
+            threading.Thread(target=self._watch_snapshots, name="rag-reload", daemon=True).start()
+
+    def _warmup(self, index: LoadedIndex):
+        """Chạy thử embedding, 2 retriever và reranker (không gọi LLM)."""
+        query = AppConfig.WARMUP_QUERY
+        docs = [d for d, _ in index.lexical_index.search(query, 2)]
+        index.vector_db.similarity_search(query, k=1)
+        self.reranker.rank_documents(query, docs)
+
+    def _load_embedding_model(self):
+        # 1. Embeddings (dùng chung cache với Indexer)
+        return get_embedding_model()
+
+    @staticmethod
+    def _load_reranker():
+        # 4. Reranker (hoặc model server dùng chung giữa các worker)
+        if AppConfig.MODEL_SERVER_URL:
+            from src.model_server import RemoteReranker
+
+            return RemoteReranker(AppConfig.MODEL_SERVER_URL)
+        return Reranker()
+
+    # --- Snapshot index: nạp bản mới ở nền, query đang chạy giữ bản cũ ---
+    @property
+    def index_version(self) -> str:
+        return self._index.version
+
+    def _active_index(self) -> LoadedIndex:
+        pinned = _pinned_index.get()
+        if pinned is not None and pinned.engine is self:
+            return pinned
+        return self._index
 
-        # 4. Reranker
-        self.reranker = Reranker()
+    @contextmanager
+    def pin_index(self):
+        if _pinned_index.get() is not None:
+            yield
+            return
+        with self._swap_lock:
+            index = self._index
+            index.acquire()
+        token = _pinned_index.set(index)
+        try:
+            yield
+        finally:
+            _pinned_index.reset(token)
+            index.release()
+
+    def reload_index(self, force: bool = False) -> bool:
+        """Nạp snapshot CURRENT (nếu khác bản đang dùng) rồi đổi con trỏ.
+
+        Load + warm-up bản mới trên thread riêng; embedding model và reranker
+        giữ nguyên. Request đang chạy đã ghim bản cũ nên vẫn chạy trọn trên
+        bản cũ; handle của bản cũ được đóng khi request cuối cùng ghim nó xong.
+        """
+        with self._reload_lock:
+            snapshot = current_snapshot()
+            if snapshot is None or (not force and snapshot.version == self._index.version):
+                return False
+
+            started = time.perf_counter()
+            with self.tracer.span("index_reload", version=snapshot.version):
+                pool = ThreadPoolExecutor(
+                    max_workers=AppConfig.STARTUP_WORKERS, thread_name_prefix="rag-reload"
+                )
+                index = LoadedIndex(self, snapshot, pool)
+                try:
+                    index.wait()
+                    self._warmup(index)
+                except Exception:
+                    index.close()
+                    raise
+                finally:
+                    pool.shutdown(wait=False)
+                with self._swap_lock:
+                    previous, self._index = self._index, index
+                previous.retire()
+            print(
+                f"   -> 🔁 Index snapshot {previous.version or '-'} -> {index.version} "
+                f"({time.perf_counter() - started:.1f}s)"
+            )
+            return True
+
+    def _watch_snapshots(self):
+        while not self._closed.wait(AppConfig.SNAPSHOT_POLL_INTERVAL):
+            if current_version() == self._index.version:
+                continue
+            try:
+                self.reload_index()
+            except Exception as e:  # Giữ bản đang chạy, thử lại ở lần poll sau
+                print(f"   ⚠️ Index reload failed: {e}")
+
+    def close(self):
+        self._closed.set()
+        self._executor.shutdown(wait=False)
+        with self._swap_lock:
+            self._index.retire()
 
-        # 5. LLM (Gemini)
+    def _load_llm(self):
+        # 5. LLM (Gemini, hoặc LLM truyền vào - VD: StubLLM khi benchmark)
         if not AppConfig.GOOGLE_API_KEY:
             raise ValueError("❌ Missing GOOGLE_API_KEY in .env")
 
-        self.llm = ChatGoogleGenerativeAI(
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        return ChatGoogleGenerativeAI(
             model=AppConfig.LLM_MODEL_NAME,
             temperature=0,
             api_key=AppConfig.GOOGLE_API_KEY,
         )
 
-        # 6. Prompts
-        self.answer_prompt = get_answer_prompt()
-        self.query_transform_prompt = get_query_transform_prompt()
+    # 6. Prompts
+    @staticmethod
+    def _load_answer_prompt():
+        from src.prompts import get_answer_prompt
+
+        return get_answer_prompt()
+
+    @staticmethod
+    def _load_query_transform_prompt():
+        from src.prompts import get_query_transform_prompt
+
+        return get_query_transform_prompt()
 
     def generate_legal_query(self, user_query: str):
         print(f"   🔄 Normalizing query: '{user_query}'")
-        try:
-            response = (self.query_transform_prompt | self.llm).invoke(
-                {"question": user_query}
-            )
-            legal_query = response.content.strip()
-            print(f"   -> 🎯 Legal Query: '{legal_query}'")
-            return legal_query
-        except Exception as e:
-            print(f"   ⚠️ Error expanding query: {e}. Using original.")
-            return user_query
+        with self.tracer.span("query_rewrite") as span:
+            cached = self.rewrite_cache.get(user_query)
+            span.set(cache_hit=cached is not None)
+            if cached is not None:
+                print(f"   -> 🎯 Legal Query (cache): '{cached}'")
+                return cached
+            try:
+                response = (self.query_transform_prompt | self.llm).invoke(
+                    {"question": user_query}
+                )
+                return self._store_legal_query(user_query, response)
+            except Exception as e:
+                print(f"   ⚠️ Error expanding query: {e}. Using original.")
+                span.set(fallback=True)
+                return user_query
+
+    @_pinned
+    def retrieve_hybrid(self, query: str, filters: Optional[dict] = None):
+        """filters: {"doc_type"|"law_id"|"article"|"vehicle": giá trị hoặc list}.
+        None = toàn bộ corpus, ưu tiên phạm vi suy ra từ câu hỏi
+        (AppConfig.SCOPE_INFER); {} = toàn bộ corpus, không ưu tiên."""
+        # Step 0: Trích dẫn rõ ràng -> bỏ qua LLM, vector search và rerank
+        cited_docs = self._lookup_citation(query)
+        if cited_docs:
+            return cited_docs
 
-    def retrieve_hybrid(self, query: str):
-        # Step 1: Query Expansion
+        # Step 1: Query Expansion + phạm vi tìm kiếm
         search_query = self.generate_legal_query(query)
+        scope, boost = self._scope(query, filters)
 
         # Step 2: Retrieval
-        docs_vector = self.vector_db.similarity_search(
-            search_query, k=AppConfig.RETRIEVAL_VECTOR_K
-        )
-        docs_bm25 = self.bm25_retriever.invoke(search_query)
-
-        # Step 3: Deduplication
-        unique_docs = {}
-        for doc in docs_vector + docs_bm25:
-            # Dùng citation làm key để lọc trùng
-            key = doc.metadata.get("citation", doc.page_content[:50])
-            unique_docs[key] = doc
+        docs_vector = self._traced_vector_search(search_query, scope)
+        docs_bm25 = self._traced_bm25(search_query, scope)
 
-        merged_docs = list(unique_docs.values())
-        print(f"   -> Found {len(merged_docs)} potential candidates.")
+        # Step 3: Fusion + cắt ứng viên
+        merged_docs = self._merge_candidates(docs_vector, docs_bm25, boost)
 
         # Step 4: Reranking
         print("   -> ⚖️  Reranking...")
-        final_docs = self.reranker.rank_documents(query, merged_docs)
+        with self.tracer.span("rerank", candidates=len(merged_docs)):
+            final_docs = self.reranker.rank_documents(query, merged_docs)
         return final_docs
 
-    def chat(self, user_query: str):
-        context_docs = self.retrieve_hybrid(user_query)
+    @_pinned
+    def chat(self, user_query: str, filters: Optional[dict] = None):
+        with self.tracer.trace(mode="sync"):
+            # Cache câu trả lời theo câu hỏi -> chỉ dùng khi không truyền bộ lọc
+            cached = self._cached_answer(user_query) if filters is None else None
+            if cached is not None:
+                return cached
 
-        if not context_docs:
-            return "Xin lỗi, không tìm thấy tài liệu liên quan.", []
+            context_docs = self.retrieve_hybrid(user_query, filters)
 
-        # Format Context
-        context_text = ""
-        for i, doc in enumerate(context_docs):
-            source = doc.metadata.get("citation", "N/A")
-            content = doc.page_content.replace("\n", " ")
-            context_text += f"[{i+1}] {source}: {content}\n\n"
+            if not context_docs:
+                return "Xin lỗi, không tìm thấy tài liệu liên quan.", []
 
-        # Generation
-        chain = self.answer_prompt | self.llm
-        response = chain.invoke({"context": context_text, "question": user_query})
+            # Generation
+            context_text, context_docs = self._format_context(context_docs)
+            with self.tracer.span("generation") as span:
+                chain = self.answer_prompt | self.llm
+                response = chain.invoke({"context": context_text, "question": user_query})
+                span.set(**self._token_usage(response))
+            if filters is not None:
+                return response.content, context_docs
+            return self._store_answer(user_query, response.content, context_docs)
 
-        return response.content, context_docs
+    # --- Async API: nhiều hội thoại dùng chung một process và một bộ model ---
+    async def _run_blocking(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        # Copy context để span hiện tại đi theo sang thread của executor
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(ctx.run, fn, *args)
+        )
+
+    async def agenerate_legal_query(self, user_query: str):
+        print(f"   🔄 Normalizing query: '{user_query}'")
+        with self.tracer.span("query_rewrite") as span:
+            cached = await self._run_blocking(self.rewrite_cache.get, user_query)
+            span.set(cache_hit=cached is not None)
+            if cached is not None:
+                print(f"   -> 🎯 Legal Query (cache): '{cached}'")
+                return cached
+            try:
+                response = await (self.query_transform_prompt | self.llm).ainvoke(
+                    {"question": user_query}
+                )
+                return await self._run_blocking(
+                    self._store_legal_query, user_query, response
+                )
+            except Exception as e:
+                print(f"   ⚠️ Error expanding query: {e}. Using original.")
+                span.set(fallback=True)
+                return user_query
+
+    @_pinned
+    async def aretrieve_hybrid(self, query: str, filters: Optional[dict] = None):
+        cited_docs = await self._run_blocking(self._lookup_citation, query)
+        if cited_docs:
+            return cited_docs
+
+        search_query = await self.agenerate_legal_query(query)
+        scope, boost = self._scope(query, filters)
+
+        # Vector search và BM25 chạy song song
+        docs_vector, docs_bm25 = await asyncio.gather(
+            self._run_blocking(self._traced_vector_search, search_query, scope),
+            self._run_blocking(self._traced_bm25, search_query, scope),
+        )
+        merged_docs = self._merge_candidates(docs_vector, docs_bm25, boost)
+
+        print("   -> ⚖️  Reranking...")
+        with self.tracer.span("rerank", candidates=len(merged_docs)):
+            return await self._run_blocking(
+                self.reranker.rank_documents, query, merged_docs
+            )
+
+    @_pinned
+    async def achat(self, user_query: str, filters: Optional[dict] = None):
+        with self.tracer.trace(mode="async"):
+            cached = None
+            if filters is None:
+                cached = await self._run_blocking(self._cached_answer, user_query)
+            if cached is not None:
+                return cached
+
+            context_docs = await self.aretrieve_hybrid(user_query, filters)
+
+            if not context_docs:
+                return "Xin lỗi, không tìm thấy tài liệu liên quan.", []
+
+            context_text, context_docs = self._format_context(context_docs)
+            with self.tracer.span("generation") as span:
+                chain = self.answer_prompt | self.llm
+                response = await chain.ainvoke(
+                    {"context": context_text, "question": user_query}
+                )
+                span.set(**self._token_usage(response))
+            if filters is not None:
+                return response.content, context_docs
+            return await self._run_blocking(
+                self._store_answer, user_query, response.content, context_docs
+            )
+
+    async def astream_chat(self, user_query: str, filters: Optional[dict] = None):
+        """Như `achat` nhưng stream: yield ("token", đoạn text) trong lúc LLM sinh
+        câu trả lời, cuối cùng ("sources", context_docs).
+
+        Chạy trọn trong task của caller (không qua wait_for/create_task) vì
+        trace và snapshot ghim nằm trong contextvar.
+        """
+        with self.pin_index(), self.tracer.trace(mode="stream"):
+            cached = None
+            if filters is None:
+                cached = await self._run_blocking(self._cached_answer, user_query)
+            if cached is not None:
+                yield "token", cached[0]
+                yield "sources", cached[1]
+                return
+
+            context_docs = await self.aretrieve_hybrid(user_query, filters)
+            if not context_docs:
+                yield "token", "Xin lỗi, không tìm thấy tài liệu liên quan."
+                yield "sources", []
+                return
+
+            context_text, context_docs = self._format_context(context_docs)
+            response = None
+            with self.tracer.span("generation", stream=True) as span:
+                chain = self.answer_prompt | self.llm
+                async for chunk in chain.astream(
+                    {"context": context_text, "question": user_query}
+                ):
+                    response = chunk if response is None else response + chunk
+                    if chunk.content:
+                        yield "token", chunk.content
+                if response is not None:
+                    span.set(**self._token_usage(response))
+            if response is not None and filters is None:
+                await self._run_blocking(
+                    self._store_answer, user_query, response.content, context_docs
+                )
+            yield "sources", context_docs
+
+    # --- Helpers dùng chung cho bản sync và async ---
+    def _lookup_citation(self, query: str):
+        """Trích dẫn rõ ràng -> bỏ qua rewrite + retrieval. Trích dẫn cả Điều kèm
+        câu hỏi nội dung -> rerank các Khoản của Điều đó theo câu hỏi."""
+        if self.citation_index is None:
+            return []
+        with self.tracer.span("citation_lookup") as span:
+            docs, needs_rerank = self.citation_index.lookup(query, self.chunk_store)
+            span.set(hit=bool(docs), docs=len(docs), reranked=needs_rerank)
+        if not docs:
+            return []
+        print(f"   -> 📌 Direct citation: {docs[0].metadata.get('citation')}")
+        if needs_rerank:
+            with self.tracer.span("rerank", candidates=len(docs)):
+                docs = self.reranker.rank_documents(query, docs)
+        return docs
+
+    def _scope(self, query: str, filters: Optional[dict] = None):
+        """-> (bộ lọc cứng cho cả hai retriever, phạm vi ưu tiên lúc fusion).
+
+        Bộ lọc do caller truyền thì lọc cứng; phạm vi suy ra từ câu hỏi (dễ
+        suy sai, VD mọi câu có chữ "phạt" -> Nghị định) chỉ được boost.
+        """
+        if filters is not None:
+            return normalize_filters(filters), {}
+        if not AppConfig.SCOPE_INFER:
+            return {}, {}
+        with self.tracer.span("scope") as span:
+            boost = infer_filters(query, self.citation_index)
+            span.set(boosted=bool(boost))
+        if boost:
+            print(f"   -> 🔎 Scope (boost): {boost}")
+        return {}, boost
+
+    def _traced_vector_search(self, search_query: str, scope: Optional[dict] = None):
+        with self.tracer.span(
+            "vector_search", backend=AppConfig.VECTOR_BACKEND, scoped=bool(scope)
+        ) as span:
+            docs = self.vector_db.similarity_search_with_relevance_scores(
+                search_query, k=AppConfig.RETRIEVAL_VECTOR_K, filters=scope
+            )
+            span.set(candidates=len(docs))
+            return docs
+
+    def _traced_bm25(self, search_query: str, scope: Optional[dict] = None):
+        with self.tracer.span("bm25", scoped=bool(scope)) as span:
+            docs = self.lexical_index.search(search_query, filters=scope)
+            span.set(candidates=len(docs))
+            return docs
+
+    def _store_legal_query(self, user_query: str, response) -> str:
+        legal_query = response.content.strip()
+        print(f"   -> 🎯 Legal Query: '{legal_query}'")
+        annotate(**self._token_usage(response))
+        self.rewrite_cache.set(user_query, legal_query)
+        return legal_query
+
+    @staticmethod
+    def _token_usage(response) -> dict:
+        usage = getattr(response, "usage_metadata", None) or {}
+        return {
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+        }
+
+    def _merge_candidates(self, docs_vector, docs_bm25, boost: Optional[dict] = None):
+        """Fusion điểm vector/BM25, ưu tiên phạm vi suy ra, gộp theo cây chunk,
+        rồi cắt ứng viên thích ứng."""
+        with self.tracer.span("fusion", candidates_in=len(docs_vector) + len(docs_bm25)) as span:
+            merged_docs, cutoff = self._fuse_candidates(docs_vector, docs_bm25, boost)
+            span.set(unique=len(merged_docs), candidates_out=cutoff)
+        print(f"   -> Found {len(merged_docs)} potential candidates, reranking top {cutoff}.")
+        return merged_docs[:cutoff]
+
+    def _fuse_candidates(self, docs_vector, docs_bm25, boost: Optional[dict] = None):
+        results = {"vector": docs_vector, "bm25": docs_bm25}
+        merged_docs = boost_scope(fuse(results), boost)
+        # Gộp các Điểm cùng Khoản về Khoản để giảm số cặp cho cross-encoder
+        if self.chunk_store is not None:
+            merged_docs = self.chunk_store.collapse(merged_docs)
+        return merged_docs, adaptive_cutoff(merged_docs, results)
+
+    def _format_context(self, context_docs):
+        """-> (context, các document nằm trong context): chỉ những document này
+        được trả về làm nguồn và lưu vào cache câu trả lời."""
+        with self.tracer.span("context_build", docs=len(context_docs)) as span:
+            context_text, stats, packed_docs = build_context(context_docs, self.chunk_store)
+            span.set(chars=len(context_text), packed=len(packed_docs), **stats)
+        print(
+            f"   -> 🧩 Context: {stats['tokens']} tokens, {len(packed_docs)}/{len(context_docs)} docs "
+            f"(saved {stats['tokens_saved']}, budget {AppConfig.CONTEXT_TOKEN_BUDGET}; "
+            f"~{stats['tokenizer']}, không phải tokenizer Gemini)"
+        )
+        return context_text, packed_docs
+
+    def _cached_answer(self, user_query: str):
+        with self.tracer.span("answer_cache") as span:
+            cached = self.answer_cache.get(user_query)
+            span.set(cache_hit=cached is not None)
+        if cached is None:
+            return None
+        print("   -> ⚡ Answer (cache)")
+        sources = [
+            Document(page_content=d["content"], metadata=d["metadata"])
+            for d in cached["sources"]
+        ]
+        return cached["answer"], sources
+
+    def _store_answer(self, user_query: str, answer: str, context_docs):
+        self.answer_cache.set(
+            user_query,
+            {
+                "answer": answer,
+                "sources": [
+                    {"content": d.page_content, "metadata": d.metadata}
+                    for d in context_docs
+                ],
+            },
+        )
+        return answer, context_docs
@@ -1,31 +1,188 @@
-from sentence_transformers import CrossEncoder
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+from src.cache import normalize_query
 from src.config import AppConfig
+from src.inference import load_cross_encoder, resolve_device
+from src.telemetry import annotate
+
+
+class _RerankJob:
+    def __init__(self, pairs: List[Tuple[str, str]]):
+        self.pairs = pairs
+        self.scores = None
+        self.error = None
+        self.done = threading.Event()
 
 
 class Reranker:
     def __init__(self):
         print(
-            f"⚖️  [Reranker] Loading: {AppConfig.RERANKER_MODEL} ({AppConfig.RERANKER_DEVICE})..."
+            f"⚖️  [Reranker] Loading: {AppConfig.RERANKER_MODEL} "
+            f"({resolve_device(AppConfig.RERANKER_DEVICE)}, {AppConfig.INFERENCE_BACKEND})..."
         )
-        self.model = CrossEncoder(
-            AppConfig.RERANKER_MODEL, device=AppConfig.RERANKER_DEVICE
+        self.model = load_cross_encoder()
+        self.max_length = self.model.max_length or min(
+            self.model.tokenizer.model_max_length, 8192
         )
+
+        # LRU điểm theo (câu hỏi đã chuẩn hoá, sha1 nội dung chunk)
+        self._score_cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # Gom cặp (query, chunk) từ các request đồng thời vào chung forward pass
+        self._queue: "queue.Queue[_RerankJob]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
         print("   -> ✅ Reranker Ready.")
 
     def rank_documents(self, query: str, documents: list):
         if not documents:
             return []
+        return self._rank([query], [documents], self._schedule)[0]
+
+    def rank_many(self, queries: List[str], documents: List[list]) -> List[list]:
+        """Rerank nhiều câu hỏi một lần (chế độ batch).
+
+        Mọi cặp (câu hỏi, chunk) chưa có trong cache được chấm trong một lần
+        gọi `_score_pairs`: sắp theo độ dài trên toàn bộ cặp nên batch đầy và
+        ít padding hơn nhiều so với rerank từng câu hỏi.
+        """
+        return self._rank(queries, documents, self._score_pairs)
+
+    def _rank(self, queries: List[str], documents: List[list], score_fn) -> List[list]:
+        keys, scores = [], []
+        for query, docs in zip(queries, documents):
+            norm_query = normalize_query(query)
+            keys.append([(norm_query, self._doc_key(doc)) for doc in docs])
+            scores.append([None] * len(docs))
+
+        with self._cache_lock:
+            for query_keys, query_scores in zip(keys, scores):
+                for i, key in enumerate(query_keys):
+                    if key in self._score_cache:
+                        self._score_cache.move_to_end(key)
+                        query_scores[i] = self._score_cache[key]
+
+        missing = [
+            (q, i)
+            for q, query_scores in enumerate(scores)
+            for i, s in enumerate(query_scores)
+            if s is None
+        ]
+        total = sum(len(docs) for docs in documents)
+        annotate(cache_hits=total - len(missing), pairs_scored=len(missing))
+        if missing:
+            new_scores = score_fn(
+                [(queries[q], documents[q][i].page_content) for q, i in missing]
+            )
+            with self._cache_lock:
+                for (q, i), score in zip(missing, new_scores):
+                    scores[q][i] = score
+                    self._score_cache[keys[q][i]] = score
+                while len(self._score_cache) > AppConfig.RERANKER_SCORE_CACHE_SIZE:
+                    self._score_cache.popitem(last=False)
 
-        inputs = [[query, doc.page_content] for doc in documents]
+        ranked = []
+        for docs, query_scores in zip(documents, scores):
+            # Attach scores & Sort
+            for doc, score in zip(docs, query_scores):
+                doc.metadata["rerank_score"] = float(score)
+            scored_docs = sorted(zip(docs, query_scores), key=lambda x: x[1], reverse=True)
+            ranked.append([doc for doc, score in scored_docs[: AppConfig.RERANK_TOP_K]])
+        return ranked
 
-        # Predict scores
-        scores = self.model.predict(
-            inputs, batch_size=AppConfig.RERANKER_BATCH_SIZE, show_progress_bar=False
+    @staticmethod
+    def _doc_key(doc) -> str:
+        # Theo nội dung, không theo chunk_id: chunk_id giữ nguyên khi Khoản bị sửa
+        # và cache sống qua reload_index -> điểm cũ không được dùng cho text mới
+        return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+    # --- Scheduler ---
+    def _schedule(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        if AppConfig.RERANKER_COALESCE_MS <= 0:
+            return self._score_pairs(pairs)
+
+        self._ensure_worker()
+        job = _RerankJob(pairs)
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.scores
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._worker_loop, name="rerank-scheduler", daemon=True
+                )
+                self._worker.start()
+
+    def _worker_loop(self):
+        window = AppConfig.RERANKER_COALESCE_MS / 1000
+        while True:
+            jobs = [self._queue.get()]
+            n_pairs = len(jobs[0].pairs)
+            deadline = time.monotonic() + window
+            while n_pairs < AppConfig.RERANKER_MAX_COALESCED_PAIRS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                n_pairs += len(job.pairs)
+
+            try:
+                scores = self._score_pairs([p for job in jobs for p in job.pairs])
+                start = 0
+                for job in jobs:
+                    job.scores = scores[start : start + len(job.pairs)]
+                    start += len(job.pairs)
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            for job in jobs:
+                job.done.set()
+
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """Chấm điểm theo batch đã sắp theo độ dài token để giảm padding.
+
+        Mỗi batch bị giới hạn bởi tổng token (kể cả padding) thay vì số cặp cố
+        định: batch các chunk ngắn chứa được nhiều cặp hơn batch các chunk dài.
+        """
+        encoded = self.model.tokenizer(
+            [q for q, _ in pairs],
+            [d for _, d in pairs],
+            truncation="longest_first",
+            max_length=self.max_length,
         )
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        order = sorted(range(len(pairs)), key=lambda i: lengths[i])
 
-        # Attach scores & Sort
-        for doc, score in zip(documents, scores):
-            doc.metadata["rerank_score"] = float(score)
+        scores = [0.0] * len(pairs)
+        batch = []
+        for i in order:
+            # Trong batch đã sắp tăng dần, cặp mới là cặp dài nhất
+            if batch and (len(batch) + 1) * lengths[i] > AppConfig.RERANKER_MAX_BATCH_TOKENS:
+                self._predict_batch(pairs, batch, scores)
+                batch = []
+            batch.append(i)
+        if batch:
+            self._predict_batch(pairs, batch, scores)
+        return scores
 
-        scored_docs = sorted(zip(documents, scores), key=lambda x: x[1], reverse=True)
-        return [doc for doc, score in scored_docs[: AppConfig.RERANK_TOP_K]]
+    def _predict_batch(self, pairs, batch, scores):
+        batch_scores = self.model.predict(
+            [list(pairs[i]) for i in batch],
+            batch_size=len(batch),
+            show_progress_bar=False,
+        )
+        for i, score in zip(batch, batch_scores):
+            scores[i] = float(score)
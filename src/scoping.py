@@ -0,0 +1,58 @@
+import re
+from typing import Dict, Tuple
+from src.citations import article_mentions, law_mentions
+from src.facets import normalize_filters
+from src.lexical import fold_diacritics
+
+# Loại phương tiện (khớp trên text đã bỏ dấu)
+_VEHICLE_PATTERNS = {
+    "o_to": re.compile(r"\b(?:o to|oto|xe hoi|bon banh)\b"),
+    "xe_may": re.compile(r"\b(?:mo to|gan may|xe may(?! chuyen dung))\b"),
+    "xe_chuyen_dung": re.compile(r"\b(?:xe may chuyen dung|may keo)\b"),
+    "xe_tho_so": re.compile(r"\b(?:xe dap|xe tho so|xich lo|xe vat nuoi keo)\b"),
+    "di_bo": re.compile(r"\bdi bo\b"),
+}
+# Câu hỏi về mức phạt -> chỉ tìm trong Nghị định (xử phạt)
+_PENALTY_RE = re.compile(
+    r"\b(?:phat|bao nhieu tien|tru diem|tuoc (?:quyen su dung )?(?:giay phep|bang)|tam giu)\b"
+)
+PENALTY_DOC_TYPE = "nghi_dinh"
+
+
+def vehicle_tag(text: str) -> str:
+    """Loại phương tiện được nhắc tới; "" nếu không có hoặc nhắc nhiều loại."""
+    folded = fold_diacritics(text)
+    tags = [tag for tag, pattern in _VEHICLE_PATTERNS.items() if pattern.search(folded)]
+    return tags[0] if len(tags) == 1 else ""
+
+
+def infer_filters(query: str, citation_index=None) -> Dict[str, Tuple[str, ...]]:
+    """Suy ra phạm vi tìm kiếm từ câu hỏi.
+
+    - Nêu số hiệu văn bản (và đúng một Điều) -> law_id (+ article)
+    - Hỏi mức phạt -> doc_type Nghị định
+    - Nêu đúng một loại phương tiện -> vehicle (kèm các Điều chung)
+    """
+    folded = fold_diacritics(query)
+    filters = {}
+
+    law_ids = []
+    if citation_index is not None:
+        for number, doc_type in sorted(law_mentions(query).items()):
+            law_ids += [
+                law["law_id"]
+                for law in citation_index.laws.get(number, [])
+                if doc_type is None or law["doc_type"] == doc_type
+            ]
+    if law_ids:
+        filters["law_id"] = law_ids
+        articles = article_mentions(query)
+        if len(law_ids) == 1 and len(articles) == 1:
+            filters["article"] = articles
+    elif _PENALTY_RE.search(folded):
+        filters["doc_type"] = PENALTY_DOC_TYPE
+
+    vehicle = vehicle_tag(query)
+    if vehicle:
+        filters["vehicle"] = vehicle
+    return normalize_filters(filters)
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+from typing import Optional
+from src.config import AppConfig
+from src.vector_store import VECTOR_BACKENDS
+
+BUILDING_NAME = ".building"
+
+
+class IndexSnapshot:
+    """Một bộ index hoàn chỉnh (vector store, BM25, ChunkStore, citation, manifest).
+
+    Snapshot đã publish không bao giờ bị sửa; build mới ghi vào
+    `snapshots/.building` rồi được đổi tên thành `snapshots/<version>` và con
+    trỏ CURRENT được thay nguyên tử.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @property
+    def version(self) -> str:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("version", "")
+        except (OSError, ValueError):
+            return ""
+
+    def vector_path(self, backend: Optional[str] = None) -> str:
+        return os.path.join(self.root, VECTOR_BACKENDS[backend or AppConfig.VECTOR_BACKEND][1])
+
+    @property
+    def lexical_path(self) -> str:
+        return os.path.join(self.root, "lexical")
+
+    @property
+    def chunk_store_path(self) -> str:
+        return os.path.join(self.root, "chunk_store.json")
+
+    @property
+    def citation_index_path(self) -> str:
+        return os.path.join(self.root, "citation_index.json")
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, "index_manifest.json")
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.root, "build_checkpoint.jsonl")
+
+
+def current_version() -> str:
+    """Version mà con trỏ CURRENT đang trỏ tới (rẻ, dùng để poll)."""
+    try:
+        with open(AppConfig.CURRENT_SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        # Layout cũ: index nằm thẳng trong data/indexes
+        return IndexSnapshot(AppConfig.INDEX_DIR).version
+
+
+def current_snapshot() -> Optional[IndexSnapshot]:
+    try:
+        with open(AppConfig.CURRENT_SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+            return IndexSnapshot(os.path.join(AppConfig.SNAPSHOTS_DIR, f.read().strip()))
+    except OSError:
+        legacy = IndexSnapshot(AppConfig.INDEX_DIR)
+        return legacy if os.path.exists(legacy.manifest_path) else None
+
+
+def building_snapshot() -> IndexSnapshot:
+    return IndexSnapshot(os.path.join(AppConfig.SNAPSHOTS_DIR, BUILDING_NAME))
+
+
+def publish_snapshot(building: IndexSnapshot, version: str) -> IndexSnapshot:
+    """Đổi tên snapshot vừa build thành `<version>` rồi trỏ CURRENT vào nó."""
+    target = IndexSnapshot(os.path.join(AppConfig.SNAPSHOTS_DIR, version))
+    if os.path.exists(target.root):
+        # Cùng version = cùng nội dung: dùng lại snapshot đã có
+        shutil.rmtree(building.root)
+    else:
+        os.replace(building.root, target.root)
+
+    tmp_path = f"{AppConfig.CURRENT_SNAPSHOT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, AppConfig.CURRENT_SNAPSHOT_PATH)
+
+    prune_snapshots(keep=AppConfig.SNAPSHOT_KEEP)
+    return target
+
+
+def prune_snapshots(keep: int = AppConfig.SNAPSHOT_KEEP):
+    """Xoá snapshot cũ, giữ CURRENT và `keep` snapshot mới nhất.
+
+    Giữ vài bản cũ để engine đang chạy kịp chuyển sang bản mới (và để
+    rollback bằng cách sửa CURRENT).
+    """
+    current = current_version()
+    names = [
+        name
+        for name in os.listdir(AppConfig.SNAPSHOTS_DIR)
+        if not name.startswith(".") and os.path.isdir(os.path.join(AppConfig.SNAPSHOTS_DIR, name))
+    ]
+    names.sort(key=lambda n: os.path.getmtime(os.path.join(AppConfig.SNAPSHOTS_DIR, n)), reverse=True)
+    for name in names[keep:]:
+        if name != current:
+            shutil.rmtree(os.path.join(AppConfig.SNAPSHOTS_DIR, name), ignore_errors=True)
@@ -0,0 +1,207 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from src.config import AppConfig
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("rag_span", default=None)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("rag_trace", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: Optional[str], attrs: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = dict(attrs)
+        self.start_ns = time.time_ns()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span": self.name,
+            "duration_ms": round(self.duration * 1000, 3),
+            "error": self.error,
+            **self.attrs,
+        }
+
+
+def annotate(**attrs):
+    """Gắn thêm thuộc tính (cache hit, số cặp rerank...) vào span đang mở, nếu có."""
+    span = _current_span.get()
+    if span is not None:
+        span.set(**attrs)
+
+
+class PrometheusSink:
+    """Histogram thời gian theo stage + tổng các thuộc tính số, xuất dạng text Prometheus."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[int]] = defaultdict(lambda: [0] * len(self.BUCKETS))
+        self._count: Dict[str, int] = defaultdict(int)
+        self._sum: Dict[str, float] = defaultdict(float)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._attr_totals: Dict[tuple, float] = defaultdict(float)
+
+    def record(self, span: Span):
+        with self._lock:
+            idx = bisect.bisect_left(self.BUCKETS, span.duration)
+            buckets = self._buckets[span.name]
+            for i in range(idx, len(self.BUCKETS)):
+                buckets[i] += 1
+            self._count[span.name] += 1
+            self._sum[span.name] += span.duration
+            if span.error:
+                self._errors[span.name] += 1
+            for key, value in span.attrs.items():
+                if isinstance(value, (bool, int, float)):
+                    self._attr_totals[(span.name, key)] += float(value)
+
+    def render(self) -> str:
+        lines = [
+            "# TYPE rag_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage in sorted(self._count):
+                for le, count in zip(self.BUCKETS, self._buckets[stage]):
+                    lines.append(
+                        f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {count}'
+                    )
+                lines.append(
+                    f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {self._count[stage]}'
+                )
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {self._sum[stage]}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {self._count[stage]}')
+            lines.append("# TYPE rag_stage_errors_total counter")
+            for stage, count in sorted(self._errors.items()):
+                lines.append(f'rag_stage_errors_total{{stage="{stage}"}} {count}')
+            lines.append("# TYPE rag_stage_attribute_total counter")
+            for (stage, key), total in sorted(self._attr_totals.items()):
+                lines.append(f'rag_stage_attribute_total{{stage="{stage}",attribute="{key}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+
+class JsonLogSink:
+    """Mỗi span một dòng JSON qua logging (logger `rag.trace`)."""
+
+    def __init__(self, logger_name: str = "rag.trace"):
+        self.logger = logging.getLogger(logger_name)
+
+    def record(self, span: Span):
+        self.logger.info(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+
+
+class OpenTelemetrySink:
+    """Chuyển span sang OpenTelemetry (exporter do ứng dụng cấu hình qua SDK)."""
+
+    def __init__(self):
+        from opentelemetry import trace
+
+        self._tracer = trace.get_tracer("traffic_law_rag")
+
+    def record(self, span: Span):
+        otel_span = self._tracer.start_span(f"rag.{span.name}", start_time=span.start_ns)
+        for key, value in span.attrs.items():
+            if isinstance(value, (bool, int, float, str)):
+                otel_span.set_attribute(f"rag.{key}", value)
+        if span.trace_id:
+            otel_span.set_attribute("rag.trace_id", span.trace_id)
+        if span.error:
+            otel_span.set_attribute("error", span.error)
+        otel_span.end(end_time=span.start_ns + int(span.duration * 1e9))
+
+
+class CollectingSink:
+    """Giữ span trong RAM (benchmark, debug)."""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def drain(self) -> List[Span]:
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+
+SINKS = {
+    "prometheus": PrometheusSink,
+    "json": JsonLogSink,
+    "otel": OpenTelemetrySink,
+}
+
+
+class Tracer:
+    def __init__(self, sinks: Optional[list] = None):
+        self.sinks = list(sinks or [])
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def get_sink(self, sink_type):
+        return next((s for s in self.sinks if isinstance(s, sink_type)), None)
+
+    @contextmanager
+    def trace(self, **attrs):
+        """Nhóm các span của một request dưới cùng trace_id."""
+        token = _current_trace.set(uuid.uuid4().hex[:16])
+        try:
+            with self.span("request", **attrs) as span:
+                yield span
+        finally:
+            _current_trace.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        span = Span(name, _current_trace.get(), attrs)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            _current_span.reset(token)
+            for sink in self.sinks:
+                try:
+                    sink.record(span)
+                except Exception as e:  # Sink lỗi không được làm hỏng request
+                    logging.getLogger("rag.trace").warning("Sink error: %s", e)
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Tracer dùng chung toàn process, sink chọn qua AppConfig.TELEMETRY_SINKS."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            sinks = []
+            for name in AppConfig.TELEMETRY_SINKS:
+                try:
+                    sinks.append(SINKS[name]())
+                except (KeyError, ImportError) as e:
+                    print(f"   ⚠️ Telemetry sink '{name}' unavailable: {e}")
+            _tracer = Tracer(sinks)
+        return _tracer
@@ -0,0 +1,450 @@
+import json
+import mmap
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from src.config import AppConfig
+from src.facets import FacetIndex, chroma_where
+
+ScoredDocs = List[Tuple[Document, float]]
+# Bộ lọc đã normalize_filters (src/facets.py); None/{} = toàn bộ corpus
+Filters = Optional[Dict[str, Tuple[str, ...]]]
+
+
+class ChromaVectorStore:
+    """ChromaDB (SQLite + HNSW), cosine. Ghi thẳng xuống đĩa sau mỗi batch."""
+
+    def __init__(self, path: str, embeddings):
+        from langchain_chroma import Chroma
+
+        self.path = path
+        self.embeddings = embeddings
+        self.db = Chroma(
+            persist_directory=path,
+            embedding_function=embeddings,
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+
+    def add_documents(self, documents: List[Document], ids: List[str]):
+        # add_documents với ids sẵn có = upsert
+        self.db.add_documents(documents, ids=ids)
+
+    def delete(self, ids: List[str]):
+        self.db.delete(ids=ids)
+
+    def save(self):
+        pass  # Chroma tự persist
+
+    def similarity_search(self, query: str, k: int = 4, filters: Filters = None) -> List[Document]:
+        return self.db.similarity_search(query, k=k, filter=chroma_where(filters or {}))
+
+    def similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, filters: Filters = None
+    ) -> ScoredDocs:
+        return self.db.similarity_search_with_relevance_scores(
+            query, k=k, filter=chroma_where(filters or {})
+        )
+
+    def similarity_search_many(
+        self, queries: List[str], k: int = 4, filters: Optional[List[Filters]] = None
+    ) -> List[ScoredDocs]:
+        """Embed cả batch câu hỏi một lần, query Chroma một lần cho mỗi bộ lọc.
+
+        `filters`: bộ lọc riêng cho từng câu hỏi (cùng độ dài với `queries`).
+        """
+        if not queries:
+            return []
+        vectors = self.embeddings.embed_documents(queries)
+        results: List[ScoredDocs] = [[] for _ in queries]
+        for group_filters, rows in _filter_groups(filters, len(queries)):
+            result = self.db._collection.query(
+                query_embeddings=[vectors[i] for i in rows],
+                n_results=k,
+                where=chroma_where(group_filters),
+                include=["documents", "metadatas", "distances"],
+            )
+            for i, texts, metas, dists in zip(
+                rows, result["documents"], result["metadatas"], result["distances"]
+            ):
+                # Cosine distance -> relevance giống similarity_search_with_relevance_scores
+                results[i] = [
+                    (Document(page_content=text, metadata=meta or {}), 1.0 - dist)
+                    for text, meta, dist in zip(texts, metas, dists)
+                ]
+        return results
+
+
+class FaissVectorStore:
+    """FAISS inner product trên vector đã chuẩn hoá (= cosine), lưu trên đĩa.
+
+    Thư mục index:
+      - index.faiss: Flat / IVF / HNSW (AppConfig.FAISS_INDEX_TYPE), dòng i <-> doc i
+      - vectors.npy, docs.jsonl + doc_offsets.npy, meta.json
+      - facets.json + facet_codes.npy: trường lọc của từng dòng (src/facets.py)
+      - staging/: log append-only các lần add/delete chưa `save()`
+
+    Khi đọc, index được mở bằng faiss.IO_FLAG_MMAP và docs.jsonl được mmap,
+    nên các worker process dùng chung page cache của OS. Khi ghi, mỗi batch
+    được append vào staging ngay (build dở vẫn resume được); `save()` gộp
+    staging với bản cũ, dựng lại index FAISS rồi thay thư mục một lần.
+    """
+
+    def __init__(self, path: str, embeddings, index_type: Optional[str] = None):
+        self.path = path
+        self.embeddings = embeddings
+        self.index_type = index_type or AppConfig.FAISS_INDEX_TYPE
+        self.staging_dir = os.path.join(path, "staging")
+        self.index = None
+        self.vectors = None
+        self.n_docs = 0
+        self._docs = b""
+        self._docs_file = None
+        if os.path.exists(os.path.join(path, "index.faiss")):
+            self._open()
+
+    # --- Đọc ---
+    def _open(self):
+        import faiss
+
+        with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n_docs = meta["n_docs"]
+        self.built_index_type = meta["index_type"]
+        self.built_params = meta.get("build_params", {"index_type": self.built_index_type})
+        self.index = faiss.read_index(
+            os.path.join(self.path, "index.faiss"),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+        )
+        if self.built_index_type == "ivf":
+            faiss.extract_index_ivf(self.index).nprobe = AppConfig.FAISS_IVF_NPROBE
+        elif self.built_index_type == "hnsw":
+            faiss.downcast_index(self.index).hnsw.efSearch = AppConfig.FAISS_HNSW_EF_SEARCH
+
+        self.doc_offsets = np.load(os.path.join(self.path, "doc_offsets.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        self._docs_file = open(os.path.join(self.path, "docs.jsonl"), "rb")
+        self._docs = (
+            mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.n_docs
+            else b""
+        )
+        self._facets = FacetIndex.load(self.path)
+
+    @property
+    def facets(self) -> FacetIndex:
+        if self._facets is None:
+            # Index build trước khi có facet: dựng từ metadata của docs.jsonl
+            facets = FacetIndex()
+            for row in range(self.n_docs):
+                facets.add(self._get_record(row)["metadata"])
+            self._facets = facets
+        return self._facets
+
+    def rebuild_index(self, index_type: str):
+        """Dựng lại index FAISS loại khác từ vectors.npy, chỉ trong RAM (benchmark)."""
+        self.index = _build_faiss_index(np.asarray(self.vectors), index_type)
+        self.index_type = self.built_index_type = index_type
+        self.built_params = faiss_build_params(index_type)
+        if index_type == "ivf":
+            self.index.nprobe = AppConfig.FAISS_IVF_NPROBE
+        elif index_type == "hnsw":
+            self.index.hnsw.efSearch = AppConfig.FAISS_HNSW_EF_SEARCH
+
+    def _get_record(self, row: int) -> Dict:
+        start, end = self.doc_offsets[row], self.doc_offsets[row + 1]
+        return json.loads(self._docs[start:end])
+
+    def _search_vectors(self, vectors: np.ndarray, k: int, filters: Filters = None) -> List[ScoredDocs]:
+        if self.index is None or not self.n_docs:
+            return [[] for _ in range(len(vectors))]
+        vectors = _normalize(vectors)
+        if not filters:
+            scores, rows = self.index.search(vectors, min(k, self.n_docs))
+        else:
+            mask = self.facets.mask(filters)
+            selected = np.flatnonzero(mask)
+            if not len(selected):
+                return [[] for _ in range(len(vectors))]
+            if len(selected) <= AppConfig.FAISS_EXACT_FILTER_MAX:
+                # Tập con nhỏ: tính chính xác trên vectors.npy, rẻ hơn duyệt index
+                scores, rows = _exact_search(self.vectors, selected, vectors, k)
+            else:
+                # selector chỉ giữ con trỏ tới bitmap -> giữ bitmap tới hết search
+                bitmap = np.packbits(mask, bitorder="little")
+                params = self._search_params(len(mask), bitmap)
+                scores, rows = self.index.search(vectors, min(k, len(selected)), params=params)
+        results = []
+        for row_scores, row_ids in zip(scores, rows):
+            hits = []
+            for score, row in zip(row_scores, row_ids):
+                if row < 0:  # IVF/HNSW có thể trả về ít hơn k kết quả
+                    continue
+                record = self._get_record(int(row))
+                doc = Document(page_content=record["content"], metadata=record["metadata"])
+                hits.append((doc, float(score)))
+            results.append(hits)
+        return results
+
+    def _search_params(self, n: int, bitmap: np.ndarray):
+        """Tham số search FAISS chỉ xét các dòng có bit 1 trong `bitmap`."""
+        import faiss
+
+        selector = faiss.IDSelectorBitmap(n, faiss.swig_ptr(bitmap))
+        if self.built_index_type == "ivf":
+            return faiss.SearchParametersIVF(sel=selector, nprobe=AppConfig.FAISS_IVF_NPROBE)
+        if self.built_index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=AppConfig.FAISS_HNSW_EF_SEARCH)
+        return faiss.SearchParameters(sel=selector)
+
+    def similarity_search(self, query: str, k: int = 4, filters: Filters = None) -> List[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_with_relevance_scores(query, k, filters)
+        ]
+
+    def similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, filters: Filters = None
+    ) -> ScoredDocs:
+        vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        return self._search_vectors(vector, k, filters)[0]
+
+    def similarity_search_many(
+        self, queries: List[str], k: int = 4, filters: Optional[List[Filters]] = None
+    ) -> List[ScoredDocs]:
+        """Embed cả batch câu hỏi một lần và search FAISS một lần cho mỗi bộ lọc
+        (đa luồng trong FAISS). `filters`: bộ lọc riêng cho từng câu hỏi."""
+        if not queries:
+            return []
+        vectors = np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32)
+        results: List[ScoredDocs] = [[] for _ in queries]
+        for group_filters, rows in _filter_groups(filters, len(queries)):
+            for i, hits in zip(rows, self._search_vectors(vectors[rows], k, group_filters)):
+                results[i] = hits
+        return results
+
+    # --- Ghi ---
+    def add_documents(self, documents: List[Document], ids: List[str]):
+        texts = [d.page_content for d in documents]
+        vectors = _normalize(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+        row_bytes = vectors.shape[1] * 4
+
+        os.makedirs(self.staging_dir, exist_ok=True)
+        vectors_path = os.path.join(self.staging_dir, "vectors.f32")
+        size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+        row = size // row_bytes
+        if size % row_bytes:  # Bỏ phần vector ghi dở khi bị ngắt
+            os.truncate(vectors_path, row * row_bytes)
+        with open(vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._log(
+            [
+                {
+                    "op": "add",
+                    "id": cid,
+                    "row": row + i,
+                    "dim": vectors.shape[1],
+                    "content": doc.page_content,
+                    "metadata": doc.metadata,
+                }
+                for i, (cid, doc) in enumerate(zip(ids, documents))
+            ]
+        )
+
+    def delete(self, ids: List[str]):
+        self._log([{"op": "delete", "id": cid} for cid in ids])
+
+    def _log(self, entries: List[Dict]):
+        os.makedirs(self.staging_dir, exist_ok=True)
+        with open(os.path.join(self.staging_dir, "log.jsonl"), "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self):
+        """Gộp bản đã lưu + staging -> index mới, thay thư mục một lần."""
+        import faiss
+
+        log_path = os.path.join(self.staging_dir, "log.jsonl")
+        # Không có thay đổi và cùng tham số index -> giữ nguyên (đổi loại/tham
+        # số index thì chỉ dựng lại FAISS từ vectors.npy, không phải embed lại)
+        if (
+            not os.path.exists(log_path)
+            and self.index is not None
+            and self.built_params == faiss_build_params(self.index_type)
+        ):
+            return
+
+        # chunk_id -> ("base", row) | ("staging", entry), giữ thứ tự chèn
+        live: Dict[str, Tuple[str, object]] = {}
+        if self.index is not None:
+            for row in range(self.n_docs):
+                live[self._get_record(row)["metadata"]["chunk_id"]] = ("base", row)
+        staged = None
+        if os.path.exists(log_path):
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Dòng cuối ghi dở
+                    if entry["op"] == "delete":
+                        live.pop(entry["id"], None)
+                    else:
+                        live.pop(entry["id"], None)
+                        live[entry["id"]] = ("staging", entry)
+                        if staged is None:
+                            staged = np.memmap(
+                                os.path.join(self.staging_dir, "vectors.f32"),
+                                dtype=np.float32,
+                                mode="r",
+                            ).reshape(-1, entry["dim"])
+        base = (
+            np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+            if self.index is not None
+            else None
+        )
+
+        n_docs = len(live)
+        dim = (base if base is not None else staged).shape[1] if n_docs else 0
+        tmp_dir = f"{self.path}.tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        vectors = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "vectors.npy"),
+            mode="w+",
+            dtype=np.float32,
+            shape=(n_docs, dim),
+        )
+        offsets = np.zeros(n_docs + 1, dtype=np.int64)
+        facets = FacetIndex()
+        with open(os.path.join(tmp_dir, "docs.jsonl"), "wb") as f:
+            for i, (source, ref) in enumerate(live.values()):
+                if source == "base":
+                    vectors[i] = base[ref]
+                    record = self._docs[self.doc_offsets[ref] : self.doc_offsets[ref + 1]]
+                    facets.add(json.loads(record)["metadata"])
+                else:
+                    vectors[i] = staged[ref["row"]]
+                    record = (
+                        json.dumps(
+                            {"content": ref["content"], "metadata": ref["metadata"]},
+                            ensure_ascii=False,
+                        )
+                        + "\n"
+                    ).encode("utf-8")
+                    facets.add(ref["metadata"])
+                f.write(record)
+                offsets[i + 1] = offsets[i] + len(record)
+        vectors.flush()
+        np.save(os.path.join(tmp_dir, "doc_offsets.npy"), offsets)
+        facets.save(tmp_dir)
+
+        index = _build_faiss_index(np.asarray(vectors), self.index_type)
+        faiss.write_index(index, os.path.join(tmp_dir, "index.faiss"))
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "n_docs": n_docs,
+                    "dim": dim,
+                    "index_type": self.index_type,
+                    "build_params": faiss_build_params(self.index_type),
+                },
+                f,
+            )
+        del vectors, base, staged
+
+        self.close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(tmp_dir, self.path)
+        self._open()
+
+    def close(self):
+        self.index = None
+        self.vectors = None
+        if self._docs_file is not None:
+            if self.n_docs:
+                self._docs.close()
+            self._docs_file.close()
+            self._docs_file = None
+
+
+def _filter_groups(filters: Optional[List[Filters]], n: int) -> List[Tuple[Filters, List[int]]]:
+    """Gom các câu hỏi cùng bộ lọc để search chung một lần."""
+    if filters is None:
+        return [(None, list(range(n)))]
+    groups: Dict[tuple, Tuple[Filters, List[int]]] = {}
+    for i, query_filters in enumerate(filters):
+        key = tuple(sorted((query_filters or {}).items()))
+        groups.setdefault(key, (query_filters, []))[1].append(i)
+    return list(groups.values())
+
+
+def _exact_search(vectors: np.ndarray, rows: np.ndarray, queries: np.ndarray, k: int):
+    """Inner product chính xác trên tập dòng `rows` (định dạng kết quả như FAISS)."""
+    scores = queries @ np.asarray(vectors[rows]).T  # vectors.npy đã chuẩn hoá
+    k = min(k, len(rows))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top_scores, order, axis=1), rows[np.take_along_axis(top, order, axis=1)]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12), dtype=np.float32)
+
+
+def faiss_build_params(index_type: Optional[str] = None) -> Dict:
+    """Tham số dựng index FAISS (đổi -> dựng lại từ vectors.npy)."""
+    index_type = index_type or AppConfig.FAISS_INDEX_TYPE
+    params = {"index_type": index_type}
+    if index_type == "hnsw":
+        params.update(m=AppConfig.FAISS_HNSW_M, ef_construction=AppConfig.FAISS_HNSW_EF_CONSTRUCTION)
+    elif index_type == "ivf":
+        params["nlist"] = AppConfig.FAISS_IVF_NLIST
+    return params
+
+
+def _build_faiss_index(vectors: np.ndarray, index_type: str):
+    import faiss
+
+    n_docs, dim = vectors.shape
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, AppConfig.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = AppConfig.FAISS_HNSW_EF_CONSTRUCTION
+    elif index_type == "ivf":
+        # FAISS cần ~39 điểm / cluster để train ổn định
+        nlist = max(1, min(AppConfig.FAISS_IVF_NLIST, n_docs // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        if n_docs:
+            index.train(vectors)
+    elif index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    else:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE: {index_type}")
+    for start in range(0, n_docs, AppConfig.INDEXING_BATCH_SIZE):
+        index.add(vectors[start : start + AppConfig.INDEXING_BATCH_SIZE])
+    return index
+
+
+# backend -> (class, tên thư mục trong snapshot)
+VECTOR_BACKENDS = {
+    "chroma": (ChromaVectorStore, "chroma_db"),
+    "faiss": (FaissVectorStore, "faiss"),
+}
+
+
+def open_vector_store(embeddings, path: str, backend: Optional[str] = None):
+    """Vector store theo AppConfig.VECTOR_BACKEND ("chroma" | "faiss")."""
+    backend = backend or AppConfig.VECTOR_BACKEND
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+    return VECTOR_BACKENDS[backend][0](path, embeddings)
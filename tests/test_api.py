@@ -0,0 +1,298 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from src.api import Admission, create_app
+from src.config import AppConfig
+from src.ingestion import VietnameseLawParser, iter_chunk_ids
+from src.lexical import tokenize
+from src.llm_stub import StubLLM
+from src.telemetry import Tracer
+
+pytest.importorskip("faiss")
+
+QUESTION = "Xe ô tô vượt đèn đỏ bị phạt bao nhiêu tiền?"
+LAW_LINES = [
+    "NGHỊ ĐỊNH",
+    "Số: 168/2024/NĐ-CP",
+    "Quy định xử phạt vi phạm hành chính về trật tự, an toàn giao thông trong lĩnh vực giao thông đường bộ",
+    "Điều 6. Xử phạt người điều khiển xe ô tô vi phạm quy tắc giao thông đường bộ",
+    "1. Phạt tiền từ 400.000 đồng đến 600.000 đồng đối với người điều khiển xe thực hiện một trong các hành vi vi phạm sau đây:",
+    "a) Không chấp hành hiệu lệnh, chỉ dẫn của biển báo hiệu, vạch kẻ đường;",
+    "b) Không có báo hiệu xin vượt trước khi vượt;",
+    "2. Phạt tiền từ 18.000.000 đồng đến 20.000.000 đồng đối với người điều khiển xe ô tô không chấp hành hiệu lệnh của đèn tín hiệu giao thông (vượt đèn đỏ).",
+    "Điều 7. Xử phạt người điều khiển xe mô tô, xe gắn máy vi phạm quy tắc giao thông đường bộ",
+    "1. Phạt tiền từ 4.000.000 đồng đến 6.000.000 đồng đối với người điều khiển xe mô tô, xe gắn máy không chấp hành hiệu lệnh của đèn tín hiệu giao thông.",
+    "2. Phạt tiền từ 800.000 đồng đến 1.000.000 đồng đối với người điều khiển xe mô tô không đội mũ bảo hiểm.",
+]
+
+
+class HashEmbeddings(Embeddings):
+    """Embedding giả: bag-of-token băm vào 256 chiều (xác định, không cần model)."""
+
+    dim = 256
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            vector[int(hashlib.md5(token.encode()).hexdigest(), 16) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class _Tokenizer:
+    model_max_length = 512
+
+    def __call__(self, queries, docs, truncation=None, max_length=None):
+        return {"input_ids": [tokenize(q + " " + d)[:max_length] for q, d in zip(queries, docs)]}
+
+
+class OverlapCrossEncoder:
+    """Cross-encoder giả: điểm = tỉ lệ token của câu hỏi có trong đoạn văn."""
+
+    max_length = 512
+    tokenizer = _Tokenizer()
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        scores = []
+        for query, doc in pairs:
+            q, d = set(tokenize(query)), set(tokenize(doc))
+            scores.append(len(q & d) / (len(q) + 1))
+        return np.asarray(scores, dtype=np.float32)
+
+
+def law_documents(lines):
+    parser = VietnameseLawParser(cache_dir=None)
+    return list(iter_chunk_ids(parser._chunk_lines(lines, "Nghị định 168_2024_ND-CP.docx")))
+
+
+@pytest.fixture
+def index_env(tmp_path, monkeypatch):
+    """Snapshot index nhỏ (FAISS + BM25) trong tmp_path, model giả."""
+    import src.inference
+    import src.reranker
+
+    monkeypatch.setattr(src.inference, "load_embedding_backend", lambda backend=None: HashEmbeddings())
+    monkeypatch.setattr(src.reranker, "load_cross_encoder", lambda backend=None: OverlapCrossEncoder())
+    for name, value in {
+        "INDEX_DIR": str(tmp_path / "indexes"),
+        "SNAPSHOTS_DIR": str(tmp_path / "indexes" / "snapshots"),
+        "CURRENT_SNAPSHOT_PATH": str(tmp_path / "indexes" / "CURRENT"),
+        "QUERY_CACHE_PATH": str(tmp_path / "cache" / "query_cache.sqlite"),
+        "EMBEDDING_CACHE_DIR": None,
+        "VECTOR_BACKEND": "faiss",
+        "FAISS_INDEX_TYPE": "flat",
+        "MODEL_SERVER_URL": None,
+        "SNAPSHOT_POLL_INTERVAL": 0,
+    }.items():
+        monkeypatch.setattr(AppConfig, name, value)
+    (tmp_path / "indexes" / "snapshots").mkdir(parents=True)
+
+    from src.indexing import Indexer
+
+    def build(lines=LAW_LINES):
+        return Indexer().build_indices(iter(law_documents(lines)))
+
+    build()
+    return build
+
+
+@pytest.fixture
+def engine(index_env):
+    from src.rag_engine import TrafficLawRAG
+
+    bot = TrafficLawRAG(llm=StubLLM(), warmup=False)
+    yield bot
+    bot.close()
+
+
+@pytest.fixture
+def admission():
+    return Admission(max_active=1, max_queue=0, queue_timeout=1.0)
+
+
+@pytest.fixture
+def client(engine, admission):
+    with TestClient(create_app(engine=engine, admission=admission)) as client:
+        yield client
+
+
+def parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_chat_stream_event_order(client, engine, admission):
+    response = client.post("/chat", json={"question": QUESTION})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_sse(response.text)
+    kinds = [kind for kind, _ in events]
+    n_tokens = kinds.count("token")
+    assert n_tokens > 0
+    assert kinds == ["token"] * n_tokens + ["citations", "done"]
+
+    # StubLLM liệt kê đúng các nguồn [n] có trong CONTEXT
+    answer = "".join(data["text"] for kind, data in events if kind == "token")
+    citations = events[-2][1]["citations"]
+    assert citations
+    for source in citations:
+        assert source["chunk_id"].startswith("Nghị định 168_2024_ND-CP|")
+        assert source["content"]
+        assert source["score"] is not None
+    assert "Điều 6 Khoản 2" in answer
+    assert any(c["citation"].endswith("Điều 6 Khoản 2") for c in citations)
+    assert events[-1][1]["index_version"] == engine.index_version
+    assert admission.active == 0
+
+
+def test_chat_stream_answer_is_cached(client):
+    first = parse_sse(client.post("/chat", json={"question": QUESTION}).text)
+    second = parse_sse(client.post("/chat", json={"question": QUESTION + "  "}).text)
+    text = lambda events: "".join(d["text"] for k, d in events if k == "token")
+    assert text(second) == text(first)
+    # Lần hai đọc từ answer cache: cùng nguồn, cùng metadata
+    assert second[-2][1]["citations"] == first[-2][1]["citations"]
+
+
+def test_chat_without_stream(client, admission):
+    response = client.post("/chat", params={"stream": "false"}, json={"question": QUESTION})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["answer"].startswith("Câu hỏi: ")
+    assert any(c["citation"].endswith("Điều 6 Khoản 2") for c in body["citations"])
+    assert admission.active == 0
+
+
+def test_retrieve(client, engine):
+    response = client.post("/retrieve", json={"question": QUESTION, "filters": {}})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["index_version"] == engine.index_version
+    documents = body["documents"]
+    assert 0 < len(documents) <= AppConfig.RERANK_TOP_K
+    assert documents[0]["citation"].endswith("Điều 6 Khoản 2")
+    scores = [d["score"] for d in documents]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_retrieve_with_filter(client):
+    response = client.post(
+        "/retrieve", json={"question": QUESTION, "filters": {"vehicle": "xe_may"}}
+    )
+    assert response.status_code == 200
+    documents = response.json()["documents"]
+    assert documents
+    assert all(d["metadata"]["vehicle"] in ("xe_may", "") for d in documents)
+
+
+def test_reload_closes_previous_index_after_last_pin(engine, index_env):
+    old_version = engine.index_version
+    with engine.pin_index():
+        old = engine._active_index()
+        index_env(LAW_LINES[:-1])  # Snapshot mới: bỏ khoản cuối
+        assert engine.reload_index()
+        assert engine.index_version != old_version
+        # Request đang ghim vẫn đọc được bản cũ
+        assert engine.lexical_index is old.lexical_index
+        assert engine.lexical_index.search(QUESTION, 2)
+        assert old.answer_cache.get(QUESTION) is None
+    assert old.lexical_index._docs_file is None
+    assert old.vector_db._docs_file is None
+    with pytest.raises(sqlite3.ProgrammingError):
+        old.answer_cache.get(QUESTION)
+    assert engine.retrieve_hybrid(QUESTION)
+
+
+@pytest.mark.parametrize("path", ["/chat", "/retrieve"])
+def test_unknown_filter_field_is_422(client, admission, path):
+    response = client.post(path, json={"question": QUESTION, "filters": {"color": "red"}})
+    assert response.status_code == 422
+    assert "Unknown filter field" in response.json()["detail"]
+    assert admission.active == 0
+
+
+# --- Admission: engine giả, chỉ cần trả lời được ---
+class FakeEngine:
+    index_version = "test"
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.ready.set()
+        self.startup_error = None
+        self.tracer = Tracer([])
+
+    async def aretrieve_hybrid(self, query, filters=None):
+        return [Document(page_content="x", metadata={"citation": "X", "chunk_id": "x"})]
+
+    async def astream_chat(self, user_query, filters=None):
+        yield "token", "ok"
+        yield "sources", []
+
+
+@pytest.fixture
+def fake_client(admission):
+    with TestClient(create_app(engine=FakeEngine(), admission=admission)) as client:
+        yield client
+
+
+@pytest.mark.parametrize("path", ["/chat", "/retrieve"])
+def test_overflow_is_503(fake_client, admission, path):
+    asyncio.run(admission.acquire())  # Giữ slot duy nhất, hàng đợi = 0
+    try:
+        response = fake_client.post(path, json={"question": QUESTION})
+    finally:
+        admission.release()
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert admission.rejected == 1
+    assert fake_client.post(path, json={"question": QUESTION}).status_code == 200
+
+
+def test_stream_slot_released_when_client_disconnects_before_body(admission):
+    app = create_app(engine=FakeEngine(), admission=admission)
+    messages = [
+        {"type": "http.request", "body": json.dumps({"question": QUESTION}).encode(), "more_body": False}
+    ]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("client disconnected")
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/chat",
+        "raw_path": b"/chat",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    with pytest.raises(Exception):
+        asyncio.run(app(scope, receive, send))
+    assert admission.active == 0
+    assert not admission._slots.locked()
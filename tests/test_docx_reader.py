@@ -0,0 +1,20 @@
+import os
+import pytest
+from src.config import AppConfig
+from src.docx_reader import check_parity
+
+pytest.importorskip("docx", reason="python-docx là tham chiếu parity")
+
+
+def _raw_files():
+    if not os.path.isdir(AppConfig.DATA_RAW_DIR):
+        return []
+    return [f for f in os.listdir(AppConfig.DATA_RAW_DIR) if f.endswith(".docx")]
+
+
+@pytest.mark.skipif(not _raw_files(), reason="không có file .docx trong data/raw")
+def test_lxml_reader_matches_python_docx():
+    report = check_parity(AppConfig.DATA_RAW_DIR, repeat=1)
+    assert report["files"] == len(_raw_files())
+    assert report["paragraphs"] > 0 and report["chunks"] > 0
+    assert report["parity"], f"lệch với python-docx: {report['mismatched_files']}"